@@ -7,6 +7,9 @@ import gzip
 import requests
 import simplejson as json
 import functools
+import hashlib
+import itertools
+import threading
 import warnings
 import urllib.parse
 from time import time
@@ -29,6 +32,7 @@ from flask_jwt_extended import JWTManager
 # from sqlalchemy.pool import NullPool
 
 from util import elapsed
+from util import register_lazy_data
 from util import HTTPMethodOverrideMiddleware
 
 HEROKU_APP_NAME = "jump-api"
@@ -243,42 +247,185 @@ suny_consortium_package_ids = ["P2NFgz7B", "PN3juRC5", "2k4Qs74v", "uwdhDaJ2"]
 
 
 
-app.my_memorycache_dict = {}
+def estimate_size(value, sample_size=100, depth=0):
+    # bytes, roughly: sys.getsizeof of the value plus its contents.  big containers
+    # are sampled and extrapolated, so sizing a huge result stays cheap
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+    if hasattr(value, "memory_usage") and hasattr(value, "columns"):
+        # pandas
+        return int(value.memory_usage(deep=True).sum())
+    size = sys.getsizeof(value)
+    if depth > 10 or isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        num_items = len(value)
+        sample = list(itertools.islice(value.items(), sample_size))
+        sample_bytes = sum([estimate_size(k, sample_size, depth + 1) + estimate_size(v, sample_size, depth + 1) for (k, v) in sample])
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        num_items = len(value)
+        sample = list(itertools.islice(value, sample_size))
+        sample_bytes = sum([estimate_size(v, sample_size, depth + 1) for v in sample])
+    elif hasattr(value, "__dict__"):
+        # skip sqlalchemy state, it points at the whole session
+        sample = [v for (k, v) in vars(value).items() if not k.startswith("_sa_")]
+        num_items = len(sample)
+        sample_bytes = sum([estimate_size(v, sample_size, depth + 1) for v in sample])
+    else:
+        return size
+    if sample:
+        size += int(sample_bytes * num_items / float(len(sample)))
+    return size
+
+
+class MemoryCache(object):
+    # The store behind memorycache: LRU, bounded by estimated bytes, with per-entry
+    # ttls and hit/miss/size stats per function.  reset_cache in any process writes
+    # jump_cache_status; every process checks it now and then and drops what it names.
+
+    def __init__(self, max_bytes, default_ttl, reset_poll_seconds):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.reset_poll_seconds = reset_poll_seconds
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.lock = threading.RLock()
+        self.stats = {}
+        self.resets_checked_updated = None
+        self.resets_checked_time = 0
+
+    def function_stats(self, function_name):
+        if function_name not in self.stats:
+            self.stats[function_name] = OrderedDict([(k, 0) for k in ["hits", "misses", "entries", "bytes", "evictions", "expirations", "resets", "too_big"]])
+        return self.stats[function_name]
+
+    def get(self, key, function_name):
+        self.check_resets()
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry and entry["expires"] and entry["expires"] < time():
+                self.delete(key)
+                self.function_stats(function_name)["expirations"] += 1
+                entry = None
+            if not entry:
+                self.function_stats(function_name)["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.function_stats(function_name)["hits"] += 1
+            return entry["value"]
+
+    def set(self, key, function_name, value, ttl=None):
+        size = estimate_size(value)
+        if ttl is None:
+            ttl = self.default_ttl
+        with self.lock:
+            self.delete(key)
+            if size > self.max_bytes:
+                self.function_stats(function_name)["too_big"] += 1
+                return
+            self.entries[key] = {
+                "value": value,
+                "function_name": function_name,
+                "bytes": size,
+                "expires": time() + ttl if ttl else None
+            }
+            self.num_bytes += size
+            self.function_stats(function_name)["entries"] += 1
+            self.function_stats(function_name)["bytes"] += size
+            while self.num_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self.function_stats(self.entries[oldest_key]["function_name"])["evictions"] += 1
+                self.delete(oldest_key)
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if not entry:
+                return False
+            self.num_bytes -= entry["bytes"]
+            self.function_stats(entry["function_name"])["entries"] -= 1
+            self.function_stats(entry["function_name"])["bytes"] -= entry["bytes"]
+            return True
+
+    def reset(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry:
+                self.function_stats(entry["function_name"])["resets"] += 1
+                self.delete(key)
+
+    def check_resets(self):
+        if time() - self.resets_checked_time < self.reset_poll_seconds:
+            return
+        self.resets_checked_time = time()
+        rows = None
+        try:
+            with get_db_cursor() as cursor:
+                if self.resets_checked_updated:
+                    cursor.execute("select cache_call, updated from jump_cache_status where updated > %s", (self.resets_checked_updated,))
+                else:
+                    # first time: anything reset before now was reset before we cached it
+                    cursor.execute("select null as cache_call, max(updated) as updated from jump_cache_status")
+                rows = cursor.fetchall()
+        except Exception as e:
+            print("Error: couldn't check jump_cache_status: {}".format(e))
+        if not rows:
+            return
+        for row in rows:
+            if row["cache_call"]:
+                self.reset(row["cache_call"])
+        updated = [row["updated"] for row in rows if row["updated"]]
+        if updated:
+            self.resets_checked_updated = max(updated)
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict([
+                ("num_entries", len(self.entries)),
+                ("num_bytes", self.num_bytes),
+                ("max_bytes", self.max_bytes),
+                ("default_ttl", self.default_ttl),
+                ("reset_poll_seconds", self.reset_poll_seconds),
+                ("resets_checked_updated", self.resets_checked_updated.isoformat() if self.resets_checked_updated else None),
+                ("functions", OrderedDict(sorted(self.stats.items()))),
+            ])
+
+app.memorycache_store = MemoryCache(max_bytes=int(os.getenv("MEMORYCACHE_MAX_MB", 512)) * 1024 * 1024,
+                                    default_ttl=int(os.getenv("MEMORYCACHE_TTL_SECONDS", 6 * 60 * 60)),
+                                    reset_poll_seconds=int(os.getenv("MEMORYCACHE_RESET_POLL_SECONDS", 10)))
 
 def build_cache_key(module_name, function_name, *args):
     # just ignoring kwargs for now
     hashable_args = args
 
-    # Generate unique cache key
+    # Generate unique cache key, hashed so big args (like all the issns in a package) make small keys
     key_raw = (module_name, function_name, hashable_args)
-    cache_key = json.dumps(key_raw)
+    cache_key = hashlib.sha1(json.dumps(key_raw, default=str).encode("utf-8")).hexdigest()
     return cache_key
 
 
-def memorycache(func):
+def memorycache(func=None, ttl=None):
+    # use as @memorycache, or @memorycache(ttl=seconds) to override MEMORYCACHE_TTL_SECONDS
+    if func is None:
+        return functools.partial(memorycache, ttl=ttl)
+
+    function_name = "{}.{}".format(func.__module__, func.__name__)
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         cache_key = build_cache_key(func.__module__, func.__name__, *args)
 
         # Return cached version if available
-        result = app.my_memorycache_dict.get(cache_key, None)
+        result = app.memorycache_store.get(cache_key, function_name)
         if result is not None:
-            # print "cache hit on", cache_key
-            # print("cache hit")
             return result
 
-        # print("cache miss on", cache_key)
-        # print("cache miss")
-
         # Generate output
-        # print("> calling {}.{} with {}".format(func.__module__, func.__name__, args))
         result = func(*args)
 
         # Cache output if allowed
         if result is not None:
-            app.my_memorycache_dict[cache_key] = result
-
-        # reset_cache(func.__module__, func.__name__, *args)
+            app.memorycache_store.set(cache_key, function_name, result, ttl)
 
         return result
 
@@ -290,8 +437,7 @@ def reset_cache(module_name, function_name, *args):
     cache_key = build_cache_key(module_name, function_name, *args)
     print("cache_key", cache_key)
 
-    if cache_key in app.my_memorycache_dict:
-        del app.my_memorycache_dict[cache_key]
+    app.memorycache_store.reset(cache_key)
 
     delete_command = "delete from jump_cache_status where cache_call = %s"
     insert_command = "insert into jump_cache_status (cache_call, updated) values (%s, sysdate)"
@@ -301,7 +447,6 @@ def reset_cache(module_name, function_name, *args):
 
 cached_consortium_scenario_ids = ["tGUVWRiN", "scenario-QC2kbHfUhj9W", "EcUvEELe", "CBy9gUC3", "6it6ajJd", "GcAsm5CX", "aAFAuovt"]
 
-@memorycache
 def fetch_common_package_data():
     try:
         print("downloading common_package_data_for_all.json.gz")
@@ -316,24 +461,53 @@ def fetch_common_package_data():
     from common_data import gather_common_data
     return gather_common_data()
 
-common_data_dict = None
-
-def warm_common_data(lst):
-    lst.append(fetch_common_package_data())
-
-# NOTE: we have to do this when app loads for now - return to this later 
-## if there's a different take on dealing with common data
-# if os.getenv('PRELOAD_LARGE_TABLES', False) == 'True':
-if not common_data_dict:
-    import threading
-    import time
-    an_lst = []
-    t = threading.Thread(target=warm_common_data, args=[an_lst])
-    t.daemon = True
-    t.start()
-    while t.is_alive():
-        time.sleep(0.1)
-    common_data_dict = an_lst[0]
-    print("warm_common_data done!")
-else:
-    print("not warming common data cache")
+common_data_store_bucket = "unsub-cache"
+common_data_store_s3_prefix = "common_package_data_columnar"
+common_data_store_dir = os.getenv("COMMON_DATA_STORE_DIR", os.path.join("data", "common_package_data_columnar"))
+
+def open_common_data_store():
+    from common_data_store import CommonDataStore
+    from common_data_store import download_common_data_store
+    from common_data_store import latest_local_common_data_store
+
+    path = None
+    try:
+        path = download_common_data_store(s3_client, common_data_store_bucket, common_data_store_s3_prefix, common_data_store_dir)
+    except Exception as e:
+        print("couldn't get the columnar common data from S3.  Error message: ", e)
+        path = latest_local_common_data_store(common_data_store_dir)
+
+    if not path:
+        return None
+
+    try:
+        return CommonDataStore(path)
+    except Exception as e:
+        print("couldn't open the columnar common data in {}.  Error message: ".format(path), e)
+        return None
+
+def load_columnar_common_data():
+    # the CommonDataStore, or None when there's no columnar build
+    if os.getenv("COMMON_DATA_STORE", "True") != "True":
+        return None
+    my_common_data_store = open_common_data_store()
+    if my_common_data_store is not None:
+        print("opened columnar common data {}".format(my_common_data_store.build_id))
+    return my_common_data_store
+
+def load_common_data():
+    # a CommonDataStore when there's a columnar build, otherwise the dict from the json
+    if columnar_common_data.value is not None:
+        return columnar_common_data.value
+    return fetch_common_package_data()
+
+# loaded on first use, or in the background by web workers (see views.py)
+columnar_common_data = register_lazy_data("columnar_common_data", load_columnar_common_data)
+common_data = register_lazy_data("common_data", load_common_data)
+
+def common_data_version():
+    # the columnar build id. only the columnar store is opened, which just maps its
+    # files: the json has no version, and isn't worth loading to find that out.
+    if columnar_common_data.value is None:
+        return None
+    return columnar_common_data.value.build_id
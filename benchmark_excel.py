@@ -0,0 +1,118 @@
+import argparse
+import csv
+import datetime
+import os
+import random
+import tempfile
+from time import time
+
+import openpyxl
+import pyexcel
+from openpyxl.cell.read_only import EmptyCell
+
+from excel import convert_spreadsheet_to_csv
+
+
+# the conversion as it was: .xls re-saved as .xlsx with pyexcel, then every
+# cell of every row read with openpyxl, checking each cell for a formula
+def convert_spreadsheet_to_csv_cell_by_cell(spreadsheet):
+    if spreadsheet.endswith('.xls'):
+        xlsx_file_name = tempfile.mkstemp(suffix='.xlsx')[1]
+        pyexcel.save_book_as(file_name=spreadsheet, dest_file_name=xlsx_file_name)
+        spreadsheet = xlsx_file_name
+
+    workbook = openpyxl.load_workbook(open(spreadsheet, "rb"), read_only=True)
+
+    def truncate_row(row, n_empty=100):
+        count = 0
+        for i, cell in enumerate(row):
+            count = count + 1 if isinstance(cell, EmptyCell) else 0
+            if count == n_empty:
+                return row[:i - n_empty - 1]
+        return row
+
+    csv_file_names = []
+    for sheet_name in list(workbook.sheetnames):
+        sheet = workbook[sheet_name]
+        csv_file_name = tempfile.mkstemp()[1]
+        with open(csv_file_name, 'w', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file, delimiter=',')
+            for i, row in enumerate(sheet.iter_rows(min_row=1)):
+                if 'f' in [w.data_type for w in row]:
+                    raise RuntimeError('Uploaded files can not contain formulas')
+                writer.writerow([cell.value for cell in truncate_row(row)])
+        csv_file_names.append(csv_file_name)
+    return csv_file_names
+
+
+def synthetic_counter_rows(num_rows):
+    months = [datetime.datetime(2018, month, 1) for month in range(1, 13)]
+    yield ["Journal Report 1 (R4)", "Number of Successful Full-Text Article Requests by Month and Journal"]
+    yield ["Big University"]
+    yield []
+    yield ["Period covered by Report:"]
+    yield ["2018-01-01 to 2018-12-31"]
+    yield ["Date run:"]
+    yield [datetime.datetime(2019, 1, 15)]
+    yield ["Journal", "Publisher", "Platform", "Journal DOI", "Proprietary Identifier", "Print ISSN", "Online ISSN",
+           "Reporting Period Total", "Reporting Period HTML", "Reporting Period PDF"] + months
+    for i in range(num_rows):
+        by_month = [random.randint(0, 300) for month in months]
+        yield (["Journal of Things {}".format(i), "Publisher {}".format(i % 40), "Platform", "10.1000/{}".format(i), "",
+                "{:04d}-{:04d}".format(random.randint(0, 9999), random.randint(0, 9999)), "",
+                sum(by_month), random.randint(0, 100), random.randint(0, 100)] + by_month)
+
+
+def write_workbook(file_name, num_rows):
+    rows = list(synthetic_counter_rows(num_rows))
+    if file_name.endswith(".xls"):
+        pyexcel.save_as(array=rows, dest_file_name=file_name)
+    else:
+        # a regular workbook, like excel writes: shared strings and a <dimension>
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = "JR1"
+        for row in rows:
+            sheet.append(row)
+        workbook.save(file_name)
+
+
+def run(num_rows, suffixes):
+    random.seed(42)
+    for suffix in suffixes:
+        file_name = os.path.join(tempfile.gettempdir(), "benchmark_excel_{}.{}".format(num_rows, suffix))
+        write_workbook(file_name, num_rows)
+        print("{}: {} rows, {:.1f} MB".format(file_name, num_rows, os.path.getsize(file_name) / 1e6))
+
+        start_time = time()
+        new_csv_file_names = convert_spreadsheet_to_csv(file_name, parsed=False)
+        new_seconds = time() - start_time
+        print("  streaming:    {: >8.2f}s".format(new_seconds))
+
+        start_time = time()
+        old_csv_file_names = convert_spreadsheet_to_csv_cell_by_cell(file_name)
+        old_seconds = time() - start_time
+        print("  cell by cell: {: >8.2f}s".format(old_seconds))
+        print("  speedup:      {: >8.1f}x".format(old_seconds / max(new_seconds, 1e-9)))
+
+        for (new_csv_file_name, old_csv_file_name) in zip(new_csv_file_names, old_csv_file_names):
+            with open(new_csv_file_name) as new_csv_file, open(old_csv_file_name) as old_csv_file:
+                if new_csv_file.read() != old_csv_file.read():
+                    raise AssertionError("csvs differ for {}".format(file_name))
+        print("  csvs match")
+
+        for csv_file_name in new_csv_file_names + old_csv_file_names + [file_name]:
+            os.remove(csv_file_name)
+
+
+# python benchmark_excel.py --run
+# python benchmark_excel.py --run --rows 60000 --formats xlsx
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", help="Time spreadsheet to csv conversion on a synthetic counter workbook", action="store_true", default=False)
+    parser.add_argument("--rows", help="Rows in the synthetic workbook", type=int, default=60000)
+    parser.add_argument("--formats", help="Spreadsheet formats to try", nargs="+", default=["xlsx", "xls"])
+    parsed_args = parser.parse_args()
+
+    if parsed_args.run:
+        run(parsed_args.rows, parsed_args.formats)
@@ -0,0 +1,110 @@
+import argparse
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from scenario_engine import ranks_and_terciles
+
+fuzzed_columns = ["subscription_cost", "cost_subscription_minus_ill", "num_citations", "num_authorships", "use_total", "downloads_total", "cpu"]
+rank_columns = ["cpu", "old_school_cpu"]
+ranked_columns = fuzzed_columns + ["old_school_cpu"]
+
+
+class SyntheticJournal(object):
+    def __init__(self, issn_l, values):
+        self.issn_l = issn_l
+        for column, value in values.items():
+            setattr(self, column, value)
+
+
+# the lookups as they were, one DataFrame, rank and qcut per variable
+def fuzzed_lookup_pandas(journals, var):
+    df = pd.DataFrame({"issn_l": [j.issn_l for j in journals], "lookup_value": [getattr(j, var) for j in journals]})
+    df["ranked"] = df.lookup_value.rank(method='first', na_option="keep")
+    if df.dropna().empty:
+        return dict(list(zip(df["issn_l"], ["-"] * len(df))))
+    if (len(df) == 1):
+        return dict(list(zip(df["issn_l"], "-")))
+    return dict(list(zip(df.issn_l, pd.qcut(df.ranked,  3, labels=["low", "medium", "high"]))))
+
+
+def rank_lookup_pandas(journals, var):
+    df = pd.DataFrame({"issn_l": [j.issn_l for j in journals], "lookup_value": [getattr(j, var) for j in journals]})
+    df["rank"] = df.lookup_value.rank(method='first', na_option="keep")
+    return dict(list(zip(df.issn_l, df["rank"])))
+
+
+def lookups_pandas(journals):
+    response = dict((column, fuzzed_lookup_pandas(journals, column)) for column in fuzzed_columns)
+    response.update(dict(("{}_rank".format(column), rank_lookup_pandas(journals, column)) for column in rank_columns))
+    return response
+
+
+def lookups_argsort(issn_ls, columns):
+    (ranks, terciles) = ranks_and_terciles([columns[column] for column in ranked_columns])
+    response = dict((column, dict(list(zip(issn_ls, terciles[i].tolist())))) for i, column in enumerate(ranked_columns) if column in fuzzed_columns)
+    response.update(dict(("{}_rank".format(column), dict(list(zip(issn_ls, ranks[ranked_columns.index(column)].tolist())))) for column in rank_columns))
+    return response
+
+
+def make_columns(num_journals):
+    # lots of zero citations and authorships, like real packages, so ties matter
+    columns = {
+        "subscription_cost": np.round(np.random.gamma(2, 1500, num_journals)),
+        "num_citations": np.where(np.random.rand(num_journals) < 0.4, 0, np.round(np.random.gamma(1, 20, num_journals), 1)),
+        "num_authorships": np.where(np.random.rand(num_journals) < 0.6, 0, np.round(np.random.gamma(1, 2, num_journals), 1)),
+        "downloads_total": np.round(np.random.gamma(1, 400, num_journals)),
+    }
+    columns["subscription_cost"][np.random.rand(num_journals) < 0.1] = np.nan
+    columns["use_total"] = columns["downloads_total"] + 10 * columns["num_citations"] + 100 * columns["num_authorships"]
+    ill_cost = np.round(0.05 * columns["downloads_total"] * 17)
+    columns["cost_subscription_minus_ill"] = columns["subscription_cost"] - ill_cost
+    use_paywalled = np.round(columns["use_total"] * np.random.rand(num_journals))
+    columns["cpu"] = np.where(use_paywalled >= 1, np.round(columns["cost_subscription_minus_ill"] / np.maximum(use_paywalled, 1), 6), np.nan)
+    columns["old_school_cpu"] = np.where(columns["downloads_total"] >= 1, np.round(columns["subscription_cost"] / np.maximum(columns["downloads_total"], 1), 6), np.nan)
+    return columns
+
+
+def same_lookup(a, b):
+    return all(a[k] == b[k] or (a[k] != a[k] and b[k] != b[k]) for k in a) and set(a) == set(b)
+
+
+def run(num_journals, repeats):
+    np.random.seed(42)
+    columns = make_columns(num_journals)
+    issn_ls = ["{:04d}-{:04d}".format(i // 10000, i % 10000) for i in range(num_journals)]
+    journals = [SyntheticJournal(issn_l, dict((column, None if columns[column][i] != columns[column][i] else columns[column][i].item()) for column in ranked_columns))
+                for i, issn_l in enumerate(issn_ls)]
+    print("{} journals, {} fuzzed lookups and {} rank lookups".format(num_journals, len(fuzzed_columns), len(rank_columns)))
+
+    start_time = time()
+    for i in range(repeats):
+        pandas_lookups = lookups_pandas(journals)
+    pandas_seconds = (time() - start_time) / repeats
+    print("pandas:  {: >8.4f}s".format(pandas_seconds))
+
+    start_time = time()
+    for i in range(repeats):
+        argsort_lookups = lookups_argsort(issn_ls, columns)
+    argsort_seconds = (time() - start_time) / repeats
+    print("argsort: {: >8.4f}s".format(argsort_seconds))
+    print("speedup: {:.0f}x".format(pandas_seconds / max(argsort_seconds, 1e-9)))
+
+    for key in pandas_lookups:
+        if not same_lookup(pandas_lookups[key], argsort_lookups[key]):
+            raise AssertionError("pandas and argsort lookups differ for {}".format(key))
+    print("lookups match")
+
+
+# python benchmark_journal_ranks.py --run
+# python benchmark_journal_ranks.py --run --journals 20000 --repeats 3
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", help="Time the fuzzed and rank lookups over synthetic journals", action="store_true", default=False)
+    parser.add_argument("--journals", help="Journals in the scenario", type=int, default=5000)
+    parser.add_argument("--repeats", help="Times to run each, the average is reported", type=int, default=5)
+    parsed_args = parser.parse_args()
+
+    if parsed_args.run:
+        run(parsed_args.journals, parsed_args.repeats)
@@ -0,0 +1,142 @@
+import argparse
+import csv
+import os
+import random
+import re
+import tempfile
+from time import time
+
+from issn_index import IssnIndex
+from issn_index import clean_issn
+
+
+# the issn check as it was, against a list of every issn
+def normalize_issn_list_scan(issn, oa_issns):
+    if issn:
+        issn = issn.replace("issn:", "")
+        issn = re.sub(r"\s", "", issn).upper()
+        if re.match(r"^\d{4}-?\d{3}(?:X|\d)$", issn):
+            issn = issn.replace("-", "")
+            issn = issn[0:4] + "-" + issn[4:8]
+            if issn not in oa_issns:
+                return "unknown_issn"
+            return issn
+        elif re.match(r"^[A-Z0-9]{4}-\d{3}(?:X|\d)$", issn):
+            return "bundle_issn"
+        else:
+            return "bad_issn"
+    return None
+
+
+def normalize_issn_indexed(issn, my_issn_index):
+    if issn:
+        (issn_type, issn) = clean_issn(issn)
+        if issn_type == "issn":
+            if issn not in my_issn_index:
+                return "unknown_issn"
+            return issn
+        elif issn_type == "bundle":
+            return "bundle_issn"
+        else:
+            return "bad_issn"
+    return None
+
+
+def random_issn():
+    digits = "{:07d}".format(random.randint(0, 9999999))
+    return "{}-{}{}".format(digits[0:4], digits[4:7], random.choice("0123456789X"))
+
+
+def make_issn_index(num_issns):
+    issn_l_by_issn = {}
+    while len(issn_l_by_issn) < num_issns:
+        issn_l = random_issn()
+        issn_l_by_issn[issn_l] = issn_l
+        if random.random() < 0.6:
+            issn_l_by_issn[random_issn()] = issn_l
+    return IssnIndex(issn_l_by_issn)
+
+
+def messy(issn):
+    # the ways issns show up in counter and price files
+    choice = random.random()
+    if choice < 0.1:
+        return issn.replace("-", "")
+    if choice < 0.15:
+        return issn.lower()
+    if choice < 0.2:
+        return " {} ".format(issn)
+    if choice < 0.22:
+        return "issn:{}".format(issn)
+    return issn
+
+
+def write_synthetic_file(filename, num_rows, known_issns):
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Title", "Print ISSN", "Online ISSN", "Reporting_Period_Total"])
+        for i in range(num_rows):
+            choice = random.random()
+            if choice < 0.8:
+                print_issn = messy(random.choice(known_issns))
+            elif choice < 0.9:
+                print_issn = messy(random_issn())
+            elif choice < 0.93:
+                print_issn = "AB{}-{}".format(random.randint(10, 99), random.randint(1000, 9999))
+            elif choice < 0.96:
+                print_issn = "n/a"
+            else:
+                print_issn = ""
+            online_issn = messy(random.choice(known_issns)) if random.random() < 0.7 else ""
+            writer.writerow(["Journal {}".format(i), print_issn, online_issn, random.randint(0, 5000)])
+
+
+def read_issn_cells(filename):
+    with open(filename, newline="") as f:
+        reader = csv.DictReader(f)
+        return [(row["Print ISSN"], row["Online ISSN"]) for row in reader]
+
+
+def run(num_rows, num_issns, list_scan_rows):
+    random.seed(42)
+    my_issn_index = make_issn_index(num_issns)
+    known_issns = list(my_issn_index.issns)
+    oa_issns = list(known_issns)
+
+    filename = os.path.join(tempfile.gettempdir(), "benchmark_normalize_issn_{}.csv".format(num_rows))
+    write_synthetic_file(filename, num_rows, known_issns)
+    rows = read_issn_cells(filename)
+    print("{} rows, {} known issns, {}".format(len(rows), len(my_issn_index), filename))
+
+    start_time = time()
+    indexed = [[normalize_issn_indexed(cell, my_issn_index) for cell in row] for row in rows]
+    indexed_seconds = time() - start_time
+    print("indexed:   {: >8.3f}s for {} rows".format(indexed_seconds, len(rows)))
+
+    sample = rows[:list_scan_rows]
+    start_time = time()
+    list_scan = [[normalize_issn_list_scan(cell, oa_issns) for cell in row] for row in sample]
+    list_scan_seconds = time() - start_time
+    estimated_seconds = list_scan_seconds * len(rows) / max(len(sample), 1)
+    print("list scan: {: >8.3f}s for {} rows, so about {:.1f}s for {} rows".format(list_scan_seconds, len(sample), estimated_seconds, len(rows)))
+    print("speedup:   {:.0f}x".format(estimated_seconds / max(indexed_seconds, 1e-9)))
+
+    if list_scan != indexed[:len(sample)]:
+        raise AssertionError("indexed and list scan results differ")
+    print("results match on the {} sampled rows".format(len(sample)))
+
+    os.remove(filename)
+
+
+# python benchmark_normalize_issn.py --run
+# python benchmark_normalize_issn.py --run --rows 100000 --issns 200000 --list-scan-rows 500
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", help="Time normalize_issn over a synthetic counter file", action="store_true", default=False)
+    parser.add_argument("--rows", help="Rows in the synthetic file", type=int, default=100000)
+    parser.add_argument("--issns", help="Issns in the index", type=int, default=150000)
+    parser.add_argument("--list-scan-rows", help="Rows to time with the old list scan, which is too slow to run on all of them", type=int, default=500)
+    parsed_args = parser.parse_args()
+
+    if parsed_args.run:
+        run(parsed_args.rows, parsed_args.issns, parsed_args.list_scan_rows)
@@ -3,9 +3,14 @@ import argparse
 from collections import defaultdict
 import json
 import gzip
+import shutil
+import datetime
 
 from app import get_db_cursor
 from app import s3_client
+from app import common_data_store_bucket
+from app import common_data_store_s3_prefix
+from common_data_store import write_common_data_store
 
 def get_embargo_data_from_db():
     command = "select issn_l, embargo from journal_delayed_oa_active"
@@ -115,6 +120,31 @@ def upload_common_data():
         Bucket="unsub-cache", 
         Key="common_package_data_for_all.json.gz")
 
+    upload_common_data_store(data)
+
+def upload_common_data_store(data=None):
+    if data is None:
+        print("gathering data from database")
+        data = gather_common_data()
+
+    path = os.path.join("data", "common_package_data_columnar_build_{}".format(datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")))
+    print("writing columnar common data to {}".format(path))
+    manifest = write_common_data_store(data, path)
+
+    print("uploading {} files to S3".format(len(manifest["files"])))
+    for filename in manifest["files"]:
+        s3_client.upload_file(
+            Filename=os.path.join(path, filename),
+            Bucket=common_data_store_bucket,
+            Key="{}/{}/{}".format(common_data_store_s3_prefix, manifest["build_id"], filename))
+    # each build has its own keys and the manifest goes last, so workers never
+    # see a build that isn't all there
+    s3_client.upload_file(
+        Filename=os.path.join(path, "manifest.json"),
+        Bucket=common_data_store_bucket,
+        Key="{}/manifest.json".format(common_data_store_s3_prefix))
+
+    shutil.rmtree(path, ignore_errors=True)
     print("done!")
 
 # heroku local:run python common_data.py --run
@@ -122,7 +152,10 @@ def upload_common_data():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--run", help="Prepare common data and upload to S3", action="store_true", default=False)
+    parser.add_argument("--columnar", help="Prepare the columnar common data and upload to S3", action="store_true", default=False)
     parsed_args = parser.parse_args()
 
     if parsed_args.run:
         upload_common_data()
+    if parsed_args.columnar:
+        upload_common_data_store()
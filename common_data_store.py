@@ -0,0 +1,283 @@
+# Columnar, memory-mapped copy of the common package data (see common_data.py).
+#
+# On disk a build is a directory of .npy files plus a manifest.json:
+#
+#   issn_l.npy                  sorted issn_ls, shared by every table
+#   <table>.offsets.npy         rows of issn_l[i] are rows offsets[i]:offsets[i+1]
+#   <table>.<column>.npy        one array per column, rows grouped by issn_l
+#   <table>.<column>.null.npy   only when the column has nulls
+#
+# Arrays are opened with np.load(mmap_mode="r"), so every worker on a machine
+# shares the same pages of the os page cache instead of holding its own parsed
+# copy of the json.
+
+import os
+import json
+import shutil
+import tempfile
+import datetime
+from decimal import Decimal
+
+import numpy as np
+
+
+format_version = 1
+
+# name in the common data dict -> (file prefix, kind)
+# kind says how the rows of one issn_l are turned back into python:
+#   value    one row, the value itself
+#   row      one row, a dict of its columns
+#   rows     a list of dicts
+#   by_year  a dict from the "year" column to the "value" column
+common_data_tables = [
+    ("embargo_dict", "embargo", "value"),
+    ("unpaywall_downloads_dict_raw", "unpaywall_downloads", "row"),
+    ("social_networks", "social_networks", "value"),
+    ("society", "society", "value"),
+    ("num_papers", "num_papers", "by_year"),
+    ("oa.with_submitted_with_bronze", "oa.with_submitted_with_bronze", "rows"),
+    ("oa.with_submitted_no_bronze", "oa.with_submitted_no_bronze", "rows"),
+    ("oa.no_submitted_with_bronze", "oa.no_submitted_with_bronze", "rows"),
+    ("oa.no_submitted_no_bronze", "oa.no_submitted_no_bronze", "rows"),
+]
+
+
+def get_common_data_table(data, name):
+    if name.startswith("oa."):
+        return data["oa"][name.split(".", 1)[1]]
+    return data[name]
+
+
+def table_rows(table, kind):
+    # yields (issn_l, row dict) in the order they should be stored
+    for issn_l in sorted(table):
+        value = table[issn_l]
+        if kind == "value":
+            yield issn_l, {"value": value}
+        elif kind == "row":
+            if value:
+                yield issn_l, value
+        elif kind == "rows":
+            for row in value:
+                yield issn_l, row
+        elif kind == "by_year":
+            for year in sorted(value, key=int):
+                yield issn_l, {"year": int(year), "value": value[year]}
+
+
+def encode_column(values):
+    present = [v for v in values if v is not None]
+    nulls = np.array([v is None for v in values], dtype=bool)
+
+    if present and all(isinstance(v, (bool, np.bool_)) for v in present):
+        array = np.array([bool(v) if v is not None else False for v in values], dtype=bool)
+    elif present and all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in present):
+        array = np.array([v if v is not None else 0 for v in values], dtype=np.int64)
+    elif all(isinstance(v, (int, float, Decimal, np.number)) and not isinstance(v, bool) for v in present):
+        array = np.array([float(v) if v is not None else np.nan for v in values], dtype=np.float64)
+    else:
+        # same as the json cache, which is written with default=str
+        strings = [v if isinstance(v, str) else str(v) for v in present]
+        width = max([len(s) for s in strings] + [1])
+        array = np.array([(v if isinstance(v, str) else str(v)) if v is not None else "" for v in values], dtype="U{}".format(width))
+
+    return array, (nulls if nulls.any() else None)
+
+
+def write_common_data_store(data, path):
+    """Writes the common data dict (see common_data.gather_common_data) as a
+    columnar build in the directory `path`, which must not exist yet."""
+    tables = [(name, prefix, kind, get_common_data_table(data, name)) for (name, prefix, kind) in common_data_tables]
+
+    all_issn_ls = set()
+    for (name, prefix, kind, table) in tables:
+        all_issn_ls.update(table.keys())
+    issn_ls = sorted(all_issn_ls)
+    position_by_issn_l = dict((issn_l, i) for (i, issn_l) in enumerate(issn_ls))
+
+    os.makedirs(path)
+    files = []
+
+    def save(filename, array):
+        np.save(os.path.join(path, filename), array, allow_pickle=False)
+        files.append(filename)
+
+    save("issn_l.npy", np.array(issn_ls, dtype="U{}".format(max([len(i) for i in issn_ls] + [1]))))
+
+    manifest_tables = {}
+    for (name, prefix, kind, table) in tables:
+        counts = np.zeros(len(issn_ls), dtype=np.int64)
+        column_names = []
+        rows = []
+        for (issn_l, row) in table_rows(table, kind):
+            counts[position_by_issn_l[issn_l]] += 1
+            for column in row:
+                if column not in column_names:
+                    column_names.append(column)
+            rows.append(row)
+
+        offsets = np.zeros(len(issn_ls) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        save("{}.offsets.npy".format(prefix), offsets)
+
+        columns = {}
+        for column in column_names:
+            array, nulls = encode_column([row.get(column, None) for row in rows])
+            save("{}.{}.npy".format(prefix, column), array)
+            if nulls is not None:
+                save("{}.{}.null.npy".format(prefix, column), nulls)
+            columns[column] = {"dtype": array.dtype.str, "nulls": nulls is not None}
+
+        manifest_tables[name] = {"prefix": prefix, "kind": kind, "num_rows": len(rows), "columns": columns}
+
+    manifest = {
+        "format_version": format_version,
+        "build_id": datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S"),
+        "num_issn_ls": len(issn_ls),
+        "tables": manifest_tables,
+        "files": files,
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def download_common_data_store(s3_client, bucket, s3_prefix, local_dir):
+    """Makes sure the latest build in S3 is in `local_dir`/<build_id> and
+    returns that path.
+
+    Several workers may start at once: each downloads into its own temporary
+    directory and renames it into place, and the losers throw theirs away.
+    """
+    manifest_obj = s3_client.get_object(Bucket=bucket, Key="{}/manifest.json".format(s3_prefix))
+    manifest = json.loads(manifest_obj["Body"].read().decode("utf-8"))
+    if manifest.get("format_version") != format_version:
+        raise ValueError("common data store format {} is not {}".format(manifest.get("format_version"), format_version))
+
+    path = os.path.join(local_dir, manifest["build_id"])
+    if os.path.exists(os.path.join(path, "manifest.json")):
+        return path
+
+    os.makedirs(local_dir, exist_ok=True)
+    temp_path = tempfile.mkdtemp(dir=local_dir, prefix=".download-")
+    try:
+        for filename in manifest["files"]:
+            s3_client.download_file(Bucket=bucket, Key="{}/{}/{}".format(s3_prefix, manifest["build_id"], filename), Filename=os.path.join(temp_path, filename))
+        with open(os.path.join(temp_path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # another worker got there first
+            pass
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    # other workers may still have older builds mapped, which is fine on linux
+    for name in os.listdir(local_dir):
+        if name != manifest["build_id"] and not name.startswith("."):
+            shutil.rmtree(os.path.join(local_dir, name), ignore_errors=True)
+
+    return path
+
+
+def latest_local_common_data_store(local_dir):
+    if not os.path.isdir(local_dir):
+        return None
+    build_ids = sorted(name for name in os.listdir(local_dir)
+                       if not name.startswith(".") and os.path.exists(os.path.join(local_dir, name, "manifest.json")))
+    if not build_ids:
+        return None
+    return os.path.join(local_dir, build_ids[-1])
+
+
+class CommonDataStore(object):
+    """Read-only view of a columnar build. `table(name, issns)` returns the same
+    dict that `include_keys(common_data_dict[name], issns)` would, but only
+    turns the rows of the requested issn_ls into python objects."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") != format_version:
+            raise ValueError("common data store format {} is not {}".format(self.manifest.get("format_version"), format_version))
+
+        self.issn_l = self.load("issn_l.npy")
+        self.offsets = {}
+        self.columns = {}
+        self.nulls = {}
+        for (name, table) in self.manifest["tables"].items():
+            prefix = table["prefix"]
+            self.offsets[name] = self.load("{}.offsets.npy".format(prefix))
+            self.columns[name] = {}
+            self.nulls[name] = {}
+            for (column, column_info) in table["columns"].items():
+                self.columns[name][column] = self.load("{}.{}.npy".format(prefix, column))
+                if column_info["nulls"]:
+                    self.nulls[name][column] = self.load("{}.{}.null.npy".format(prefix, column))
+
+    def load(self, filename):
+        return np.load(os.path.join(self.path, filename), mmap_mode="r", allow_pickle=False)
+
+    @property
+    def build_id(self):
+        return self.manifest["build_id"]
+
+    def __contains__(self, name):
+        return name in self.manifest["tables"]
+
+    def positions(self, issns):
+        """Positions in self.issn_l of the issns that are in the store, and those issns."""
+        issns = np.array(sorted(set(issns or [])), dtype=str)
+        if not len(issns) or not len(self.issn_l):
+            return np.zeros(0, dtype=np.int64), []
+        positions = np.searchsorted(self.issn_l, issns)
+        positions = np.minimum(positions, len(self.issn_l) - 1)
+        found = self.issn_l[positions] == issns
+        return positions[found], issns[found].tolist()
+
+    def column_values(self, name, column, row_index):
+        values = self.columns[name][column][row_index].tolist()
+        if column in self.nulls[name]:
+            for i in np.flatnonzero(self.nulls[name][column][row_index]):
+                values[i] = None
+        return values
+
+    def table(self, name, issns):
+        kind = self.manifest["tables"][name]["kind"]
+        positions, issn_ls = self.positions(issns)
+        offsets = self.offsets[name]
+        starts = offsets[positions]
+        lengths = offsets[positions + 1] - starts
+
+        # indexes of all the rows of all the requested issn_ls, in one gather
+        total = int(lengths.sum())
+        row_index = np.arange(total, dtype=np.int64) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        columns = dict((column, self.column_values(name, column, row_index)) for column in self.columns[name])
+
+        response = {}
+        row = 0
+        for (issn_l, length) in zip(issn_ls, lengths.tolist()):
+            if not length:
+                continue
+            if kind == "value":
+                response[issn_l] = columns["value"][row]
+            elif kind == "row":
+                response[issn_l] = dict((column, values[row]) for (column, values) in columns.items())
+            elif kind == "rows":
+                response[issn_l] = [dict((column, values[i]) for (column, values) in columns.items())
+                                    for i in range(row, row + length)]
+            elif kind == "by_year":
+                response[issn_l] = dict(zip(columns["year"][row:row + length], columns["value"][row:row + length]))
+            row += length
+        return response
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "build_id": self.build_id,
+            "num_issn_ls": len(self.issn_l),
+            "num_rows": dict((name, table["num_rows"]) for (name, table) in self.manifest["tables"].items()),
+        }
@@ -4,20 +4,24 @@ from cached_property import cached_property
 from collections import defaultdict
 from collections import OrderedDict
 import datetime
-from multiprocessing.pool import ThreadPool
-import threading
-import weakref
+import hashlib
+import multiprocessing
+import os
 from time import time
+import numpy as np
+import pandas as pd
 import simplejson as json
 from simplejson import dumps
 from psycopg2 import sql
+from psycopg2.errors import UndefinedColumn
 from psycopg2.extras import execute_values
-from kids.cache import cache
 
 from app import app
 from app import get_db_cursor
 from app import reset_cache
 from consortium_journal import ConsortiumJournal
+from consortium_journal import aggregate_member_frame
+from consortium_journal import frame_values
 from package import Package
 from util import elapsed
 from util import chunks
@@ -47,7 +51,7 @@ def get_latest_member_institutions_raw(scenario_id):
 
     return scenario_members
 
-@cache
+@memorycache
 def get_consortium_ids():
     # consortium_ids is a materialized view
     with get_db_cursor() as cursor:
@@ -71,6 +75,42 @@ def consortium_get_computed_data(scenario_id):
     return response
 
 
+# the text columns of jump_scenario_computed repeat across members or journals,
+# so in the frame they're categoricals: one small int code per row
+consortium_computed_numeric_columns = ["usage", "cpu", "subscription_cost", "ill_cost", "use_instant_for_debugging",
+    "use_social_networks", "use_oa", "use_backfile", "use_subscription", "use_other_delayed", "use_ill",
+    "use_social_networks_percent", "use_green_percent", "use_hybrid_percent", "use_bronze_percent",
+    "use_peer_reviewed_percent", "downloads", "citations", "authorships"]
+
+
+@memorycache
+def consortium_get_computed_frame(scenario_id):
+    """jump_scenario_computed for a scenario as a pandas DataFrame, one row per
+    member x journal: float64 for the numbers, categoricals for the rest."""
+    start_time = time()
+    command = "select {} from jump_scenario_computed where scenario_id=%s".format(", ".join(consortium_computed_columns))
+    rows = []
+    with get_db_cursor(use_defaultcursor=True) as cursor:
+        cursor.execute(command, (scenario_id,))
+        rows = cursor.fetchall()
+
+    frame = pd.DataFrame.from_records(rows, columns=consortium_computed_columns)
+    for column in consortium_computed_columns:
+        if column in consortium_computed_numeric_columns:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce").astype(np.float64)
+        elif column != "updated":
+            frame[column] = frame[column].astype("category")
+    print("loaded {} member rows of {} into a frame, {} bytes, {}s".format(
+        len(frame), scenario_id, int(frame.memory_usage(deep=True).sum()), elapsed(start_time)))
+    return frame
+
+
+def frame_to_dicts(frame):
+    # rows as dicts, like consortium_get_computed_data
+    columns = {column: frame_values(frame[column]) for column in frame.columns}
+    return [dict(zip(columns.keys(), values)) for values in zip(*columns.values())]
+
+
 def consortium_get_issns(scenario_id):
     start_time = time()
 
@@ -82,6 +122,26 @@ def consortium_get_issns(scenario_id):
     return [row["issn_l"] for row in rows]
 
 
+def consortium_members_key(member_package_ids):
+    # the included-member list the saved journal aggregates were summed over
+    return hashlib.sha1(json.dumps(sorted(member_package_ids)).encode("utf-8")).hexdigest()
+
+
+def consortium_get_journal_aggregates(scenario_id, members_key):
+    rows = []
+    command = "select issn_l, aggregates from jump_scenario_computed_journal where scenario_id=%s and members_key=%s"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (scenario_id, members_key,))
+        rows = cursor.fetchall()
+
+    response = OrderedDict()
+    for row in rows:
+        # two readers can race to save the same aggregates; either copy will do
+        if row["issn_l"] not in response:
+            response[row["issn_l"]] = json.loads(row["aggregates"])
+    return response
+
+
 def big_deal_costs_for_members():
     start_time = time()
 
@@ -119,6 +179,121 @@ def jsonify_fast_no_sort_simple(*args, **kwargs):
               sort_keys=sort_keys)
 
 
+consortium_computed_columns = ["member_package_id","scenario_id","updated","issn_l","usage","cpu","package_id",
+    "consortium_name","institution_name","institution_short_name","institution_id","subject",
+    "era_subjects","is_society_journal","subscription_cost","ill_cost","use_instant_for_debugging",
+    "use_social_networks","use_oa","use_backfile","use_subscription","use_other_delayed","use_ill",
+    "perpetual_access_years","baseline_access","use_social_networks_percent","use_green_percent",
+    "use_hybrid_percent","use_bronze_percent","use_peer_reviewed_percent","bronze_oa_embargo_months",
+    "is_hybrid_2019","downloads","citations","authorships",]
+
+
+def get_consortium_rows_for_member(member_package_id, scenario_saved_dict, consortium_package_id, scenario_id, consortium_name):
+    # runs in the recompute worker processes, so it only takes plain values.
+    # the common data is a memory-mapped store, so the workers share its pages.
+    from scenario import Scenario
+
+    start_time = time()
+    with app.app_context():
+        my_live_scenario = Scenario(member_package_id, scenario_saved_dict, my_jwt=None)
+        command_list = [my_journal.to_values_journals_for_consortium() for my_journal in my_live_scenario.journals]
+
+    # to_values_journals_for_consortium leaves placeholders for the consortium values
+    placeholders = {"package_id": consortium_package_id, "scenario_id": scenario_id, "consortium_name": consortium_name}
+    rows = [tuple(placeholders[x] if isinstance(x, str) and x in placeholders else x for x in lst) for lst in command_list]
+    return member_package_id, rows, elapsed(start_time)
+
+
+def _get_consortium_rows_for_member_star(args):
+    # one bad member shouldn't stop the others, so errors come back as rows=None
+    start_time = time()
+    try:
+        return get_consortium_rows_for_member(*args)
+    except Exception as e:
+        print("In get_consortium_rows_for_member with Error: ", args[0], e)
+        return args[0], None, elapsed(start_time)
+
+
+def insert_consortium_rows(rows):
+    with get_db_cursor() as cursor:
+        qry = sql.SQL("INSERT INTO jump_scenario_computed ({}) VALUES %s").format(
+            sql.SQL(', ').join(map(sql.Identifier, consortium_computed_columns)))
+        execute_values(cursor, qry, rows, page_size=1000)
+
+
+def shard_member_package_ids(member_package_ids, shard, num_shards):
+    # stable across dynos: every dyno sorts the same list the same way
+    return [member_package_id for i, member_package_id in enumerate(sorted(member_package_ids)) if i % num_shards == shard]
+
+
+def recompute_num_workers():
+    return int(os.getenv("CONSORTIUM_RECOMPUTE_WORKERS", os.cpu_count() or 1))
+
+
+# bump this when the model changes, so every member is rebuilt once
+member_fingerprint_version = 1
+
+# configs that only feed scenario level totals, not the per-member rows
+configs_not_in_member_rows = ["cost_bigdeal", "description", "notes"]
+
+
+def get_member_fingerprint_inputs(member_package_ids):
+    """What each member's rows depend on, apart from the consortium configs:
+    its uploads (counter, price, perpetual access, filter) and the package and
+    institution values that end up in the rows."""
+    inputs = {member_package_id: {"uploads": [], "package": None} for member_package_id in member_package_ids}
+    if not member_package_ids:
+        return inputs
+
+    upload_rows = []
+    package_rows = []
+    with get_db_cursor() as cursor:
+        command = """select package_id, file, created, num_rows, error, to_delete_date
+            from jump_raw_file_upload_object
+            where package_id in %s and claimed_by is null"""
+        cursor.execute(command, (tuple(member_package_ids),))
+        upload_rows = cursor.fetchall()
+
+        command = """select p.package_id, p.currency, p.is_deleted, i.id as institution_id, i.display_name, i.old_username
+            from jump_account_package p
+            join jump_institution i on i.id = p.institution_id
+            where p.package_id in %s"""
+        cursor.execute(command, (tuple(member_package_ids),))
+        package_rows = cursor.fetchall()
+
+    for row in upload_rows:
+        inputs[row["package_id"]]["uploads"].append([row["file"], row["created"], row["num_rows"], row["error"], row["to_delete_date"]])
+    for row in package_rows:
+        inputs[row["package_id"]]["package"] = [row["currency"], row["is_deleted"], row["institution_id"], row["display_name"], row["old_username"]]
+    for member_inputs in inputs.values():
+        member_inputs["uploads"].sort(key=lambda upload: upload[0])
+    return inputs
+
+
+def get_journal_metadata_version():
+    """When the journal metadata behind member rows was last rebuilt: the
+    public prices come from journalsdb_computed and the titles, publishers and
+    concepts from openalex_computed, and both are recomputed as a whole."""
+    rows = []
+    with get_db_cursor() as cursor:
+        command = """select (select max(created) from journalsdb_computed) as journalsdb_created,
+            (select max(created) from openalex_computed) as openalex_created"""
+        cursor.execute(command)
+        rows = cursor.fetchall()
+    if not rows or rows[0]["journalsdb_created"] is None or rows[0]["openalex_created"] is None:
+        return None
+    return [rows[0]["journalsdb_created"], rows[0]["openalex_created"]]
+
+
+def member_fingerprint(member_inputs, configs, common_data_version, journal_metadata_version):
+    if common_data_version is None or journal_metadata_version is None:
+        # nothing to tell a new common data or metadata build from the old one
+        return None
+    fingerprint_configs = {key: value for key, value in (configs or {}).items() if key not in configs_not_in_member_rows}
+    fingerprint_data = [member_fingerprint_version, common_data_version, journal_metadata_version, fingerprint_configs, member_inputs]
+    return hashlib.sha1(json.dumps(fingerprint_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
 class Consortium(object):
     def __init__(self, scenario_id, package_id=None):
         self.scenario_id = None
@@ -141,10 +316,19 @@ class Consortium(object):
         from app import JISC_INSTITUTION_ID
         return (self.institution_id == JISC_INSTITUTION_ID)
 
+    @cached_property
+    def journal_member_frame(self):
+        return consortium_get_computed_frame(self.scenario_id)
+
+    @cached_property
+    def included_member_frame(self):
+        frame = self.journal_member_frame
+        return frame[frame["member_package_id"].isin(self.member_institution_included_list)]
+
     @cached_property
     def journal_member_data(self):
-        response = consortium_get_computed_data(self.scenario_id)
-        return response
+        # the included members' rows, as dicts
+        return frame_to_dicts(self.included_member_frame)
 
     @cached_property
     def member_institution_included_list(self):
@@ -192,13 +376,28 @@ class Consortium(object):
     @cached_property
     def update_percent_complete(self):
         if self.is_locked_pending_update:
-            command = "select count(distinct member_package_id) as num_members_done from jump_scenario_computed where scenario_id=%s"
+            num_members_done = None
+            rows = []
+            # recompute_journal_dicts counts members off as they finish
+            command = "select num_members_done from jump_scenario_computed_update_queue where completed is null and scenario_id=%s"
             with get_db_cursor() as cursor:
-                cursor.execute(command, (self.scenario_id,))
-                rows = cursor.fetchall()
-            if rows:
+                try:
+                    cursor.execute(command, (self.scenario_id,))
+                    rows = cursor.fetchall()
+                except UndefinedColumn:
+                    # the column hasn't been added (see docs/running-unsub.md), so count rows below
+                    rows = []
+            if rows and rows[0]["num_members_done"] is not None:
                 num_members_done = rows[0]["num_members_done"]
-                return 100 * float(num_members_done)/len(self.all_member_package_ids)
+            else:
+                command = "select count(distinct member_package_id) as num_members_done from jump_scenario_computed where scenario_id=%s"
+                with get_db_cursor() as cursor:
+                    cursor.execute(command, (self.scenario_id,))
+                    rows = cursor.fetchall()
+                if rows:
+                    num_members_done = rows[0]["num_members_done"]
+            if num_members_done is not None and self.all_member_package_ids:
+                return min(100.0, 100 * float(num_members_done)/len(self.all_member_package_ids))
         return None
 
     @cached_property
@@ -225,23 +424,22 @@ class Consortium(object):
         rows = self.journal_member_data
 
         response = []
-        members_to_export = self.member_institution_included_list
+        subscribed_by_consortium = set(self.scenario_saved_dict.get("subrs", [])) | set(self.scenario_saved_dict.get("customSubrs", []))
 
         for row in rows:
             issn_l = row["issn_l"]
             journal_metadata = self.my_package.get_journal_metadata(issn_l)
-            if row["member_package_id"] in members_to_export:
-                row["title"] = journal_metadata.title
-                row["issns"] = journal_metadata.display_issns
+            row["title"] = journal_metadata.title
+            row["issns"] = journal_metadata.display_issns
 
-                row["package_id"] = row["member_package_id"]
-                row["institution_code"] = row["package_id"].replace("package-solojiscels", "")
+            row["package_id"] = row["member_package_id"]
+            row["institution_code"] = row["package_id"].replace("package-solojiscels", "")
 
-                row["subscribed_by_consortium"] = (issn_l in self.scenario_saved_dict.get("subrs", [])) or (issn_l in self.scenario_saved_dict.get("customSubrs", []))
-                row["subscribed_by_member_institution"] = (row["member_package_id"], issn_l) in self.all_member_added_subscriptions
-                row["core_plus_for_member_institution"] = row["subscribed_by_consortium"] or row["subscribed_by_member_institution"]
+            row["subscribed_by_consortium"] = issn_l in subscribed_by_consortium
+            row["subscribed_by_member_institution"] = (row["member_package_id"], issn_l) in self.all_member_added_subscriptions
+            row["core_plus_for_member_institution"] = row["subscribed_by_consortium"] or row["subscribed_by_member_institution"]
 
-                response.append(row)
+            response.append(row)
 
         return response
 
@@ -253,7 +451,7 @@ class Consortium(object):
         }
         return response
 
-    def to_dict_journals(self):
+    def to_dict_journals(self, stream_journals=False):
         my_response = OrderedDict()
         my_response["meta"] = {'publisher_name': self.publisher,
                                           'institution_name': self.consortium_name,
@@ -266,10 +464,11 @@ class Consortium(object):
                                           'publisher_id': self.package_id}
         my_response["saved"] = self.scenario_saved_dict
 
-        start_time = time()
-        response_list = [j.to_dict_journals() for j in self.journals_sorted_cpu]
-
-        my_response["journals"] = response_list
+        if stream_journals:
+            # made one at a time while jsonify_streaming sends them
+            my_response["journals"] = (j.to_dict_journals() for j in self.journals_sorted_cpu)
+        else:
+            my_response["journals"] = [j.to_dict_journals() for j in self.journals_sorted_cpu]
         my_response["member_institutions"] = self.member_institution_included_list
         my_response["is_locked_pending_update"] = self.is_locked_pending_update
         my_response["update_notification_email"] = self.update_notification_email
@@ -298,6 +497,18 @@ class Consortium(object):
         with get_db_cursor() as cursor:
             cursor.execute(q)
 
+        q = """
+                insert into jump_scenario_computed_journal
+                (scenario_id, members_key, issn_l, aggregates, updated)
+                (
+                    select %s, members_key, issn_l, aggregates, updated
+                    from jump_scenario_computed_journal
+                    where scenario_id = %s
+                )
+            """
+        with get_db_cursor() as cursor:
+            cursor.execute(q, (new_scenario_id, self.scenario_id,))
+
     @cached_property
     def all_member_package_ids(self):
         q = "select member_package_id from jump_consortium_members where consortium_package_id=%s"
@@ -311,7 +522,7 @@ class Consortium(object):
 
     @cached_property
     def included_member_package_ids(self):
-        return uniquify_list([d["member_package_id"] for d in self.journal_member_data])
+        return [member_package_id for member_package_id in pd.unique(self.journal_member_frame["member_package_id"].astype(object))]
 
     def queue_for_recompute(self, email):
         num_member_institutions = len(self.all_member_package_ids)
@@ -327,78 +538,198 @@ class Consortium(object):
             cursor.execute(qry, values)
 
 
-    def recompute_journal_dicts(self):
+    def set_num_members_done(self, num_members_done):
+        command = "update jump_scenario_computed_update_queue set num_members_done=%s where scenario_id=%s and completed is null"
+        with get_db_cursor() as cursor:
+            try:
+                cursor.execute(command, (num_members_done, self.scenario_id,))
+            except UndefinedColumn:
+                # the column hasn't been added, update_percent_complete counts rows instead
+                pass
+
+    def get_member_fingerprints(self, member_package_ids):
+        from app import common_data_version
+
+        configs = (self.scenario_saved_dict or {}).get("configs", {})
+        version = common_data_version()
+        metadata_version = get_journal_metadata_version()
+        member_inputs = get_member_fingerprint_inputs(member_package_ids)
+        return {member_package_id: member_fingerprint(member_inputs[member_package_id], configs, version, metadata_version)
+                for member_package_id in member_package_ids}
+
+    def get_saved_member_fingerprints(self):
+        rows = []
+        with get_db_cursor() as cursor:
+            # only trust a fingerprint if the member's rows are still there
+            command = """select f.member_package_id, f.fingerprint
+                from jump_scenario_computed_fingerprint f
+                where f.scenario_id=%s
+                and f.member_package_id in (select distinct member_package_id from jump_scenario_computed where scenario_id=%s)"""
+            cursor.execute(command, (self.scenario_id, self.scenario_id,))
+            rows = cursor.fetchall()
+        return {row["member_package_id"]: row["fingerprint"] for row in rows}
+
+    def save_member_fingerprint(self, member_package_id, fingerprint):
+        with get_db_cursor() as cursor:
+            cursor.execute("delete from jump_scenario_computed_fingerprint where scenario_id=%s and member_package_id=%s",
+                           (self.scenario_id, member_package_id,))
+            if fingerprint:
+                cursor.execute("insert into jump_scenario_computed_fingerprint (scenario_id, member_package_id, fingerprint, updated) values (%s, %s, %s, sysdate)",
+                               (self.scenario_id, member_package_id, fingerprint,))
+
+    @cached_property
+    def included_members_key(self):
+        return consortium_members_key(self.member_institution_included_list)
 
-        # delete everything with this scenario_id first
-        q = "delete from jump_scenario_computed where scenario_id=%s"
+    def build_journal_aggregates(self):
+        start_time = time()
+        response = aggregate_member_frame(self.included_member_frame)
+        print("built journal aggregates for {}: {} journals, {} members, {}s".format(
+            self.scenario_id, len(response), len(self.member_institution_included_list), elapsed(start_time)))
+        return response
+
+    def save_journal_aggregates(self, aggregates_by_issn_l):
+        # only one included-member list is current, so this replaces any others
+        updated = datetime.datetime.utcnow()
+        rows = [(self.scenario_id, self.included_members_key, issn_l, dumps(aggregates, default=myconverter), updated)
+                for issn_l, aggregates in aggregates_by_issn_l.items()]
         with get_db_cursor() as cursor:
-            print(cursor.mogrify(q, (self.scenario_id,)))
-            cursor.execute(q, (self.scenario_id,))
+            cursor.execute("delete from jump_scenario_computed_journal where scenario_id=%s", (self.scenario_id,))
+            if rows:
+                qry = "insert into jump_scenario_computed_journal (scenario_id, members_key, issn_l, aggregates, updated) values %s"
+                execute_values(cursor, qry, rows, page_size=1000)
 
-        from scenario import Scenario
+    def delete_journal_aggregates(self):
+        with get_db_cursor() as cursor:
+            cursor.execute("delete from jump_scenario_computed_journal where scenario_id=%s", (self.scenario_id,))
 
-        if not hasattr(threading.current_thread(), "_children"):
-            threading.current_thread()._children = weakref.WeakKeyDictionary()
-        my_thread_pool = ThreadPool(1)
+    @cached_property
+    def journal_aggregates(self):
+        """One dict per journal, summed over the included members, see
+        aggregate_member_data. Recompute saves them; if the included-member
+        list has changed since, they're rebuilt from the member rows and saved
+        for next time."""
+        response = consortium_get_journal_aggregates(self.scenario_id, self.included_members_key)
+        if not response:
+            response = self.build_journal_aggregates()
+            # while a recompute is running the member rows are half done
+            if response and not self.is_locked_pending_update:
+                self.save_journal_aggregates(response)
+        return response
 
-        print("starting threads")
+    def recompute_journal_dicts(self, num_workers=None, shard=None, num_shards=None, force=False, cancel_event=None):
+        """Rebuilds this scenario's rows in jump_scenario_computed.
 
-        def get_insert_rows_for_member(member_package_id):
-            command_list = []
-            print("in get_insert_rows_for_member with", member_package_id, self.scenario_id)
-            try:
-                with app.app_context():
-                    print("len(app.my_memorycache_dict)", len(app.my_memorycache_dict))
-
-                    my_live_scenario = Scenario(member_package_id, self.scenario_saved_dict, my_jwt=None)
-                    command_list = [my_journal.to_values_journals_for_consortium() for my_journal in my_live_scenario.journals]
-
-                    # save all of these in the db
-                    print("now writing to db", member_package_id, self.scenario_id)
-
-                    start_time = time()
-
-                    cols = ["member_package_id","scenario_id","updated","issn_l","usage","cpu","package_id",
-                        "consortium_name","institution_name","institution_short_name","institution_id","subject",
-                        "era_subjects","is_society_journal","subscription_cost","ill_cost","use_instant_for_debugging",
-                        "use_social_networks","use_oa","use_backfile","use_subscription","use_other_delayed","use_ill",
-                        "perpetual_access_years","baseline_access","use_social_networks_percent","use_green_percent",
-                        "use_hybrid_percent","use_bronze_percent","use_peer_reviewed_percent","bronze_oa_embargo_months",
-                        "is_hybrid_2019","downloads","citations","authorships",]
-
-                    # use [:] to replace in place to keep same object id() (identity) & reduce memory
-                    for lst in command_list:
-                        lst[:] = [self.package_id if x=='package_id' else x for x in lst]
-                        lst[:] = [self.scenario_id if x=='scenario_id' else x for x in lst]
-                        lst[:] = [self.consortium_name if x=='consortium_name' else x for x in lst]
-                    
-                    # convert list to tuples, as required by psycopg2
-                    command_list = [tuple(w) for w in command_list]
-
-                    with get_db_cursor() as cursor:
-                        qry = sql.SQL("INSERT INTO jump_scenario_computed ({}) VALUES %s").format(
-                            sql.SQL(', ').join(map(sql.Identifier, cols)))
-                        execute_values(cursor, qry, command_list, page_size=1000)
-
-                    print((elapsed(start_time)))
-                    print("done writing to db", member_package_id, self.scenario_id)
-
-            except Exception as e:
-                print("In get_insert_rows_for_member with Error: ", e)
-                raise
-            return command_list
-
-        results = my_thread_pool.imap_unordered(get_insert_rows_for_member, self.all_member_package_ids)
-        my_thread_pool.close()
-        my_thread_pool.join()
-        my_thread_pool.terminate()
-        print("done with threads")
+        Members are computed in a pool of `num_workers` processes (one core
+        each) and each member's rows are inserted as soon as it finishes, so the
+        dashboard's update_percent_complete moves as they come in. With `shard`
+        and `num_shards` this only does its share of the members, so several
+        dynos can split a big consortium between them.
+
+        Members whose inputs haven't changed since their rows were written
+        (see member_fingerprint) keep their rows, unless `force`. Setting
+        `cancel_event` (a threading.Event) stops it after the member in hand;
+        the members already written keep their rows and fingerprints. Returns
+        a report of what was rebuilt and skipped.
+        """
+        start_time = time()
+        num_workers = num_workers or recompute_num_workers()
+        member_package_ids = self.all_member_package_ids
+        if num_shards:
+            member_package_ids = shard_member_package_ids(member_package_ids, shard, num_shards)
+
+        fingerprints = self.get_member_fingerprints(member_package_ids)
+        saved_fingerprints = {} if force else self.get_saved_member_fingerprints()
+        skipped_member_package_ids = [member_package_id for member_package_id in member_package_ids
+                                      if fingerprints[member_package_id] and saved_fingerprints.get(member_package_id) == fingerprints[member_package_id]]
+        skipped = set(skipped_member_package_ids)
+        rebuild_member_package_ids = [member_package_id for member_package_id in member_package_ids if member_package_id not in skipped]
+        print("skipping {} of {} members of {}, their inputs haven't changed".format(
+            len(skipped_member_package_ids), len(member_package_ids), self.scenario_id))
+
+        # delete the rows of the members being rebuilt, and of anyone who isn't a member any more
+        self.delete_journal_aggregates()
+        with get_db_cursor() as cursor:
+            if rebuild_member_package_ids:
+                q = "delete from jump_scenario_computed where scenario_id=%s and member_package_id in %s"
+                cursor.execute(q, (self.scenario_id, tuple(rebuild_member_package_ids),))
+            if not num_shards:
+                if self.all_member_package_ids:
+                    q = "delete from jump_scenario_computed where scenario_id=%s and member_package_id not in %s"
+                    cursor.execute(q, (self.scenario_id, tuple(self.all_member_package_ids),))
+                else:
+                    q = "delete from jump_scenario_computed where scenario_id=%s"
+                    cursor.execute(q, (self.scenario_id,))
+
+        scenario_saved_dict = self.scenario_saved_dict
+        member_args = [(member_package_id, scenario_saved_dict, self.package_id, self.scenario_id, self.consortium_name)
+                       for member_package_id in rebuild_member_package_ids]
+
+        print("recomputing {} members of {} with {} workers".format(len(member_args), self.scenario_id, num_workers))
+        pool = None
+        if num_workers > 1 and len(member_args) > 1:
+            # spawn, not fork: each worker needs its own database connections
+            pool = multiprocessing.get_context("spawn").Pool(min(num_workers, len(member_args)), maxtasksperchild=25)
+            results = pool.imap_unordered(_get_consortium_rows_for_member_star, member_args, chunksize=1)
+        else:
+            results = map(_get_consortium_rows_for_member_star, member_args)
+
+        num_members_done = len(skipped_member_package_ids)
+        failed_member_package_ids = []
+        cancelled = False
+        if not num_shards:
+            self.set_num_members_done(num_members_done)
+        try:
+            for (member_package_id, rows, member_seconds) in results:
+                insert_start_time = time()
+                if rows is None:
+                    failed_member_package_ids.append(member_package_id)
+                else:
+                    if rows:
+                        insert_consortium_rows(rows)
+                    self.save_member_fingerprint(member_package_id, fingerprints[member_package_id])
+                num_members_done += 1
+                if not num_shards:
+                    # sharded runs share the queue row, so they leave progress to the row count
+                    self.set_num_members_done(num_members_done)
+                print("recomputed {} for {}: {} rows, {}s to compute, {}s to write, {}/{} members done".format(
+                    member_package_id, self.scenario_id, len(rows or []), member_seconds, elapsed(insert_start_time),
+                    num_members_done, len(member_package_ids)))
+                if cancel_event is not None and cancel_event.is_set():
+                    cancelled = True
+                    break
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        report = OrderedDict()
+        report["scenario_id"] = self.scenario_id
+        report["num_members"] = len(member_package_ids)
+        report["cancelled"] = cancelled
+        report["num_rebuilt"] = num_members_done - len(skipped_member_package_ids) - len(failed_member_package_ids)
+        report["num_skipped"] = len(skipped_member_package_ids)
+        report["num_failed"] = len(failed_member_package_ids)
+        report["skipped_member_package_ids"] = skipped_member_package_ids
+        report["failed_member_package_ids"] = failed_member_package_ids
+        report["seconds"] = elapsed(start_time)
+        print("{} recomputing {}: {} members, {} rebuilt, {} skipped as unchanged, {} failed {}, {}s".format(
+            "cancelled" if cancelled else "done",
+            self.scenario_id, report["num_members"], report["num_rebuilt"], report["num_skipped"],
+            report["num_failed"], failed_member_package_ids, report["seconds"]))
 
         # clear cache
         print("clearing cache")
         reset_cache("consortium", "consortium_get_computed_data", self.scenario_id)
+        reset_cache("consortium", "consortium_get_computed_frame", self.scenario_id)
         print("cache clear set")
 
+        # sharded runs only have their share of the members; the first read builds them instead
+        if not cancelled and not num_shards:
+            self.save_journal_aggregates(self.build_journal_aggregates())
+
+        return report
+
     def to_dict_journal_zoom(self, issn_l):
         start_time = time()
 
@@ -430,21 +761,10 @@ class Consortium(object):
     def journals(self):
         start_time = time()
 
-        issn_ls = consortium_get_issns(self.scenario_id)
-        start_time = time()
-        journals_dicts_by_issn_l = defaultdict(list)
-
-        rows = self.journal_member_data
-
-        for d in rows:
-            if d["member_package_id"] in self.member_institution_included_list:
-                journals_dicts_by_issn_l[d["issn_l"]].append(d)
-
-        start_time = time()
+        # one saved row per journal; the member rows are only read for the zoom and exports
         journal_list = []
-        for issn_l in issn_ls:
-            if len(journals_dicts_by_issn_l[issn_l]) > 0:
-                journal_list.append(ConsortiumJournal(issn_l, self.member_institution_included_list, journals_dicts_by_issn_l[issn_l], self.is_jisc, self.my_package))
+        for issn_l, aggregates in self.journal_aggregates.items():
+            journal_list.append(ConsortiumJournal(issn_l, self.member_institution_included_list, None, self.is_jisc, self.my_package, aggregates=aggregates))
 
         for my_journal in journal_list:
             if my_journal.issn_l in self.scenario_saved_dict.get("subrs", []):
@@ -464,17 +784,43 @@ class Consortium(object):
 
         return journal_list
 
+    @cached_property
+    def feedback_rows_by_member_package_id(self):
+        rows_for_feedback = []
+        command = "select * from jump_consortium_feedback_requests where consortium_scenario_id=%s"
+        with get_db_cursor() as cursor:
+            cursor.execute(command, (self.scenario_id,))
+            rows_for_feedback = cursor.fetchall()
+        # a later row for the same member wins, as it did in the old nested loop
+        return {row["member_package_id"]: row for row in rows_for_feedback}
+
+    @cached_property
+    def member_feedback_scenarios(self):
+        # the latest saved scenario of every member's feedback copy, in one query
+        from saved_scenario import get_latest_scenarios_raw
+        member_scenario_ids = [row["member_scenario_id"] for row in self.feedback_rows_by_member_package_id.values()]
+        return get_latest_scenarios_raw(member_scenario_ids, exclude_added_via_pushpull=True)
+
+    def member_added_subrs(self, member_package_id):
+        row_for_feedback = self.feedback_rows_by_member_package_id.get(member_package_id, None)
+        if not row_for_feedback:
+            return []
+        (updated, scenario_data) = self.member_feedback_scenarios[row_for_feedback["member_scenario_id"]]
+        if not scenario_data:
+            return []
+        return scenario_data.get("member_added_subrs", [])
+
     @cached_property
     def all_member_added_subscriptions(self):
-        institution_dicts = self.to_dict_institutions()
-        response = []
-        for my_dict in institution_dicts:
-            for my_issn in my_dict.get("member_added_subrs", []):
-                response.append((my_dict["package_id"], my_issn))
+        # a set, for the membership test on every exported row
+        response = set()
+        if self.scenario_id is not None:
+            for member_package_id in self.feedback_rows_by_member_package_id:
+                for my_issn in self.member_added_subrs(member_package_id):
+                    response.add((member_package_id, my_issn))
         return response
 
     def to_dict_institutions(self):
-        from saved_scenario import get_latest_scenario_raw
         start_time = time()
 
         command = """with tags as (select institution_id, listagg(tag_string, ', ') as tag_listagg from jump_tag_institution group by institution_id)
@@ -494,28 +840,23 @@ class Consortium(object):
             group by s.member_package_id
             order by usage desc
              """
+        rows = []
         with get_db_cursor(use_realdictcursor=True) as cursor:
             cursor.execute(command, (self.scenario_id,))
             rows = cursor.fetchall()
 
-        command = "select * from jump_consortium_feedback_requests where consortium_scenario_id=%s"
-        with get_db_cursor() as cursor:
-            cursor.execute(command, (self.scenario_id,))
-            rows_for_feedback = cursor.fetchall()
-
         if self.scenario_id is not None:
+            included = set(self.member_institution_included_list)
             for row in rows:
-                if row["package_id"] in self.member_institution_included_list:
+                if row["package_id"] in included:
                     row["included"] = True
-                for row_for_feedback in rows_for_feedback:
-                    if row_for_feedback["member_package_id"] == row["package_id"]:
-                        row["sent_date"] = row_for_feedback["sent_date"]
-                        row["return_date"] = row_for_feedback["return_date"]
-                        (updated, scenario_data) = get_latest_scenario_raw(row_for_feedback["member_scenario_id"], exclude_added_via_pushpull=True)
-                        row["changed_date"] = updated
-                        row["member_added_subrs"] = []
-                        if scenario_data:
-                            row["member_added_subrs"] = scenario_data.get("member_added_subrs", [])
+                row_for_feedback = self.feedback_rows_by_member_package_id.get(row["package_id"], None)
+                if row_for_feedback:
+                    row["sent_date"] = row_for_feedback["sent_date"]
+                    row["return_date"] = row_for_feedback["return_date"]
+                    (updated, scenario_data) = self.member_feedback_scenarios[row_for_feedback["member_scenario_id"]]
+                    row["changed_date"] = updated
+                    row["member_added_subrs"] = self.member_added_subrs(row["package_id"])
 
         return rows
 
@@ -1,7 +1,9 @@
 # coding: utf-8
 
+import os
 import random
 import datetime
+import threading
 from time import time
 from time import sleep
 
@@ -9,78 +11,247 @@ import argparse
 
 from app import get_db_cursor
 from consortium import Consortium
+from consortium import recompute_num_workers
 from emailer import send_email
 from util import elapsed
 
+# a job's priority is how long it has waited, discounted by its size: a
+# consortium with this many members has to wait twice as long as a tiny one
+priority_member_scale = 50
 
-def consortium_calculate():
-    # command = "truncate jump_scenario_computed_update_queue"
-    # print command
-    # with get_db_cursor() as cursor:
-    #    cursor.execute(command)
+# a run that raises, or leaves members failed, is tried again after
+# retry_seconds, doubling each time, and given up on after max_attempts
+max_attempts = 4
+retry_seconds = 60
 
 
-    while True:
-        command = "select * from jump_scenario_computed_update_queue where completed is null order by random()"
-        # print command
-        with get_db_cursor() as cursor:
-            cursor.execute(command)
-            rows = cursor.fetchall()
+class RecomputeJob(object):
+    """Everything queued for one scenario in jump_scenario_computed_update_queue.
+    Duplicate requests are coalesced into one recompute, and every requester
+    gets the done email."""
 
-        for row in rows:
-            start_time = time()
-            print("in consortium_calculate, starting recompute_journal_dicts for scenario_id {}".format(
-                row["scenario_id"]))
+    def __init__(self, scenario_id, queue_rows):
+        self.scenario_id = scenario_id
+        self.queue_rows = queue_rows
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.report = None
+        self.start_time = None
 
-            my_consortium = Consortium(row["scenario_id"])
-            my_consortium.recompute_journal_dicts()
+    @property
+    def requested_at(self):
+        # the newest request; anything after this needs another run
+        return max(row["created"] for row in self.queue_rows)
 
-            print("in consortium_calculate, done recompute_journal_dicts for scenario_id {} took {}s".format(
-                row["scenario_id"], elapsed(start_time)))
+    @property
+    def first_requested_at(self):
+        return min(row["created"] for row in self.queue_rows)
 
-            print("updating jump_scenario_computed_update_queue with completed")
+    @property
+    def num_members(self):
+        return max(row["num_member_institutions"] or 0 for row in self.queue_rows)
 
-            command = "update jump_scenario_computed_update_queue set completed=sysdate where scenario_id='{}' and completed is null".format(
-                row["scenario_id"])
+    @property
+    def emails(self):
+        return sorted(set(row["email"] for row in self.queue_rows if row["email"]))
 
-            # print command
-            with get_db_cursor() as cursor:
-                cursor.execute(command)
+    def priority(self, now):
+        age_seconds = (now - self.first_requested_at).total_seconds()
+        return age_seconds / (1 + float(self.num_members) / priority_member_scale)
 
-            if row["email"]:
-                print("SENDING EMAIL")
-                send_email(
-                    to_address=row["email"],
-                    subject='Unsub update complete',
-                    template_name='update_done',
-                    template_data={
-                        'data': {
-                             'consortium_name': row.get("consortium_name", ""),
-                             'package_name': row.get("package_name", ""),
-                             'start_time': row.get("created", ""),
-                             'end_time': datetime.datetime.utcnow().isoformat(),
-                             'institution_id': row.get("institution_id", ""),
-                             'package_id': row.get("package_id", ""),
-                             'scenario_id': row["scenario_id"]
-                        }
-                    },
-                    for_real=True
-                )
-                print("SENT EMAIL DONE")
+    def cancel(self):
+        self.cancel_event.set()
 
-            print("DONE UPDATING", row["scenario_id"])
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
 
-        sleep( 2 * random.random())
+    def __repr__(self):
+        return "<{} {} ({} requests, {} members)>".format(
+            self.__class__.__name__, self.scenario_id, len(self.queue_rows), self.num_members)
+
+
+def get_pending_jobs():
+    command = "select * from jump_scenario_computed_update_queue where completed is null"
+    rows = []
+    with get_db_cursor() as cursor:
+        cursor.execute(command)
+        rows = cursor.fetchall()
+
+    rows_by_scenario_id = {}
+    for row in rows:
+        if row["created"] is None:
+            continue
+        rows_by_scenario_id.setdefault(row["scenario_id"], []).append(row)
+    return {scenario_id: RecomputeJob(scenario_id, queue_rows) for scenario_id, queue_rows in rows_by_scenario_id.items()}
+
+
+def mark_completed(job):
+    # only the requests this run covered; newer ones stay queued
+    command = "update jump_scenario_computed_update_queue set completed=sysdate where scenario_id=%s and completed is null and created <= %s"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (job.scenario_id, job.requested_at,))
+
+
+def mark_failed(job, error):
+    # completed too, so the consortium isn't left locked as pending an update
+    command = "update jump_scenario_computed_update_queue set completed=sysdate, failed=sysdate, error=%s where scenario_id=%s and completed is null and created <= %s"
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (error[:65535], job.scenario_id, job.requested_at,))
+
+
+def send_done_emails(job, failed=False):
+    row = sorted(job.queue_rows, key=lambda r: r["created"])[-1]
+    for email in job.emails:
+        print("SENDING EMAIL")
+        send_email(
+            to_address=email,
+            subject='Unsub update failed' if failed else 'Unsub update complete',
+            template_name='update_failed' if failed else 'update_done',
+            template_data={
+                'data': {
+                     'consortium_name': row.get("consortium_name", ""),
+                     'package_name': row.get("package_name", ""),
+                     'start_time': row.get("created", ""),
+                     'end_time': datetime.datetime.utcnow().isoformat(),
+                     'institution_id': row.get("institution_id", ""),
+                     'package_id': row.get("package_id", ""),
+                     'scenario_id': row["scenario_id"]
+                }
+            },
+            for_real=True
+        )
+        print("SENT EMAIL DONE")
+
+
+def run_job(job, num_workers):
+    job.start_time = time()
+    print("in consortium_calculate, starting recompute_journal_dicts for {}".format(job))
+
+    my_consortium = Consortium(job.scenario_id)
+    job.report = my_consortium.recompute_journal_dicts(num_workers=num_workers, cancel_event=job.cancel_event)
+
+    if job.report["cancelled"]:
+        print("in consortium_calculate, cancelled recompute_journal_dicts for scenario_id {} after {}s, there's a newer request".format(
+            job.scenario_id, elapsed(job.start_time)))
+        return
+
+    print("in consortium_calculate, done recompute_journal_dicts for scenario_id {} took {}s, {} of {} members skipped as unchanged".format(
+        job.scenario_id, elapsed(job.start_time), job.report["num_skipped"], job.report["num_members"]))
+
+    if job.report["num_failed"]:
+        # the retry skips the members that were written
+        raise RuntimeError("{} of {} members failed: {}".format(
+            job.report["num_failed"], job.report["num_members"], job.report["failed_member_package_ids"]))
+
+    print("updating jump_scenario_computed_update_queue with completed")
+    mark_completed(job)
+    send_done_emails(job)
+    print("DONE UPDATING", job.scenario_id)
+
+
+class RecomputeScheduler(object):
+    """Runs queued consortium recomputes, up to `max_concurrent` at once.
+
+    Each poll coalesces the queue by scenario, cancels a running recompute if
+    its scenario has been queued again since it started (the rerun skips the
+    members it already finished, see Consortium.recompute_journal_dicts), and
+    starts the waiting jobs with the highest priority. Each job gets its share
+    of the recompute worker processes. A run that raises or leaves members
+    failed is retried with backoff, then marked failed in the queue.
+    """
+
+    def __init__(self, max_concurrent=2, poll_seconds=2, num_workers=None):
+        self.max_concurrent = max_concurrent
+        self.poll_seconds = poll_seconds
+        self.num_workers_per_job = max(1, (num_workers or recompute_num_workers()) // max_concurrent)
+        self.running = {}
+        # scenario_id -> {"requested_at", "num_attempts", "retry_at"} for runs that failed and will be retried
+        self.failed = {}
+
+    def run_job_thread(self, job):
+        try:
+            run_job(job, self.num_workers_per_job)
+            self.failed.pop(job.scenario_id, None)
+        except Exception as e:
+            print("Error: exception {} during consortium_calculate for {}".format(e, job))
+            self.job_failed(job, e)
+
+    def job_failed(self, job, error):
+        previous = self.failed.get(job.scenario_id)
+        num_attempts = 1
+        if previous and previous["requested_at"] >= job.requested_at:
+            num_attempts = previous["num_attempts"] + 1
+
+        # kept until the queue rows are marked, so a run that can't be marked failed still backs off
+        retry_in = retry_seconds * 2 ** (num_attempts - 1)
+        self.failed[job.scenario_id] = {"requested_at": job.requested_at, "num_attempts": num_attempts, "retry_at": time() + retry_in}
+
+        if num_attempts < max_attempts:
+            print("in consortium_calculate, retrying {} in {}s, attempt {} of {}".format(job, retry_in, num_attempts + 1, max_attempts))
+            return
+
+        print("in consortium_calculate, giving up on {} after {} attempts".format(job, num_attempts))
+        mark_failed(job, "{}: {}".format(type(error).__name__, error))
+        self.failed.pop(job.scenario_id, None)
+        send_done_emails(job, failed=True)
+
+    def is_waiting_to_retry(self, job):
+        # a newer request doesn't wait for the retry
+        failed_run = self.failed.get(job.scenario_id)
+        return failed_run is not None and failed_run["requested_at"] >= job.requested_at and failed_run["retry_at"] > time()
+
+    def reap(self):
+        for scenario_id, job in list(self.running.items()):
+            if not job.is_running:
+                del self.running[scenario_id]
+
+    def poll(self):
+        self.reap()
+        pending = get_pending_jobs()
+
+        for scenario_id, job in self.running.items():
+            pending_job = pending.get(scenario_id)
+            if pending_job and pending_job.requested_at > job.requested_at and not job.cancel_event.is_set():
+                print("in consortium_calculate, cancelling {}, it was queued again".format(job))
+                job.cancel()
+
+        waiting = [job for scenario_id, job in pending.items()
+                   if scenario_id not in self.running and not self.is_waiting_to_retry(job)]
+        now = datetime.datetime.utcnow()
+        waiting.sort(key=lambda job: job.priority(now), reverse=True)
+
+        for job in waiting[:max(0, self.max_concurrent - len(self.running))]:
+            job.thread = threading.Thread(target=self.run_job_thread, args=(job,), name="recompute-{}".format(job.scenario_id))
+            job.thread.daemon = True
+            self.running[job.scenario_id] = job
+            job.thread.start()
+
+        return waiting
+
+    def run(self):
+        print("consortium_calculate: up to {} recomputes at once, {} workers each".format(
+            self.max_concurrent, self.num_workers_per_job))
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print("Error: exception {} during consortium_calculate poll".format(e))
+            sleep(self.poll_seconds * (0.5 + random.random()))
+
+
+def consortium_calculate(max_concurrent=None):
+    max_concurrent = max_concurrent or int(os.getenv("CONSORTIUM_CALCULATE_CONCURRENCY", 2))
+    RecomputeScheduler(max_concurrent=max_concurrent).run()
 
 
 # python consortium_calculate.py
+# python consortium_calculate.py --max-concurrent 4
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run stuff :)")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="recomputes to run at once, CONSORTIUM_CALCULATE_CONCURRENCY or 2 by default")
 
     parsed_args = parser.parse_args()
     parsed_vars = vars(parsed_args)
 
-    consortium_calculate()
-
-
-
+    consortium_calculate(parsed_vars["max_concurrent"])
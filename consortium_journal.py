@@ -1,6 +1,8 @@
 # coding: utf-8
 
+from collections import OrderedDict
 from datetime import datetime
+import numpy as np
 from cached_property import cached_property
 from time import time
 from journal import Journal
@@ -30,16 +32,125 @@ from journal import Journal
 #     response_list.append(my_journal_dict)
 
 
+# what ConsortiumJournal needs from its members' rows in jump_scenario_computed
+summed_attributes = ["usage", "downloads", "authorships", "citations", "ill_cost", "use_oa", "use_subscription",
+                     "use_backfile", "use_ill", "use_other_delayed"]
+attributes_multiplied_by_usage = ["use_social_networks_percent", "use_green_percent", "use_hybrid_percent",
+                                  "use_bronze_percent", "use_peer_reviewed_percent"]
+listed_attributes = ["institution_id", "institution_name", "institution_short_name", "package_id"]
+meta_attributes = ["subject", "era_subjects", "is_society_journal", "bronze_oa_embargo_months", "is_hybrid_2019",
+                   "subscription_cost"]
+
+
+def aggregate_member_data(member_data):
+    """Everything a ConsortiumJournal reads from its members' rows, in one pass
+    and as plain json, so it can be saved and the rows left in the database."""
+    sums = {attribute_name: 0 for attribute_name in summed_attributes}
+    sums_multiplied_by_usage = {attribute_name: 0 for attribute_name in attributes_multiplied_by_usage}
+    lists = {attribute_name: [] for attribute_name in listed_attributes}
+    has_perpetual_access = False
+    perpetual_access_years = None
+    baseline_access = None
+
+    for my_member_dict in member_data:
+        usage = float(my_member_dict["usage"])
+        for attribute_name in summed_attributes:
+            sums[attribute_name] += my_member_dict.get(attribute_name, 0) or 0
+        for attribute_name in attributes_multiplied_by_usage:
+            sums_multiplied_by_usage[attribute_name] += (my_member_dict.get(attribute_name, 0) or 0) * usage
+        for attribute_name in listed_attributes:
+            lists[attribute_name].append(my_member_dict.get(attribute_name, None))
+        if my_member_dict.get("has_perpetual_access"):
+            has_perpetual_access = True
+        if not perpetual_access_years and my_member_dict.get("perpetual_access_years"):
+            perpetual_access_years = my_member_dict.get("perpetual_access_years")
+        if not baseline_access and my_member_dict.get("baseline_access"):
+            baseline_access = my_member_dict.get("baseline_access")
+
+    return {
+        "num_members": len(member_data),
+        "sums": {attribute_name: float(value) for attribute_name, value in sums.items()},
+        "sums_multiplied_by_usage": {attribute_name: float(value) for attribute_name, value in sums_multiplied_by_usage.items()},
+        "lists": lists,
+        "meta": {attribute_name: member_data[0].get(attribute_name, None) for attribute_name in meta_attributes},
+        "has_perpetual_access": has_perpetual_access,
+        "perpetual_access_years": perpetual_access_years,
+        "baseline_access": baseline_access,
+    }
+
+
+def frame_values(series):
+    # plain python values for json, with None for missing
+    return [None if value != value else value for value in series.astype(object).tolist()]
+
+
+def aggregate_member_frame(member_frame):
+    """aggregate_member_data for every journal in a frame of member rows (see
+    consortium_get_computed_frame) at once, as group-bys over its columns.
+    Returns an OrderedDict of issn_l to the same dicts, in first-seen order."""
+    if not len(member_frame):
+        return OrderedDict()
+
+    by_issn_l = member_frame.groupby("issn_l", sort=False, observed=True)
+    num_members = by_issn_l.size()
+    issn_ls = list(num_members.index.astype(object))
+
+    def by_issn_l_values(frame):
+        return {column: dict(zip(issn_ls, frame[column].reindex(num_members.index).tolist())) for column in frame.columns}
+
+    sums = by_issn_l_values(by_issn_l[summed_attributes].sum())
+    multiplied_by_usage = member_frame[attributes_multiplied_by_usage].fillna(0).multiply(member_frame["usage"], axis=0)
+    multiplied_by_usage["issn_l"] = member_frame["issn_l"]
+    sums_multiplied_by_usage = by_issn_l_values(multiplied_by_usage.groupby("issn_l", sort=False, observed=True)[attributes_multiplied_by_usage].sum())
+
+    # each journal's members in row order: a stable sort on the issn code, split where it changes
+    issn_l_codes = member_frame["issn_l"].cat.codes.values
+    order = np.argsort(issn_l_codes, kind="stable")
+    splits = np.flatnonzero(np.diff(issn_l_codes[order])) + 1
+    split_issn_ls = [member_frame["issn_l"].cat.categories[code] for code in issn_l_codes[order][np.concatenate(([0], splits))]]
+    lists = {}
+    for attribute_name in listed_attributes:
+        values = np.array(frame_values(member_frame[attribute_name]), dtype=object)[order]
+        lists[attribute_name] = {issn_l: members.tolist() for issn_l, members in zip(split_issn_ls, np.split(values, splits))}
+
+    # like member_data[0], and the first member with a value
+    first_rows = member_frame.drop_duplicates("issn_l").set_index("issn_l")
+    meta = {attribute_name: dict(zip(first_rows.index.astype(object), frame_values(first_rows[attribute_name])))
+            for attribute_name in meta_attributes}
+    firsts_with_value = {}
+    for attribute_name in ["perpetual_access_years", "baseline_access"]:
+        with_value = member_frame[member_frame[attribute_name].astype(object).fillna("").astype(str) != ""]
+        with_value = with_value.drop_duplicates("issn_l").set_index("issn_l")
+        firsts_with_value[attribute_name] = dict(zip(with_value.index.astype(object), frame_values(with_value[attribute_name])))
+
+    response = OrderedDict()
+    for issn_l in issn_ls:
+        response[issn_l] = {
+            "num_members": len(lists["package_id"][issn_l]),
+            "sums": {attribute_name: float(sums[attribute_name][issn_l]) for attribute_name in summed_attributes},
+            "sums_multiplied_by_usage": {attribute_name: float(sums_multiplied_by_usage[attribute_name][issn_l]) for attribute_name in attributes_multiplied_by_usage},
+            "lists": {attribute_name: lists[attribute_name][issn_l] for attribute_name in listed_attributes},
+            "meta": {attribute_name: meta[attribute_name][issn_l] for attribute_name in meta_attributes},
+            # not a column in jump_scenario_computed, so always False, as in aggregate_member_data
+            "has_perpetual_access": False,
+            "perpetual_access_years": firsts_with_value["perpetual_access_years"].get(issn_l, None),
+            "baseline_access": firsts_with_value["baseline_access"].get(issn_l, None),
+        }
+    return response
+
+
 class ConsortiumJournal(Journal):
     years = list(range(0, 5))
 
-    def __init__(self, issn_l, included_package_ids, all_member_data, is_jisc, package):
+    def __init__(self, issn_l, included_package_ids, all_member_data, is_jisc, package, aggregates=None):
         start_time = time()
         self.issn_l = issn_l
         self.is_jisc = is_jisc
         self.included_package_ids = included_package_ids
+        # member_data is None when built from saved aggregates, see Consortium.journal_aggregates
         self.member_data = all_member_data
-        self.meta_data = self.member_data[0]
+        self.aggregates = aggregates or aggregate_member_data(all_member_data)
+        self.meta_data = self.aggregates["meta"]
         self.subscribed_bulk = False
         self.subscribed_custom = False
         self.use_default_download_curve = False
@@ -57,6 +168,8 @@ class ConsortiumJournal(Journal):
         return list(range(now.year - 5, now.year))
 
     def sum_attribute(self, attribute_name, nesting_key=None):
+        if not nesting_key and attribute_name in self.aggregates["sums"]:
+            return self.aggregates["sums"][attribute_name]
         response = 0
         for my_member_dict in self.member_data:
             if nesting_key:
@@ -66,6 +179,8 @@ class ConsortiumJournal(Journal):
         return float(response)
 
     def sum_attribute_multiplied_by_usage(self, attribute_name, nesting_key=None):
+        if not nesting_key and attribute_name in self.aggregates["sums_multiplied_by_usage"]:
+            return self.aggregates["sums_multiplied_by_usage"][attribute_name]
         response = 0
         for my_member_dict in self.member_data:
             if nesting_key:
@@ -75,32 +190,27 @@ class ConsortiumJournal(Journal):
         return float(response)
 
     def list_attribute(self, attribute_name):
+        if attribute_name in self.aggregates["lists"]:
+            return self.aggregates["lists"][attribute_name]
         return [my_member_dict.get(attribute_name, None) for my_member_dict in self.member_data]
 
     @cached_property
     def has_perpetual_access(self):
-        response = False
-        for my_member_dict in self.member_data:
-            if my_member_dict.get("has_perpetual_access"):
-                response = True
-        return response
+        return self.aggregates["has_perpetual_access"]
 
     @cached_property
     def perpetual_access_years(self):
-        for my_member_dict in self.member_data:
-            if my_member_dict.get("perpetual_access_years"):
-                if isinstance(my_member_dict.get("perpetual_access_years"), str) :
-                    return [int(z) for z in my_member_dict.get("perpetual_access_years").split("-") if len(z)]
-                else:
-                    return my_member_dict.get("perpetual_access_years")
+        perpetual_access_years = self.aggregates["perpetual_access_years"]
+        if perpetual_access_years:
+            if isinstance(perpetual_access_years, str):
+                return [int(z) for z in perpetual_access_years.split("-") if len(z)]
+            else:
+                return perpetual_access_years
         return []
 
     @cached_property
     def baseline_access(self):
-        for my_member_dict in self.member_data:
-            if my_member_dict.get("baseline_access"):
-                return my_member_dict.get("baseline_access")
-        return None
+        return self.aggregates["baseline_access"]
 
     @cached_property
     def institution_id(self):
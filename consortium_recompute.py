@@ -7,22 +7,36 @@ from consortium import Consortium
 # heroku run --size=performance-l python consortium_recompute.py --package_id=package-3WkCDEZTqo6S -r heroku
 # heroku run --size=performance-l python consortium_recompute.py --scenario_id=tGUVWRiN -r heroku
 # python consortium_recompute.py --package_id=package-X9cgZdJWfmGy
+# python consortium_recompute.py --scenario_id=tGUVWRiN --workers=8
+# split across two dynos, one of these on each:
+# heroku run --size=performance-l python consortium_recompute.py --scenario_id=tGUVWRiN --shard=0 --num_shards=2 -r heroku
+# heroku run --size=performance-l python consortium_recompute.py --scenario_id=tGUVWRiN --shard=1 --num_shards=2 -r heroku
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run stuff :)")
     parser.add_argument("--package_id", type=str, default=None, help="package id of consortium to recompute")
     parser.add_argument("--scenario_id", type=str, default=None, help="scenario id of consortium to recompute")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, CONSORTIUM_RECOMPUTE_WORKERS or the number of cores by default")
+    parser.add_argument("--shard", type=int, default=None, help="which share of the members to recompute, from 0")
+    parser.add_argument("--num_shards", type=int, default=None, help="how many dynos the members are split between")
+    parser.add_argument("--force", action="store_true", default=False, help="rebuild every member, even if its inputs haven't changed")
 
     parsed_args = parser.parse_args()
     parsed_vars = vars(parsed_args)
 
     consortium_package_id = parsed_vars["package_id"]
     consortium_scenario_id = parsed_vars["scenario_id"]
+    recompute_args = {
+        "num_workers": parsed_vars["workers"],
+        "shard": parsed_vars["shard"],
+        "num_shards": parsed_vars["num_shards"],
+        "force": parsed_vars["force"],
+    }
 
     if consortium_scenario_id:
         new_consortia = Consortium(consortium_scenario_id)
-        new_consortia.recompute_journal_dicts()
-        print("recomputing {}".format(new_consortia))
+        report = new_consortia.recompute_journal_dicts(**recompute_args)
+        print("recomputed {}: {}".format(new_consortia, report))
 
     elif consortium_package_id:
         from consortium import get_consortium_ids
@@ -32,5 +46,5 @@ if __name__ == "__main__":
             if consortium_package_id == d["package_id"]:
                 print("starting to recompute row {}".format(d))
                 new_consortia = Consortium(d["scenario_id"])
-                new_consortia.recompute_journal_dicts()
-                print("recomputing {}".format(new_consortia))
+                report = new_consortia.recompute_journal_dicts(**recompute_args)
+                print("recomputed {}: {}".format(new_consortia, report))
@@ -140,7 +140,7 @@ class CounterInput(db.Model, PackageInput):
     def issn_columns(self):
         return ["print_issn", "online_issn"]
 
-    def apply_header(self, normalized_rows, header_rows):
+    def header_values(self, normalized_rows, header_rows):
         # get the counter version and file format
         version_labels = {
             "Journal Report 1 (R4)": {
@@ -166,6 +166,7 @@ class CounterInput(db.Model, PackageInput):
         }
 
         assigned_label = None
+        self.looking_for_oa_gold = False
 
         normalized_header_text = "".join([re.sub(r"\s*", "", "".join(row)).lower() for row in header_rows])
         for label in version_labels:
@@ -181,8 +182,12 @@ class CounterInput(db.Model, PackageInput):
                 assigned_label = "TR_J4"
             elif first_row["metric_type"] == "No_License":
                 assigned_label = "TR_J2"
+            # normalized_rows are the first rows of the file, see PackageInput.header_sample_size.
+            # revise_header_values looks at the rest
             elif "OA_Gold" in [row.get("access_type", "") for row in normalized_rows]:
                 assigned_label = "TR_J3"
+            else:
+                self.looking_for_oa_gold = True
 
         if assigned_label:
             print("Recognized the file type as {}".format(version_labels[assigned_label]))
@@ -213,12 +218,20 @@ class CounterInput(db.Model, PackageInput):
             logger.warn("Couldn't guess a year from column headers: {}".format(header_rows[-1]))
 
 
-        for row in normalized_rows:
-            row["report_year"] = report_year
-            row["report_version"] = report_version
-            row["report_name"] = report_name
+        return {
+            "report_year": report_year,
+            "report_version": report_version,
+            "report_name": report_name,
+        }
 
-        return normalized_rows
+    def revise_header_values(self, header_values, normalized_row):
+        # an unlabeled TR_J3 file can have its first OA_Gold row past the header sample
+        if getattr(self, "looking_for_oa_gold", False) and normalized_row.get("access_type", "") == "OA_Gold":
+            self.looking_for_oa_gold = False
+            print("Recognized the file type as TR_J3 from row access types")
+            header_values = dict(header_values)
+            header_values.update({"report_version": "5", "report_name": "trj3"})
+        return header_values
 
     def set_to_delete(self, package_id, report_name=None):
         if report_name:
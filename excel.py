@@ -1,117 +1,223 @@
+import datetime
+import re
 import tempfile
 import zipfile
 
+from xml.etree import ElementTree
+
 import openpyxl
-import pyexcel
+import xlrd
 import csv
 
-from openpyxl.cell.read_only import EmptyCell
-
 from app import logger
 
 
-def convert_xls_to_xlsx(xls_file):
-    xlsx_file_name = tempfile.mkstemp(suffix='.xlsx')[1]
+# a formula in a worksheet part of an .xlsx is an <f> element inside its <c>
+xlsx_formula_pattern = re.compile(rb"<(?:\w+:)?f[\s>/]")
+
+
+def _hidden_xlsx_worksheet_parts(xlsx_zip):
+    # the worksheet parts of sheets that aren't visible, from the sheet states in
+    # xl/workbook.xml and the parts their relationships point to
     try:
-        pyexcel.save_book_as(file_name=xls_file, dest_file_name=xlsx_file_name)
-    except Exception as e:
-        logger.info(
-            'Error converting {} from .xls to .xlsx: {}, {}'.format(xls_file,
-                                                                    type(e),
-                                                                    str(e)))
+        workbook = ElementTree.fromstring(xlsx_zip.read('xl/workbook.xml'))
+        rels = ElementTree.fromstring(xlsx_zip.read('xl/_rels/workbook.xml.rels'))
+    except (KeyError, ElementTree.ParseError):
+        # openpyxl will say what's wrong with the file
+        return set()
+
+    targets = {}
+    for rel in rels:
+        target = rel.get('Target', '')
+        targets[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+
+    hidden_parts = set()
+    for element in workbook.iter():
+        if element.tag.rsplit('}', 1)[-1] == 'sheet' and element.get('state', 'visible') != 'visible':
+            rel_ids = [value for key, value in element.attrib.items() if key.rsplit('}', 1)[-1] == 'id']
+            hidden_parts.update(targets[rel_id] for rel_id in rel_ids if rel_id in targets)
+    return hidden_parts
+
+
+def count_xlsx_formulas(xlsx_file, stop_at_first=False):
+    """Counts formula cells by scanning the raw worksheet xml, which is much
+    cheaper than looking at the data_type of every cell. Hidden sheets aren't
+    read, so they aren't scanned."""
+    num_formulas = 0
+    with zipfile.ZipFile(xlsx_file) as xlsx_zip:
+        hidden_parts = _hidden_xlsx_worksheet_parts(xlsx_zip)
+        for part_name in xlsx_zip.namelist():
+            if not (part_name.startswith('xl/worksheets/') and part_name.endswith('.xml')):
+                continue
+            if part_name in hidden_parts:
+                continue
+            with xlsx_zip.open(part_name) as part:
+                tail = b''
+                while True:
+                    chunk = part.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    data = tail + chunk
+                    # matches that end in the tail were counted with the last chunk
+                    num_formulas += len([m for m in xlsx_formula_pattern.finditer(data) if m.end() > len(tail)])
+                    if num_formulas and stop_at_first:
+                        return num_formulas
+                    tail = data[-16:]
+    return num_formulas
+
+
+def _xls_value(cell_type, value, datemode):
+    # the same values pyexcel gave when .xls files were converted to .xlsx first
+    if cell_type in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    if cell_type == xlrd.XL_CELL_DATE:
+        date_tuple = xlrd.xldate_as_tuple(value, datemode)
+        if date_tuple == (0, 0, 0, 0, 0, 0):
+            return datetime.datetime(1900, 1, 1, 0, 0, 0)
+        elif date_tuple[0:3] == (0, 0, 0):
+            return datetime.time(*date_tuple[3:6])
+        return datetime.datetime(*date_tuple)
+    if cell_type == xlrd.XL_CELL_NUMBER and float(value).is_integer():
+        return int(value)
+    if cell_type == xlrd.XL_CELL_ERROR:
+        return '#N/A'
+    return value
+
+
+def _iter_xls_sheets(book):
+    # yields (sheet name, row values iterator), skipping hidden sheets, rows and
+    # columns like pyexcel did. .xls has no way to tell us about formulas.
+    try:
+        for sheet_name in book.sheet_names():
+            sheet = book.sheet_by_name(sheet_name)
+            if sheet.visibility != 0:
+                book.unload_sheet(sheet_name)
+                continue
+            visible_columns = [c for c in range(sheet.ncols)
+                               if not (c in sheet.colinfo_map and sheet.colinfo_map[c].hidden)]
+
+            def rows(sheet=sheet, visible_columns=visible_columns):
+                for r in range(sheet.nrows):
+                    if r in sheet.rowinfo_map and sheet.rowinfo_map[r].hidden:
+                        continue
+                    types = sheet.row_types(r)
+                    values = sheet.row_values(r)
+                    yield [_xls_value(types[c], values[c], book.datemode) if c < len(values) else None
+                           for c in visible_columns]
+
+            yield sheet_name, rows()
+            book.unload_sheet(sheet_name)
+    finally:
+        book.release_resources()
+
+
+def _iter_openpyxl_sheets(workbook, xlsx_file):
+    # read_only streams each sheet's xml; values_only skips making a cell object per value.
+    # hidden sheets are skipped, as they are for .xls
+    try:
+        for sheet_name in list(workbook.sheetnames):
+            sheet = workbook[sheet_name]
+            if sheet.sheet_state != "visible":
+                continue
+            yield sheet_name, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+        xlsx_file.close()
+
+
+def iter_spreadsheet_sheets(spreadsheet):
+    """Yields (sheet name, rows) for an .xls or .xlsx file, where rows yields
+    lists of cell values, None for empty cells. Returns None if the file can't
+    be opened as a spreadsheet."""
+    try:
+        if spreadsheet.endswith('.xls'):
+            return _iter_xls_sheets(xlrd.open_workbook(spreadsheet, formatting_info=True, on_demand=True))
+        xlsx_file = open(spreadsheet, "rb")
+        try:
+            workbook = openpyxl.load_workbook(xlsx_file, read_only=True)
+        except Exception:
+            xlsx_file.close()
+            raise
+        return _iter_openpyxl_sheets(workbook, xlsx_file)
+    except (KeyError, zipfile.BadZipfile, ElementTree.ParseError, xlrd.XLRDError) as e:
+        logger.info('{} could not be opened as a spreadsheet: {}, {}'.format(
+            spreadsheet, type(e), str(e)))
         return None
-    return xlsx_file_name
 
 
 def convert_spreadsheet_to_csv(spreadsheet, parsed=True):
-    if spreadsheet.endswith('.xls'):
-        spreadsheet = convert_xls_to_xlsx(spreadsheet)
-        if spreadsheet is None:
+    if not spreadsheet.endswith('.xls'):
+        try:
+            num_formulas = count_xlsx_formulas(spreadsheet, stop_at_first=not parsed)
+        except (KeyError, zipfile.BadZipfile) as e:
+            logger.info('{} could not be opened as a spreadsheet: {}, {}'.format(
+                spreadsheet, type(e), str(e)))
             return None
-
-    try:
-        workbook = openpyxl.load_workbook(open(spreadsheet, "rb"),
-                                          read_only=True)
-    except (KeyError, zipfile.BadZipfile) as e:
-        logger.info('{} could not be opened as a spreadsheet: {}, {}'.format(
-            spreadsheet, type(e), str(e)))
+        if num_formulas:
+            if parsed:
+                raise RuntimeError(
+                    'Uploaded files can not contain formulas. Found {} cells with formulas.'.format(
+                        num_formulas))
+            raise RuntimeError('Uploaded files can not contain formulas')
+
+    sheets = iter_spreadsheet_sheets(spreadsheet)
+    if sheets is None:
         return None
 
-    return _convert_parsed(workbook) if parsed else _convert_blind(workbook)
+    return _convert_parsed(sheets) if parsed else _convert_blind(sheets)
 
 
-def _convert_parsed(workbook):
+def _convert_parsed(sheets):
     csv_file_name = tempfile.mkstemp()[1]
-
-    rows = []
     column_names = None
 
-    for sheet_name in list(workbook.sheetnames):
-        sheet = workbook[sheet_name]
-
-        sheet_column_names = {}
-        for i, column in enumerate(
-                list(sheet.iter_rows(min_row=1, max_row=1))[0]):
-            sheet_column_names[i] = column.value.lower().strip()
-
-        if column_names is None:
-            column_names = list(sheet_column_names.values())
-        elif set(sheet_column_names.values()).difference(set(column_names)):
-            raise ValueError('all worksheets must contain the same columns')
-
-        cell_types = []
-        for row_cells in sheet.iter_rows(min_row=2):
-            row = {}
-            for column in range(0, len(sheet_column_names)):
-                row[sheet_column_names[column]] = row_cells[
-                                                      column].value or None
-                cell_types.append(row_cells[column].data_type)
-            rows.append(row)
-
-        formula_cells = cell_types.count('f')
-        if formula_cells > 0:
-            raise RuntimeError(
-                'Uploaded files can not contain formulas. Found {} cells with formulas.'.format(
-                    formula_cells))
-
     with open(csv_file_name, 'w') as csv_file:
-        writer = csv.DictWriter(csv_file, column_names)
-
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+        writer = None
+        for sheet_name, rows in sheets:
+            header = next(rows, None)
+            if header is None:
+                continue
+            sheet_column_names = [value.lower().strip() for value in header]
+
+            if column_names is None:
+                column_names = sheet_column_names
+                writer = csv.DictWriter(csv_file, column_names)
+                writer.writeheader()
+            elif set(sheet_column_names).difference(set(column_names)):
+                raise ValueError('all worksheets must contain the same columns')
+
+            for values in rows:
+                row = {}
+                for column, column_name in enumerate(sheet_column_names):
+                    row[column_name] = (values[column] if column < len(values) else None) or None
+                writer.writerow(row)
 
     return [csv_file_name]
 
 
-def _truncate_row(row: tuple, n_empty=100):
+def _truncate_row(row, n_empty=100):
+    # sheets sometimes say they are thousands of columns wide
     count = 0
-    for i, cell in enumerate(row):
-        if isinstance(cell, EmptyCell):
+    for i, value in enumerate(row):
+        if value is None:
             count += 1
         else:
             count = 0
 
         if count == n_empty:
-            return row[:i - n_empty - 1]
+            return row[:i - n_empty + 1]
     return row
 
 
-def _convert_blind(workbook):
+def _convert_blind(sheets):
     csv_file_names = []
 
-    for sheet_name in list(workbook.sheetnames):
-        sheet = workbook[sheet_name]
+    for sheet_name, rows in sheets:
         csv_file_name = tempfile.mkstemp()[1]
         with open(csv_file_name, 'w', encoding='utf-8') as csv_file:
             writer = csv.writer(csv_file, delimiter=',')
-            for i, row in enumerate(sheet.iter_rows(min_row=1)):
-                if i % 100 == 0:
-                    print(f'Processed {i + 1}/{sheet.max_row} rows')
-                if 'f' in [w.data_type for w in row]:
-                    raise RuntimeError(
-                        'Uploaded files can not contain formulas')
-                writer.writerow([cell.value for cell in _truncate_row(row)])
+            for row in rows:
+                writer.writerow(_truncate_row(row))
 
         csv_file_names.append(csv_file_name)
 
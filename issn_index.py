@@ -0,0 +1,56 @@
+import re
+
+issn_pattern = re.compile(r"^\d{4}-?\d{3}(?:X|\d)$")
+bundle_issn_pattern = re.compile(r"^[A-Z0-9]{4}-\d{3}(?:X|\d)$")
+whitespace_pattern = re.compile(r"\s")
+
+
+def clean_issn(issn):
+    """Returns ("issn", "1234-567X") for something that looks like an issn,
+    ("bundle", ...) for a publisher bundle id in issn format and ("bad", ...)
+    for anything else."""
+    issn = issn.replace("issn:", "")
+    issn = whitespace_pattern.sub("", issn).upper()
+    if issn_pattern.match(issn):
+        issn = issn.replace("-", "")
+        return ("issn", issn[0:4] + "-" + issn[4:8])
+    elif bundle_issn_pattern.match(issn):
+        return ("bundle", issn)
+    return ("bad", issn)
+
+
+class IssnIndex(object):
+    """Every issn openalex knows about, and its issn_l.
+
+    Membership is a hash lookup in `issn_l_by_issn`, whose keys are the set of
+    issns. The same dict is used to build `openalex.all_journal_metadata_flat`,
+    so the issn strings are only held once.
+    """
+
+    def __init__(self, issn_l_by_issn):
+        self.issn_l_by_issn = issn_l_by_issn
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows of (issn, issn_l)
+        issn_l_by_issn = {}
+        for (issn, issn_l) in rows:
+            if issn:
+                issn_l_by_issn[issn] = issn_l
+        return cls(issn_l_by_issn)
+
+    @property
+    def issns(self):
+        return self.issn_l_by_issn.keys()
+
+    def get_issn_l(self, issn, default=None):
+        return self.issn_l_by_issn.get(issn, default)
+
+    def __contains__(self, issn):
+        return issn in self.issn_l_by_issn
+
+    def __len__(self):
+        return len(self.issn_l_by_issn)
+
+    def __repr__(self):
+        return "<{} {} issns>".format(self.__class__.__name__, len(self))
@@ -4,12 +4,9 @@ import datetime
 import weakref
 from collections import OrderedDict
 from collections import defaultdict
-from threading import Lock
 
 import numpy as np
-import scipy
 from cached_property import cached_property
-from scipy.optimize import curve_fit
 
 from app import DEMO_PACKAGE_ID
 from app import use_groups
@@ -19,11 +16,19 @@ from util import format_currency
 from util import format_percent
 from util import format_with_commas
 
-scipy_lock = Lock()
-
-# from future of OA paper, modified to be just elsevier, all colours
-default_download_by_age = [0.371269, 0.137739, 0.095896, 0.072885, 0.058849]
-default_download_older_than_five_years = 1.0 - sum(default_download_by_age)
+subscription_dependent_properties = [
+    "subscribed",
+    "cost_actual",
+    "cost_actual_by_year",
+    "use_instant",
+    "use_instant_by_year",
+    "use_instant_percent",
+    "use_instant_percent_by_year",
+    "use_actual",
+    "use_actual_by_year",
+    "downloads_actual",
+    "downloads_actual_by_year",
+]
 
 def display_cpu(value):
     if value and str(value).lower() != "nan":
@@ -46,8 +51,8 @@ class Journal(object):
             self.package_id_for_db = DEMO_PACKAGE_ID
         self.subscribed_bulk = False
         self.subscribed_custom = False
-        self.use_default_download_curve = False
-        self.use_default_num_papers_curve = False
+        self.engine = None
+        self.engine_row = None
 
     def set_scenario(self, scenario):
         if scenario:
@@ -60,6 +65,15 @@ class Journal(object):
     def set_scenario_data(self, scenario_data):
         self._scenario_data = scenario_data
 
+    def set_engine(self, engine, engine_row):
+        # the numbers for this journal are computed for the whole scenario at once by the
+        # ScenarioEngine; this journal is a view of one row of it
+        self.engine = engine
+        self.engine_row = engine_row
+
+    def engine_value(self, column):
+        return self.engine.value(column, self.engine_row)
+
     @cached_property
     def subscribed(self):
         return self.subscribed_bulk or self.subscribed_custom
@@ -124,55 +138,27 @@ class Journal(object):
 
     @cached_property
     def cost_first_year_including_content_fee(self):
-        # return float(self.my_scenario_data_row.get("price", 0)) * (1 + self.settings.cost_content_fee_percent/float(100))
-        my_lookup = self._scenario_data["prices"]
-        if my_lookup.get(self.issn_l, None) is None:
-            print("no price for {}".format(self.issn_l))
-            return None
-        # print "my price", self.issn_l, float(my_lookup.get(self.issn_l)) * (1 + self.settings.cost_content_fee_percent/float(100))
-        return float(my_lookup.get(self.issn_l)) * (1 + self.settings.cost_content_fee_percent/float(100))
+        return self.engine_value("cost_first_year_including_content_fee")
 
     @cached_property
     def papers_2021(self):
-        response = self.my_scenario_data_row.get("num_papers_2021", 0)
-        if not response:
-            return 0
-        return response
+        return self.engine_value("papers_2021")
 
     @cached_property
     def num_citations_historical_by_year(self):
-        try:
-            my_dict = self._scenario_data[self.package_id_for_db]["citation_dict"].get(self.issn_l, {})
-        except KeyError:
-            # print "key error in num_citations_historical_by_year for {}".format(self.issn_l)
-            return [0 for year in self.years]
-        # the year is a string key alas
-        if my_dict and isinstance(list(my_dict.keys())[0], int):
-            return [my_dict.get(year, 0) for year in self.historical_years_by_year]
-        else:
-            return [my_dict.get(str(year), 0) for year in self.historical_years_by_year]
+        return self.engine_value("num_citations_historical_by_year")
 
     @cached_property
     def num_citations(self):
-        return round(np.mean(self.num_citations_historical_by_year), 4)
+        return self.engine_value("num_citations")
 
     @cached_property
     def num_authorships_historical_by_year(self):
-        try:
-            my_dict = self._scenario_data[self.package_id_for_db]["authorship_dict"].get(self.issn_l, {})
-        except KeyError:
-            # print "key error in num_authorships_historical_by_year for {}".format(self.issn_l)
-            return [0 for year in self.years]
-
-        # the year is a string key alas
-        if my_dict and isinstance(list(my_dict.keys())[0], int):
-            return [my_dict.get(year, 0) for year in self.historical_years_by_year]
-        else:
-            return [my_dict.get(str(year), 0) for year in self.historical_years_by_year]
+        return self.engine_value("num_authorships_historical_by_year")
 
     @cached_property
     def num_authorships(self):
-        return round(np.mean(self.num_authorships_historical_by_year), 4)
+        return self.engine_value("num_authorships")
 
     @cached_property
     def bronze_oa_embargo_months(self):
@@ -180,31 +166,24 @@ class Journal(object):
 
     def set_subscribe_bulk(self):
         self.subscribed_bulk = True
-        # invalidate cache
-        for key in self.__dict__:
-            if "actual" in key:
-                del self.__dict__[key]
+        self.clear_subscription_cache()
 
     def set_unsubscribe_bulk(self):
         self.subscribed_bulk = False
-        # invalidate cache
-        for key in self.__dict__:
-            if "actual" in key:
-                del self.__dict__[key]
+        self.clear_subscription_cache()
 
     def set_subscribe_custom(self):
         self.subscribed_custom = True
-        # invalidate cache
-        for key in self.__dict__:
-            if "actual" in key:
-                del self.__dict__[key]
+        self.clear_subscription_cache()
 
     def set_unsubscribe_custom(self):
         self.subscribed_custom = False
-        # invalidate cache
-        for key in self.__dict__:
-            if "actual" in key:
-                del self.__dict__[key]
+        self.clear_subscription_cache()
+
+    def clear_subscription_cache(self):
+        # only these depend on whether the journal is subscribed; everything else comes from the engine
+        for key in subscription_dependent_properties:
+            self.__dict__.pop(key, None)
 
     @cached_property
     def years_by_year(self):
@@ -230,17 +209,11 @@ class Journal(object):
 
     @cached_property
     def subscription_cost_by_year(self):
-        if self.cost_first_year_including_content_fee is not None:
-            response = [round(((1+self.settings.cost_alacart_increase/float(100))**year) * self.cost_first_year_including_content_fee )
-                                                for year in self.years]
-        else:
-            # will cause errors further down the line
-            response = [None for year in self.years]
-        return response
+        return self.engine_value("subscription_cost_by_year")
 
     @cached_property
     def subscription_cost(self):
-        return round(np.mean(self.subscription_cost_by_year), 4)
+        return self.engine_value("subscription_cost")
 
 
     @cached_property
@@ -257,18 +230,12 @@ class Journal(object):
 
     @cached_property
     def use_weight_multiplier(self):
-        if not self.downloads_total:
-            return 1.0
-        return float(self.use_total) / self.downloads_total
+        return self.engine_value("use_weight_multiplier")
 
 
     @cached_property
     def use_free_instant_by_year(self):
-        response = [0 for year in self.years]
-        for group in use_groups_free_instant:
-            for year in self.years:
-                response[year] += self.__getattribute__("use_{}_by_year".format(group))[year]
-        return response
+        return self.engine_value("use_free_instant_by_year")
 
     @cached_property
     def use_instant_by_year(self):
@@ -295,106 +262,77 @@ class Journal(object):
 
     @cached_property
     def use_free_instant(self):
-        # return round(np.mean(self.use_free_instant_by_year), 4)
-        response = 0
-        for group in use_groups_free_instant:
-            response += self.__getattribute__("use_{}".format(group))
-        return response
+        return self.engine_value("use_free_instant")
 
     @cached_property
     def downloads_subscription_by_year(self):
-        return self.downloads_paywalled_by_year
+        return self.engine_value("downloads_subscription_by_year")
 
     @cached_property
     def downloads_subscription(self):
-        return self.downloads_paywalled
+        return self.engine_value("downloads_subscription")
 
     @cached_property
     def use_subscription(self):
-        return self.use_paywalled
+        return self.engine_value("use_subscription")
 
     @cached_property
     def use_subscription_by_year(self):
-        return [self.use_paywalled_by_year[year] for year in self.years]
+        return self.engine_value("use_subscription_by_year")
 
     @cached_property
     def downloads_social_network_multiplier(self):
-        if not self.settings.include_social_networks:
-            return 0.0
-        return self._scenario_data["social_networks"].get(self.issn_l, 0.06)
+        return self.engine_value("downloads_social_network_multiplier")
 
     @cached_property
     def downloads_social_networks_by_year(self):
-        if not self.downloads_social_network_multiplier:
-            return [0.0 for year in self.years]
-
-        response = [0.0 for year in self.years]
-        for year in self.years:
-            social_network = self.downloads_total_by_year[year] * self.downloads_social_network_multiplier
-            if social_network:
-                overlap_with_backfile = (social_network * self.downloads_backfile_by_year[year]) / self.downloads_total_by_year[year]
-                # print social_network, self.downloads_backfile_by_year[year], self.downloads_total_by_year[year], overlap_with_backfile
-                social_network = social_network - overlap_with_backfile
-            response[year] = social_network
-
-        # response = [self.downloads_total_by_year[year] * self.downloads_social_network_multiplier for year in self.years]
-
-        response = [min(response[year], self.downloads_total_by_year[year] - self.downloads_oa_by_year[year]) for year in self.years]
-        response = [max(response[year], 0) for year in self.years]
-        return response
+        return self.engine_value("downloads_social_networks_by_year")
 
     @cached_property
     def downloads_social_networks(self):
-        return round(np.mean(self.downloads_social_networks_by_year), 4)
+        return self.engine_value("downloads_social_networks")
 
     @cached_property
     def use_social_networks_by_year(self):
-        response = [max(0, round(self.downloads_social_networks_by_year[year] * self.use_weight_multiplier, 4)) for year in self.years]
-        response = [min(response[year], self.use_total_by_year[year] - self.use_oa_by_year[year]) for year in self.years]
-        response = [max(response[year], 0) for year in self.years]
-        return response
+        return self.engine_value("use_social_networks_by_year")
 
     @cached_property
     def use_social_networks(self):
-        # return round(self.downloads_social_networks * self.use_weight_multiplier, 4)
-        response = min(np.mean(self.use_social_networks_by_year), self.use_total - self.use_oa)
-        return response
+        return self.engine_value("use_social_networks")
 
 
     @cached_property
     def downloads_ill_by_year(self):
-        response = [self.settings.ill_request_percent_of_delayed/float(100) * self.downloads_paywalled_by_year[year] for year in self.years]
-        response = [num if num else 0 for num in response]
-        return response
+        return self.engine_value("downloads_ill_by_year")
 
 
     @cached_property
     def downloads_ill(self):
-        return round(np.mean(self.downloads_ill_by_year), 4)
+        return self.engine_value("downloads_ill")
 
     @cached_property
     def use_ill(self):
-        return self.settings.ill_request_percent_of_delayed/float(100) * self.use_paywalled
+        return self.engine_value("use_ill")
 
     @cached_property
     def use_ill_by_year(self):
-        return [self.settings.ill_request_percent_of_delayed/float(100) * self.use_paywalled_by_year[year] for year in self.years]
+        return self.engine_value("use_ill_by_year")
 
     @cached_property
     def downloads_other_delayed_by_year(self):
-        return [self.downloads_paywalled_by_year[year] - self.downloads_ill_by_year[year] for year in self.years]
+        return self.engine_value("downloads_other_delayed_by_year")
 
     @cached_property
     def downloads_other_delayed(self):
-        return round(np.mean(self.downloads_other_delayed_by_year), 4)
+        return self.engine_value("downloads_other_delayed")
 
     @cached_property
     def use_other_delayed(self):
-        return self.use_paywalled - self.use_ill
+        return self.engine_value("use_other_delayed")
 
     @cached_property
     def use_other_delayed_by_year(self):
-        return [self.use_paywalled_by_year[year] - self.use_ill_by_year[year] for year in self.years]
+        return self.engine_value("use_other_delayed_by_year")
 
     @cached_property
     def display_perpetual_access_years(self):
@@ -418,345 +356,130 @@ class Journal(object):
 
     @cached_property
     def perpetual_access_years(self):
-        # if no perpetual access data for any journals in this scenario, then we are acting like it has perpetual access to everything
-        # else, for this journal
-        #   if two dates, that is the perpetual access range
-        #   if a start date and no end date, then has perpetual access till the model says it doesn't
-        #   if no start date, then no perpetual access
-        #   if not there, then no perpetual access
-
-        data_dict = self._scenario_data["perpetual_access"]
-
-        # if not data_dict:
-        #     return self.year_by_perpetual_access_years
-
-        if self.issn_l not in data_dict:
-            return []
-
-        start_date = data_dict[self.issn_l]["start_date"]
-        end_date = data_dict[self.issn_l]["end_date"]
-
-        #   if no dates, then no perpetual access
-        if not start_date:
-            start_date = datetime.datetime(1850, 1, 1)  # far in the past
-
-        #   if no end date, then has perpetual access till the model says it doesn't
-        if not end_date:
-            end_date = datetime.datetime(2042, 1, 2)  # far in the future, let's really hope we have universal OA by then
-
-        #   if two dates, that is the perpetual access range
-        response = []
-        for year in self.year_by_perpetual_access_years:
-            working_date = datetime.datetime(year, 1, 2).isoformat()  # use January 2nd
-            try:
-                start_date = start_date.isoformat()
-            except:
-                pass
-
-            try:
-                end_date = end_date.isoformat()
-            except:
-                pass
-
-            in_range = working_date > start_date and working_date < end_date
-
-            if in_range:
-                # print year, "yes", data_dict[self.issn_l]
-                response.append(year)
-            else:
-                pass
-                # print year, "no", data_dict[self.issn_l]
-
-        return response
+        return self.engine_value("perpetual_access_years")
 
     @cached_property
     def downloads_backfile_by_year(self):
-        response = self.sum_obs_pub_matrix_by_obs(self.backfile_obs_pub)
-        response = [min(response[year], self.downloads_total_by_year[year] - self.downloads_oa_by_year[year]) for year in self.years]
-        return response
+        return self.engine_value("downloads_backfile_by_year")
 
     @cached_property
     def downloads_obs_pub(self):
-        by_age = self.downloads_by_age
-        by_age_old = self.downloads_total_older_than_five_years/5.0
-        growth_scaling = self.growth_scaling_downloads
-        my_matrix = self.obs_pub_matrix(by_age, by_age_old, growth_scaling)
-        return my_matrix
-
+        return self.engine.obs_pub_matrix("downloads_obs_age", self.engine_row)
 
     @cached_property
     def oa_obs_pub(self):
-        by_age = self.downloads_oa_by_age
-        if not self.downloads_by_age[4]:
-            by_age_old = (self.downloads_total_older_than_five_years/5.0)
-        else:
-            by_age_old = (self.downloads_total_older_than_five_years/5.0) * (self.downloads_oa_by_age[4]/(self.downloads_by_age[4]))
-        growth_scaling = self.growth_scaling_oa_downloads
-        my_matrix = self.obs_pub_matrix(by_age, by_age_old, growth_scaling)
-        return my_matrix
+        return self.engine.obs_pub_matrix("oa_obs_age", self.engine_row)
 
     @cached_property
     def backfile_raw_obs_pub(self):
-        response = {}
-        for obs_year in range(self.now.year, self.now.year + 5):
-            obs_key = "obs{}".format(obs_year)
-            response[obs_key] = {}
-            for pub_year in range(self.now.year - 10, self.now.year + 5):
-                pub_key = "pub{}".format(pub_year)
-
-                # modelling subscription ending in 2020, so no backfile beyond that
-                if pub_year in self.perpetual_access_years:
-                    value = self.downloads_obs_pub[obs_key][pub_key] - self.oa_obs_pub[obs_key][pub_key]
-                elif pub_year-1 in self.perpetual_access_years:
-                    value = 0.5*(self.downloads_obs_pub[obs_key][pub_key] - self.oa_obs_pub[obs_key][pub_key])
-                else:
-                    value = 0
-                value = max(value, 0)
-                response[obs_key][pub_key] = int(round(value))
-        return response
-
+        # modelling subscription ending in 2020, so no backfile beyond that
+        return self.engine.obs_pub_matrix("backfile_obs_age", self.engine_row)
 
     @cached_property
     def backfile_obs_pub(self):
-        response = {}
-        for obs_year in range(self.now.year, self.now.year + 5):
-            obs_key = "obs{}".format(obs_year)
-            response[obs_key] = {}
-            for pub_year in range(self.now.year - 10, self.now.year + 5):
-                pub_key = "pub{}".format(pub_year)
-                value = self.backfile_raw_obs_pub[obs_key][pub_key]
-                # value *= (self.settings.backfile_contribution / 100.0)
-                value = max(0, value)
-                response[obs_key][pub_key] = int(round(value))
-
-        return response
-
-    def obs_pub_matrix(self, by_age, by_age_old, growth_scaling):
-        response = {}
-        for obs_index, obs_year in enumerate(range(self.now.year, self.now.year + 5)):
-            response["obs{}".format(obs_year)] = {}
-            for pub_year in range(self.now.year - 10, self.now.year + 5):
-                age = obs_year - pub_year
-                value = 0
-                if age >= 0 and age <= 4:
-                    value = int(round(by_age[age]))
-                elif age >= 5 and age <= 9:
-                    value = int(round(by_age_old))
-                value *= growth_scaling[obs_index]
-                response["obs{}".format(obs_year)]["pub{}".format(pub_year)] = int(round(value))
-        return response
+        # value *= (self.settings.backfile_contribution / 100.0)
+        return self.backfile_raw_obs_pub
 
     def display_obs_pub_matrix(self, my_obs_pub_matrix):
-        response = []
-        obs_keys_ordered = sorted(my_obs_pub_matrix.keys())
-        for obs_key in obs_keys_ordered:
-            sub_response = []
-            pub_row = my_obs_pub_matrix[obs_key]
-            pub_keys_ordered = sorted(pub_row.keys())
-            for pub_key in pub_keys_ordered:
-                sub_response.append(pub_row[pub_key])
-            response.append(sub_response)
-        return response
-
-    def sum_obs_pub_matrix_by_obs(self, my_obs_pub_matrix):
-        response = [0 for year in self.years]
-        for i, obs_year in enumerate(range(self.now.year, self.now.year + 5)):
-            obs_key = "obs{}".format(obs_year)
-            for pub_year in range(self.now.year - 10, self.now.year + 5):
-                pub_key = "pub{}".format(pub_year)
-                response[i] += my_obs_pub_matrix[obs_key][pub_key]
-        return response
+        # rows are obs years, columns are pub years, both ascending
+        return my_obs_pub_matrix.tolist()
 
 
 
     @cached_property
     def downloads_backfile(self):
-        return round(np.mean(self.downloads_backfile_by_year), 4)
+        return self.engine_value("downloads_backfile")
 
     @cached_property
     def use_backfile_by_year(self):
-        response = [max(0, round(self.downloads_backfile_by_year[year] * self.use_weight_multiplier, 4)) for year in self.years]
-        response = [min(response[year], self.use_total_by_year[year] - self.use_oa_by_year[year]) for year in self.years]
-        return response
+        return self.engine_value("use_backfile_by_year")
 
     @cached_property
     def use_backfile(self):
-        # response = [min(response[year], self.use_total_by_year[year] - self.use_oa_by_year[year]) for year in self.years]
-        response = min(np.mean(self.use_backfile_by_year), self.use_total - self.use_oa - self.use_social_networks)
-        return round(response, 4)
+        return self.engine_value("use_backfile")
 
     @cached_property
     def raw_num_oa_historical_by_year(self):
-        return [self.num_green_historical_by_year[year]+self.num_bronze_historical_by_year[year]+self.num_hybrid_historical_by_year[year] for year in self.years]
+        return self.engine_value("raw_num_oa_historical_by_year")
 
     @cached_property
     def use_oa_plus_social_networks(self):
-        return self.use_oa + self.use_social_networks
+        return self.engine_value("use_oa_plus_social_networks")
 
     @cached_property
     def use_oa_plus_social_networks_by_year(self):
-        return [self.use_oa_by_year[year] + self.use_social_networks_by_year[year] for year in self.years]
+        return self.engine_value("use_oa_plus_social_networks_by_year")
 
     @cached_property
     def downloads_oa_by_year(self):
-        # if self.issn_l == "0271-678X":
-        #     print "self.oa_obs_pub", self.oa_obs_pub
-        #     print "self.sum_obs_pub_matrix_by_obs(self.oa_obs_pub)", self.sum_obs_pub_matrix_by_obs(self.oa_obs_pub)
-
-        return self.sum_obs_pub_matrix_by_obs(self.oa_obs_pub)
+        return self.engine_value("downloads_oa_by_year")
 
     @cached_property
     def downloads_oa_plus_social_networks_by_year(self):
-        return [self.downloads_oa_by_year[year] + self.downloads_social_networks_by_year[year] for year in self.years]
+        return self.engine_value("downloads_oa_plus_social_networks_by_year")
 
     @cached_property
     def use_oa(self):
-        # return round(self.downloads_oa * self.use_weight_multiplier, 4)
-        # return self.use_oa_green + self.use_oa_bronze + self.use_oa_hybrid
-        # if self.issn_l == "0271-678X":
-        #     print "self.use_oa_by_year", self.use_oa_by_year
-        response = min(np.mean(self.use_oa_by_year), self.use_total)
-        return round(response, 4)
+        return self.engine_value("use_oa")
 
     @cached_property
     def use_oa_by_year(self):
-        # TODO fix
-        response = [max(0, self.downloads_oa_by_year[year] * self.use_weight_multiplier) for year in self.years]
-        response = [min(response[year], self.use_total_by_year[year]) for year in self.years]
-        return response
+        return self.engine_value("use_oa_by_year")
 
     @cached_property
     def use_oa_percent_by_year(self):
-        # print self.use_oa_by_year, self.use_total_by_year
-        response = [min(100, round(100.0*(self.use_oa_by_year[year]/(1.0+self.use_total_by_year[year])), 1)) for year in self.years]
-        return response
+        return self.engine_value("use_oa_percent_by_year")
 
     @cached_property
     def downloads_total_by_year(self):
-        scaled = [self.downloads_scaled_by_counter_by_year[year] * self.growth_scaling_downloads[year] for year in self.years]
-        return scaled
+        return self.engine_value("downloads_total_by_year")
 
     @cached_property
     def downloads_total(self):
-        return round(np.mean(self.downloads_total_by_year), 4)
-
+        return self.engine_value("downloads_total")
 
 
-    # used to calculate use_weight_multiplier so it can't use it
     @cached_property
     def use_total_by_year(self):
-        return [self.downloads_total_by_year[year] + self.use_addition_from_weights*self.growth_scaling_downloads[year] for year in self.years]
+        return self.engine_value("use_total_by_year")
 
     @cached_property
     def use_total(self):
-        response = round(np.mean(self.use_total_by_year), 4)
-        if response == 0:
-            response = 0.0001
-        return response
+        return self.engine_value("use_total")
 
 
     @cached_property
     def raw_downloads_by_age(self):
-        # isn't replaced by default if too low or not monotonically decreasing
-        total_downloads_by_age_before_counter_correction = [self.my_scenario_data_row.get("downloads_{}y".format(age), 0) for age in self.years]
-        total_downloads_by_age_before_counter_correction = [val if val else 0 for val in total_downloads_by_age_before_counter_correction]
-        downloads_by_age = [num * self.downloads_counter_multiplier for num in total_downloads_by_age_before_counter_correction]
-        return downloads_by_age
+        return self.engine_value("raw_downloads_by_age")
 
 
     @cached_property
     def curve_fit_for_downloads(self):
-        x = np.array(self.years)
-        y = np.array(self.downloads_by_age_before_counter_correction)
-        initial_guess = (float(np.max(y)), 30.0, -1.0)  # determined empirically
-
-        def func(x, a, b, c):
-            try:
-                response = b + a * scipy.special.expit( x / c )
-            except:
-                response = None
-            return response
-
-
-        try:
-            pars, pcov = curve_fit(func, x, y, initial_guess)
-        except:
-            return {}
-
-        y_fit = [func(a, pars[0], pars[1], pars[2]) for a in x]
-
-        residuals = y - y_fit
-        ss_res = np.sum(residuals**2) + 0.0001
-        ss_tot = np.sum((y - np.mean(y))**2) + 0.0001
-        r_squared = 1 - (ss_res / ss_tot)
-
-        return {"y_fit": y_fit,
-                "r_squared": r_squared,
-                "params": list(pars),
-                "input_y": list(y)}
+        return self.engine_value("curve_fit_for_downloads")
 
 
 
     @cached_property
     def downloads_by_age_before_counter_correction(self):
-        downloads_by_age_before_counter_correction = [self.my_scenario_data_row.get("downloads_{}y".format(age), 0) for age in self.years]
-        downloads_by_age_before_counter_correction = [val if val else 0 for val in downloads_by_age_before_counter_correction]
-        return downloads_by_age_before_counter_correction
+        return self.engine_value("downloads_by_age_before_counter_correction")
 
 
     @cached_property
     def downloads_by_age(self):
-        self.use_default_download_curve = False
-
-        # although the curve fit is on downloads, download number probably off if there are some years with no papers,
-        # so in those cases just use the default
-        nonzero_paper_years = [year for year in self.years if self.raw_num_papers_historical_by_year[year]]
-        if len(nonzero_paper_years) == 5:
-            scipy_lock.acquire()
-            my_curve_fit = self.curve_fit_for_downloads
-            scipy_lock.release()
-            if my_curve_fit and my_curve_fit["r_squared"] >= 0.75:
-                # print u"GREAT curve fit for {}, r_squared {}".format(self.issn_l, my_curve_fit.get("r_squared", "no r_squared"))
-                downloads_by_age_before_counter_correction_curve_to_use = my_curve_fit["y_fit"]
-            else:
-                # print u"bad curve fit for {}, r_squared {}".format(self.issn_l, my_curve_fit.get("r_squared", "no r_squared"))
-                self.use_default_download_curve = True
-        else:
-            self.use_default_download_curve = True
-
-        if self.use_default_download_curve:
-            sum_total_downloads_by_age_before_counter_correction = np.sum(self.downloads_by_age_before_counter_correction)
-            downloads_by_age_before_counter_correction_curve_to_use = [num*sum_total_downloads_by_age_before_counter_correction for num in default_download_by_age]
-
-        downloads_by_age = [num * self.downloads_counter_multiplier for num in downloads_by_age_before_counter_correction_curve_to_use]
-
-        downloads_by_age = [max(val, 0.0) for val in downloads_by_age]
-
-        return downloads_by_age
+        return self.engine_value("downloads_by_age")
 
 
     @cached_property
     def downloads_total_older_than_five_years(self):
-        if self.use_default_download_curve:
-            return default_download_older_than_five_years * (self.downloads_total)
-        return self.downloads_total - np.sum(self.downloads_by_age)
+        return self.engine_value("downloads_total_older_than_five_years")
 
     @cached_property
     def downloads_per_paper_by_age(self):
-        # TODO do separately for each type of OA
-        # print [[float(num), self.num_papers, self.num_oa_historical] for num in self.downloads_by_age]
-
-        if self.num_papers:
-            return [float(num)/self.num_papers for num in self.downloads_by_age]
-        return [0 for num in self.downloads_by_age]
+        return self.engine_value("downloads_per_paper_by_age")
 
     @cached_property
     def downloads_scaled_by_counter_by_year(self):
-        # TODO is flat right now
-        downloads_total_before_counter_correction_by_year = [max(1.0, self.my_scenario_data_row.get("downloads_total", 0.0) or 0.0) for year in self.years]
-        downloads_total_before_counter_correction_by_year = [val if val else 0.0 for val in downloads_total_before_counter_correction_by_year]
-        downloads_total_scaled_by_counter = [num * self.downloads_counter_multiplier for num in downloads_total_before_counter_correction_by_year]
-        return downloads_total_scaled_by_counter
+        return self.engine_value("downloads_scaled_by_counter_by_year")
 
     @cached_property
     def downloads_per_paper(self):
@@ -766,119 +489,62 @@ class Journal(object):
 
     @cached_property
     def proportion_oa_historical_by_year(self):
-        response = []
-        for year in self.years:
-            if self.raw_num_papers_historical_by_year[year]:
-                response.append(float(self.raw_num_oa_historical_by_year[year] or 0) / self.raw_num_papers_historical_by_year[year])
-            else:
-                response.append(None)
-
-        # if self.issn_l == "0031-9406":
-        #     print "self.raw_num_oa_historical_by_year", self.raw_num_oa_historical_by_year
-        #     print self.raw_num_papers_historical_by_year
-        #     print "response", response
-        #     print
-        return response
+        return self.engine_value("proportion_oa_historical_by_year")
 
 
     @cached_property
     def num_oa_historical_by_year(self):
-        oa_proportion_reversed = self.proportion_oa_historical_by_year[::-1]
-
-        num_scaled_by_num_papers = []
-        for year in self.years:
-            if oa_proportion_reversed[year] and oa_proportion_reversed[year]:
-                num_scaled_by_num_papers.append(oa_proportion_reversed[year]*self.num_papers_by_year[year])
-            else:
-                num_scaled_by_num_papers.append(0)
-
-        # if self.issn_l == "0031-9406":
-        #     print "self.num_papers_growth_from_2018_by_year", self.num_papers_growth_from_2018_by_year
-        #     print oa_proportion_reversed, "oa_proportion_reversed"
-        #     print num_scaled_by_num_papers, "num_scaled_by_num_papers"
-        #     print self.num_papers_by_year, "num_papers_by_year"
-        #     print
-
-        return [int(round(min(self.num_papers_by_year[year], num_scaled_by_num_papers[year]))) for year in self.years]
+        return self.engine_value("num_oa_historical_by_year")
 
 
     @cached_property
     def downloads_oa_by_age(self):
-        response = [(float(self.downloads_per_paper_by_age[age])*self.num_oa_historical_by_year[age]) for age in self.years]
-        if self.bronze_oa_embargo_months:
-            for age in self.years:
-                if age*12 >= self.bronze_oa_embargo_months:
-                    response[age] = self.downloads_by_age[age]
-
-        # if self.issn_l == "0031-9406":
-        #     print "self.num_oa_historical_by_year", self.num_oa_historical_by_year
-        #     print "downloads_per_paper_by_age", self.downloads_per_paper_by_age
-        #     print "downloads_by_age", self.downloads_by_age
-        #     print "downloads_by_age_before_counter_correction", self.downloads_by_age_before_counter_correction
-        #     print "downloads_oa_by_age", response
-        return response
+        return self.engine_value("downloads_oa_by_age")
 
 
     @cached_property
     def downloads_oa_bronze_by_age(self):
-        response = [(float(self.downloads_per_paper_by_age[age])*self.num_bronze_by_year[age]) for age in self.years]
-        return response
+        return self.engine_value("downloads_oa_bronze_by_age")
 
     @cached_property
     def downloads_oa_green_by_age(self):
-        response = [(float(self.downloads_per_paper_by_age[age])*self.num_green_by_year[age]) for age in self.years]
-        return response
+        return self.engine_value("downloads_oa_green_by_age")
 
     @cached_property
     def num_hybrid_by_year(self):
-        num_reversed = self.num_hybrid_historical_by_year[::-1]
-        return [min(self.num_papers_by_year[year],
-                                  num_reversed[year]) for year in self.years]
+        return self.engine_value("num_hybrid_by_year")
 
     @cached_property
     def num_bronze_by_year(self):
-        num_reversed = self.num_bronze_historical_by_year[::-1]
-        return [min(self.num_papers_by_year[year] - self.num_hybrid_by_year[year],
-                                  num_reversed[year]) for year in self.years]
+        return self.engine_value("num_bronze_by_year")
 
     @cached_property
     def num_green_by_year(self):
-        num_reversed = self.num_green_historical_by_year[::-1]
-        return [min(self.num_papers_by_year[year] - self.num_hybrid_by_year[year] - self.num_bronze_by_year[year],
-                                  num_reversed[year]) for year in self.years]
+        return self.engine_value("num_green_by_year")
 
     @cached_property
     def downloads_oa_hybrid_by_age(self):
-        response = [(float(self.downloads_per_paper_by_age[age])*self.num_hybrid_by_year[age]) for age in self.years]
-        return response
+        return self.engine_value("downloads_oa_hybrid_by_age")
 
     @cached_property
     def downloads_oa_peer_reviewed_by_age(self):
-        num_reversed = self.num_peer_reviewed_historical_by_year[::-1]
-        num_for_convolving = [min(self.num_papers_by_year[year], num_reversed[year]) for year in self.years]
-
-        response = [(float(self.downloads_per_paper_by_age[age])*num_for_convolving[age]) for age in self.years]
-        return response
+        return self.engine_value("downloads_oa_peer_reviewed_by_age")
 
     @cached_property
     def downloads_paywalled_by_year(self):
-        scaled = [self.downloads_total_by_year[year]
-              - (self.downloads_backfile_by_year[year] + self.downloads_oa_by_year[year] + self.downloads_social_networks_by_year[year])
-          for year in self.years]
-        scaled = [max(0, num) for num in scaled]
-        return scaled
+        return self.engine_value("downloads_paywalled_by_year")
 
     @cached_property
     def downloads_paywalled(self):
-        return round(np.mean(self.downloads_paywalled_by_year), 4)
+        return self.engine_value("downloads_paywalled")
 
     @cached_property
     def use_paywalled(self):
-        return max(0, self.use_total - self.use_free_instant)
+        return self.engine_value("use_paywalled")
 
     @cached_property
     def use_paywalled_by_year(self):
-        return [max(0, self.use_total_by_year[year] - self.use_free_instant_by_year[year]) for year in self.years]
+        return self.engine_value("use_paywalled_by_year")
 
     @cached_property
     def downloads_counter_multiplier_normalized(self):
@@ -938,44 +604,32 @@ class Journal(object):
 
     @cached_property
     def downloads_total_before_counter_correction(self):
-        return max(1.0, self.my_scenario_data_row.get("downloads_total", 0.0))
+        return self.engine_value("downloads_total_before_counter_correction")
 
     @cached_property
     def use_addition_from_weights(self):
-        # using the average on purpose... by year too rough
-        weights_addition = 0
-        # the if is to help speed it up
-        if self.num_citations or self.num_authorships:
-            weights_addition = float(self.settings.weight_citation) * self.num_citations
-            weights_addition += float(self.settings.weight_authorship) * self.num_authorships
-            weights_addition = round(weights_addition, 4)
-        return weights_addition
+        return self.engine_value("use_addition_from_weights")
 
     @cached_property
     def downloads_counter_multiplier(self):
-        try:
-            counter_for_this_journal = self._scenario_data[self.package_id_for_db]["counter_dict"][self.issn_l]
-            counter_multiplier = float(counter_for_this_journal) / self.downloads_total_before_counter_correction
-        except:
-            counter_multiplier = float(0)
-        return counter_multiplier
+        return self.engine_value("downloads_counter_multiplier")
 
 
     @cached_property
     def ill_cost(self):
-        return round(np.mean(self.ill_cost_by_year), 4)
+        return self.engine_value("ill_cost")
 
     @cached_property
     def ill_cost_by_year(self):
-        return [round(self.downloads_ill_by_year[year] * self.settings.cost_ill, 4) for year in self.years]
+        return self.engine_value("ill_cost_by_year")
 
     @cached_property
     def cost_subscription_minus_ill_by_year(self):
-        return [self.subscription_cost_by_year[year] - self.ill_cost_by_year[year] for year in self.years]
+        return self.engine_value("cost_subscription_minus_ill_by_year")
 
     @cached_property
     def cost_subscription_minus_ill(self):
-        return round(self.subscription_cost - self.ill_cost, 4)
+        return self.engine_value("cost_subscription_minus_ill")
 
     @cached_property
     def cpu_rank(self):
@@ -1021,48 +675,16 @@ class Journal(object):
         return self.scenario.num_citations_fuzzed_lookup[self.issn_l]
 
     @cached_property
-    def curve_fit_for_num_papers(self):
-        x_list = []
-        y_list = []
-        threshold = 0.25
-        from app import USE_PAPER_GROWTH
-        if USE_PAPER_GROWTH:
-            threshold = 0.1
+    def use_default_download_curve(self):
+        return self.engine_value("use_default_download_curve")
 
-        for year in self.years:
-            if self.raw_num_papers_historical_by_year[year] >= threshold * self.raw_num_papers_historical_by_year[4]:
-                x_list.append(year)
-                y_list.append(self.raw_num_papers_historical_by_year[year])
-        x = np.array(x_list)
-        y = np.array(y_list)
-
-        initial_guess = (float(np.mean(y)), 0.05)  # determined empirically
-
-        def func(x, b, m):
-               return b + m * x
-
-        try:
-            pars, pcov = curve_fit(func, x, y, initial_guess)
-        except:
-            return {}
-
-        y_fit = [func(a, pars[0], pars[1]) for a in x]
-
-        residuals = y - y_fit
-        ss_res = np.sum(residuals**2) + 0.0001
-        ss_tot = np.sum((y - np.mean(y))**2) + 0.0001
-        r_squared = 1 - (ss_res / ss_tot)
-
-        y_extrap = [func(a, pars[0], pars[1]) for a in range(5, 10)]
-
-        response = {"y_fit": y_fit,
-                "x": x_list,
-                "r_squared": r_squared,
-                "params": list(pars),
-                "y_extrap": y_extrap,
-                "input_y": list(y)
-                }
-        return response
+    @cached_property
+    def use_default_num_papers_curve(self):
+        return self.engine_value("use_default_num_papers_curve")
+
+    @cached_property
+    def curve_fit_for_num_papers(self):
+        return self.engine_value("curve_fit_for_num_papers")
 
     @cached_property
     def num_papers_slope_percent(self):
@@ -1072,69 +694,28 @@ class Journal(object):
 
     @cached_property
     def growth_scaling_downloads(self):
-        return self.num_papers_growth_from_2018_by_year
+        return self.engine_value("growth_scaling_downloads")
 
     @cached_property
     def growth_scaling_oa_downloads(self):
-        # todo add OA growing faster
-        return self.growth_scaling_downloads
+        return self.engine_value("growth_scaling_oa_downloads")
 
     @cached_property
     def num_papers_growth_from_2018_by_year(self):
-        num_papers_2021 = self.num_papers_by_year[4]
-        return [round(float(self.num_papers_by_year[year])/(num_papers_2021+1), 4) for year in self.years]
+        return self.engine_value("num_papers_growth_from_2018_by_year")
 
     @cached_property
     def num_papers_by_year(self):
-        my_curve_fit = None
-        nonzero_paper_years = [year for year in self.years if self.raw_num_papers_historical_by_year[year] >= 0.1*self.raw_num_papers_historical_by_year[4]]
-        # make sure it includes at least 4 years and the most recent year
-        from app import USE_PAPER_GROWTH
-        if USE_PAPER_GROWTH:
-            if len(nonzero_paper_years) >= 4 and self.papers_2021:
-                scipy_lock.acquire()
-                my_curve_fit = self.curve_fit_for_num_papers
-                scipy_lock.release()
-        if my_curve_fit and my_curve_fit["r_squared"] >= -0.1:
-            # print u"GREAT curve fit for {}, r_squared {}".format(self.issn_l, my_curve_fit.get("r_squared", "no r_squared"))
-            self.use_default_num_papers_curve = False
-            # only let it drop down below 25% of the most recent year
-            return [max(int(round(self.papers_2021 * 0.5)), num) for num in my_curve_fit["y_extrap"]]
-        else:
-            # print u"bad curve fit for {}, r_squared {}".format(self.issn_l, my_curve_fit.get("r_squared", "no r_squared"))
-            self.use_default_num_papers_curve = True
-            return [self.papers_2021 for year in self.years]
+        return self.engine_value("num_papers_by_year")
 
 
     @cached_property
     def raw_num_papers_historical_by_year(self):
-        # if self.issn_l == "0271-678X":
-        #     print "num_papers", self._scenario_data["num_papers"][self.issn_l]
-        if self.issn_l in self._scenario_data["num_papers"]:
-            my_raw_numbers = self._scenario_data["num_papers"][self.issn_l]
-            # historical goes up to 2019 but we don't have all the data for that yet
-
-            # yeah this is ugly depends on whether cached or not yuck
-            from app import USE_PAPER_GROWTH
-            if USE_PAPER_GROWTH:
-                if isinstance(list(my_raw_numbers.keys())[0], int):
-                    response = [my_raw_numbers.get(year, 0) for year in self.historical_years_by_year]
-                else:
-                    response = [my_raw_numbers.get(str(year), 0) for year in self.historical_years_by_year]
-            else:
-                if isinstance(list(my_raw_numbers.keys())[0], int):
-                    response = [my_raw_numbers.get(year-1, 0) for year in self.historical_years_by_year]
-                else:
-                    response = [my_raw_numbers.get(str(year-1), 0) for year in self.historical_years_by_year]
-
-        else:
-            response = [self.papers_2021 for year in self.years]
-
-        return response
+        return self.engine_value("raw_num_papers_historical_by_year")
 
     @cached_property
     def num_papers(self):
-        return round(np.mean(self.num_papers_by_year))
+        return self.engine_value("num_papers")
 
     @cached_property
     def use_instant_percent(self):
@@ -1144,9 +725,7 @@ class Journal(object):
 
     @cached_property
     def use_free_instant_percent(self):
-        if not self.use_total:
-            return 0
-        return min(100.0, round(100 * float(self.use_free_instant) / self.use_total, 4))
+        return self.engine_value("use_free_instant_percent")
 
     @cached_property
     def use_instant_percent_by_year(self):
@@ -1193,31 +772,27 @@ class Journal(object):
 
     @cached_property
     def num_green_historical_by_year(self):
-        # if self.issn_l == "0271-678X":
-        #     print "self.get_oa_data()", self.get_oa_data()
-        my_dict = self.get_oa_data()["green"]
-        return [my_dict.get(year, 0) for year in self.historical_years_by_year]
+        return self.engine_value("num_green_historical_by_year")
 
     @cached_property
     def num_green_historical(self):
-        return round(np.mean(self.num_green_historical_by_year), 4)
+        return self.engine_value("num_green_historical")
 
     @cached_property
     def downloads_oa_green(self):
-        return round(np.mean(self.downloads_oa_green_by_year), 4)
+        return self.engine_value("downloads_oa_green")
 
     @cached_property
     def use_oa_green(self):
-        return round(self.downloads_oa_green * self.use_weight_multiplier, 4)
+        return self.engine_value("use_oa_green")
 
     @cached_property
     def num_hybrid_historical_by_year(self):
-        my_dict = self.get_oa_data()["hybrid"]
-        return [my_dict.get(year, 0) for year in self.historical_years_by_year]
+        return self.engine_value("num_hybrid_historical_by_year")
 
     @cached_property
     def num_hybrid_historical(self):
-        return round(np.mean(self.num_hybrid_historical_by_year), 4)
+        return self.engine_value("num_hybrid_historical")
 
     # @cached_property
     # def downloads_oa_hybrid_by_year(self):
@@ -1228,22 +803,20 @@ class Journal(object):
 
     @cached_property
     def downloads_oa_hybrid(self):
-        return round(np.mean(self.downloads_oa_hybrid_by_year), 4)
+        return self.engine_value("downloads_oa_hybrid")
 
     @cached_property
     def use_oa_hybrid(self):
-        return round(self.downloads_oa_hybrid * self.use_weight_multiplier, 4)
+        return self.engine_value("use_oa_hybrid")
 
     @cached_property
     def num_bronze_historical_by_year(self):
-        my_dict = self.get_oa_data()["bronze"]
-        response = [my_dict.get(year, 0) for year in self.historical_years_by_year]
-        return response
+        return self.engine_value("num_bronze_historical_by_year")
 
 
     @cached_property
     def num_bronze_historical(self):
-        return round(np.mean(self.num_bronze_historical_by_year), 4)
+        return self.engine_value("num_bronze_historical")
 
     # @cached_property
     # def downloads_oa_bronze_by_year(self):
@@ -1254,97 +827,60 @@ class Journal(object):
 
     @cached_property
     def downloads_oa_bronze_by_year(self):
-        return self.sum_obs_pub_matrix_by_obs(self.oa_bronze_obs_pub)
+        return self.engine_value("downloads_oa_bronze_by_year")
 
     @cached_property
     def downloads_oa_bronze_older(self):
-        return (self.downloads_total_older_than_five_years/5.0) * (self.downloads_oa_bronze_by_age[4]/(self.downloads_by_age[4]+1))
+        return self.engine_value("downloads_oa_bronze_older")
 
     @cached_property
     def downloads_oa_green_older(self):
-        return (self.downloads_total_older_than_five_years/5.0) * (self.downloads_oa_green_by_age[4]/(self.downloads_by_age[4]+1))
+        return self.engine_value("downloads_oa_green_older")
 
     @cached_property
     def downloads_oa_hybrid_older(self):
-        return (self.downloads_total_older_than_five_years/5.0) * (self.downloads_oa_hybrid_by_age[4]/(self.downloads_by_age[4]+1))
+        return self.engine_value("downloads_oa_hybrid_older")
 
     @cached_property
     def downloads_oa_peer_reviewed_older(self):
-        return (self.downloads_total_older_than_five_years/5.0) * (self.downloads_oa_peer_reviewed_by_age[4]/(self.downloads_by_age[4]+1))
-
-    @cached_property
-    def oa_bronze_obs_pub(self):
-        by_age = self.downloads_oa_bronze_by_age
-        by_age_old = self.downloads_oa_bronze_older
-        growth_scaling = self.growth_scaling_oa_downloads
-        my_matrix = self.obs_pub_matrix(by_age, by_age_old, growth_scaling)
-        return my_matrix
+        return self.engine_value("downloads_oa_peer_reviewed_older")
 
     @cached_property
     def downloads_oa_hybrid_by_year(self):
-        return self.sum_obs_pub_matrix_by_obs(self.oa_hybrid_obs_pub)
-
-    @cached_property
-    def oa_hybrid_obs_pub(self):
-        by_age = self.downloads_oa_hybrid_by_age
-        by_age_old = self.downloads_oa_hybrid_older
-        growth_scaling = self.growth_scaling_oa_downloads
-        my_matrix = self.obs_pub_matrix(by_age, by_age_old, growth_scaling)
-        return my_matrix
+        return self.engine_value("downloads_oa_hybrid_by_year")
 
     @cached_property
     def downloads_oa_green_by_year(self):
-        return self.sum_obs_pub_matrix_by_obs(self.oa_green_obs_pub)
-
-    @cached_property
-    def oa_green_obs_pub(self):
-        by_age = self.downloads_oa_green_by_age
-        by_age_old = self.downloads_oa_green_older
-        growth_scaling = self.growth_scaling_oa_downloads
-        my_matrix = self.obs_pub_matrix(by_age, by_age_old, growth_scaling)
-        return my_matrix
+        return self.engine_value("downloads_oa_green_by_year")
 
     @cached_property
     def downloads_oa_peer_reviewed_by_year(self):
-        return self.sum_obs_pub_matrix_by_obs(self.oa_peer_reviewed_obs_pub)
-
-    @cached_property
-    def oa_peer_reviewed_obs_pub(self):
-        by_age = self.downloads_oa_peer_reviewed_by_age
-        by_age_old = self.downloads_oa_peer_reviewed_older
-        growth_scaling = self.growth_scaling_oa_downloads
-        my_matrix = self.obs_pub_matrix(by_age, by_age_old, growth_scaling)
-        return my_matrix
+        return self.engine_value("downloads_oa_peer_reviewed_by_year")
 
     @cached_property
     def downloads_oa_bronze(self):
-        return round(np.mean(self.downloads_oa_bronze_by_year), 4)
+        return self.engine_value("downloads_oa_bronze")
 
     @cached_property
     def use_oa_bronze(self):
-        return round(self.downloads_oa_bronze * self.use_weight_multiplier, 4)
+        return self.engine_value("use_oa_bronze")
 
 
     @cached_property
     def num_peer_reviewed_historical_by_year(self):
-        my_dict = self.get_oa_data(only_peer_reviewed=True)
-        response = defaultdict(int)
-        for oa_type in my_dict:
-            for year in self.historical_years_by_year:
-                response[year] += my_dict[oa_type].get(year, 0)
-        return [response[year] for year in self.historical_years_by_year]
+        return self.engine_value("num_peer_reviewed_historical_by_year")
 
     @cached_property
     def num_peer_reviewed_historical(self):
-        return round(np.mean(self.num_peer_reviewed_historical_by_year), 4)
+        return self.engine_value("num_peer_reviewed_historical")
 
     @cached_property
     def downloads_oa_peer_reviewed(self):
-        return round(np.mean(self.downloads_oa_peer_reviewed_by_year), 4)
+        return self.engine_value("downloads_oa_peer_reviewed")
 
     @cached_property
     def use_oa_peer_reviewed(self):
-        return round(self.downloads_oa_peer_reviewed * self.use_weight_multiplier, 4)
+        return self.engine_value("use_oa_peer_reviewed")
 
     @cached_property
     def is_society_journal(self):
@@ -1364,7 +900,7 @@ class Journal(object):
         return rows[self.issn_l]["baseline_access"]
 
 
-    def to_dict_journals(self):
+    def to_dict_journals(self, export_concepts=None):
         table_row = OrderedDict()
 
         table_row["issn_l"] = self.issn_l
@@ -1375,8 +911,12 @@ class Journal(object):
         
         if not self.__class__.__name__ == 'ConsortiumJournal':
             table_row["subject"] = self.subject
-            table_row["subject_top_three"] = self.subject_top_three
-            table_row["subjects_all"] = self.subjects_all
+            if export_concepts is None:
+                table_row["subject_top_three"] = self.subject_top_three
+                table_row["subjects_all"] = self.subjects_all
+            else:
+                table_row["subject_top_three"] = export_concepts.get(self.issn_l, {}).get("top_three", "")
+                table_row["subjects_all"] = export_concepts.get(self.issn_l, {}).get("all", "")
 
         table_row["subscribed"] = self.subscribed
 
@@ -2,12 +2,12 @@
 
 import datetime
 import simplejson as json
-from kids.cache import cache
 from cached_property import cached_property
 from time import time
 from enum import Enum
 
 from app import db
+from app import memorycache
 from util import elapsed
 from jisc_utils import jisc_default_prices
 
@@ -92,7 +92,7 @@ class JournalsDB(db.Model):
 	def __repr__(self):
 		return "<{} ({}) '{}' {}>".format(self.__class__.__name__, self.issn_l, self.title, self.publisher)
 
-@cache
+@memorycache
 def jdb_pricing():
 	start_time = time()
 	jdb_pricing_list = JournalsDB.query.all()
@@ -18,9 +18,12 @@ from util import elapsed
 from util import chunks
 from util import sql_bool
 from util import sql_escape_string
+from util import LazyData
+from util import register_lazy_data
 from journalsdb_pricing import jdb_pricing
 from jisc_utils import jisc_default_prices
 from openalex_date_last_doi import OpenalexDateLastDOI
+from issn_index import IssnIndex
 
 def safer_json_decode(json_str):
     try:
@@ -341,24 +344,38 @@ def recompute_journal_metadata():
 
 
 
-print("loading all journal metadata...", end=' ')
-start_time = time()
-all_journal_metadata_list = JournalMetadata.query.all()
-[db.session.expunge(my_journal_metadata) for my_journal_metadata in all_journal_metadata_list]
-all_journal_metadata = dict(list(zip([journal_object.issn_l for journal_object in all_journal_metadata_list], all_journal_metadata_list)))
-all_journal_metadata_flat = {}
-for issn_l, journal_metadata in all_journal_metadata.items():
-    for issn in journal_metadata.issns:
-        all_journal_metadata_flat[issn] = journal_metadata
-
-# load issns from openalex_computed_flat
-with get_db_cursor() as cursor:
-	cursor.execute("select issn from openalex_computed_flat")
-	rows = cursor.fetchall()
-
-oa_issns = [w[0] for w in rows]
-
-print("loaded all journal metadata in {} seconds.".format(elapsed(start_time)))
+def load_issn_index():
+	with get_db_cursor() as cursor:
+		cursor.execute("select issn, issn_l from openalex_computed_flat")
+		rows = cursor.fetchall()
+	return IssnIndex.from_rows((row[0], row[1]) for row in rows)
+
+def load_journal_metadata():
+	# its own session: this runs in whichever thread first uses the data, and
+	# closing db.session would close that caller's session mid-request
+	session = db.create_scoped_session()
+	try:
+		all_journal_metadata_list = session.query(JournalMetadata).all()
+		session.expunge_all()
+	finally:
+		session.remove()
+	all_journal_metadata = dict(list(zip([journal_object.issn_l for journal_object in all_journal_metadata_list], all_journal_metadata_list)))
+
+	# openalex_computed_flat is these same issns, flattened, so share its keys
+	all_journal_metadata_flat = {}
+	for issn, issn_l in issn_index.value.issn_l_by_issn.items():
+		if issn_l in all_journal_metadata:
+			all_journal_metadata_flat[issn] = all_journal_metadata[issn_l]
+	for issn_l, journal_metadata in all_journal_metadata.items():
+		for issn in journal_metadata.issns:
+			all_journal_metadata_flat.setdefault(issn, journal_metadata)
+	return {"all_journal_metadata": all_journal_metadata, "all_journal_metadata_flat": all_journal_metadata_flat}
+
+# loaded on first use, see LazyData in util.py
+issn_index = register_lazy_data("issn_index", load_issn_index)
+journal_metadata = register_lazy_data("journal_metadata", load_journal_metadata)
+all_journal_metadata = LazyData("all_journal_metadata", lambda: journal_metadata.value["all_journal_metadata"])
+all_journal_metadata_flat = LazyData("all_journal_metadata_flat", lambda: journal_metadata.value["all_journal_metadata_flat"])
 
 
 class MissingJournalMetadata(object):
@@ -366,7 +383,7 @@ class MissingJournalMetadata(object):
 		self.issn_l = issn_l
 		# only print below if issn actually not known to openalex
 		# in some cases we call this class with a subset of openalex ISSNs, leading to false positives
-		if issn_l not in oa_issns:
+		if issn_l not in issn_index:
 			print("MissingJournalMetadata: missing {} from openalex: https://api.openalex.org/venues/issn:{}".format(issn_l, issn_l))
 		super(MissingJournalMetadata, self).__init__()
 
@@ -620,6 +620,9 @@ class Package(db.Model):
 
         # go through all the upload rows
         for raw_file_upload_row in raw_file_upload_rows:
+            if raw_file_upload_row.get("claimed_by"):
+                # parse_uploads is loading this one, it's still in the preprocess bucket below
+                continue
             my_dict = data_files_dict[raw_file_upload_row["file"]]
             if (my_dict["name"] == raw_file_upload_row["file"]):
                 if raw_file_upload_row["to_delete_date"] != None:
@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import itertools
 import json
 import os
 import re
@@ -23,6 +24,7 @@ from app import reset_cache
 from consortium import Consortium
 from app import s3_client
 from excel import convert_spreadsheet_to_csv
+from issn_index import clean_issn
 from package_file_error_rows import PackageFileErrorRow
 from raw_file_upload_object import RawFileUploadObject
 from util import safe_commit
@@ -30,6 +32,12 @@ from util import safe_commit
 
 
 class PackageInput:
+    # normalize_rows streams the file, these bound what it holds on to
+    max_header_search_rows = 100
+    header_sample_size = 1000
+    max_error_rows = 1000
+    max_cached_cells = 100000
+
     @staticmethod
     def normalize_date(date_str, warn_if_blank=False, default=None):
         if date_str:
@@ -84,18 +92,15 @@ class PackageInput:
 
     @staticmethod
     def normalize_issn(issn, warn_if_blank=False):
-        from openalex import oa_issns
+        from openalex import issn_index
         if issn:
-            issn = issn.replace("issn:", "")
-            issn = sub(r"\s", "", issn).upper()
-            if re.match(r"^\d{4}-?\d{3}(?:X|\d)$", issn):
-                issn = issn.replace("-", "")
-                issn = issn[0:4] + "-" + issn[4:8]
-                if issn not in oa_issns:
+            (issn_type, issn) = clean_issn(issn)
+            if issn_type == "issn":
+                if issn not in issn_index:
                     print(f"Missing journal in normalize_issn {issn} from OpenAlex: https://api.openalex.org/venues/issn:{issn}")
                     return ParseWarning.unknown_issn
                 return issn
-            elif re.match(r"^[A-Z0-9]{4}-\d{3}(?:X|\d)$", issn):
+            elif issn_type == "bundle":
                 return ParseWarning.bundle_issn
             else:
                 return ParseWarning.bad_issn
@@ -128,8 +133,15 @@ class PackageInput:
     def ignore_row(self, row):
         return False
 
-    def apply_header(self, normalized_rows, header_rows):
-        return normalized_rows
+    def header_values(self, normalized_rows, header_rows):
+        # values to set on every row, from the rows above the column names
+        # and the first normalized rows
+        return {}
+
+    def revise_header_values(self, header_values, normalized_row):
+        # header values given a row past the header sample, for when one can
+        # still change them; see CounterInput
+        return header_values
 
     def update_subscriptions(self):
         pass
@@ -157,10 +169,20 @@ class PackageInput:
 
         return None
 
-    @cache
     def normalize_cell(self, normalized_column_name, raw_column_value):
+        # the same values come up over and over in a file, so remember them,
+        # up to max_cached_cells so a big file doesn't grow this without end
+        cell_cache = self.__dict__.setdefault("normalized_cell_cache", {})
+        key = (normalized_column_name, raw_column_value)
+        if key in cell_cache:
+            return cell_cache[key]
+
         spec = self.csv_columns()[normalized_column_name]
-        return spec["normalize"](raw_column_value, spec.get("warn_if_blank", False))
+        normalized_value = spec["normalize"](raw_column_value, spec.get("warn_if_blank", False))
+        if len(cell_cache) >= self.max_cached_cells:
+            cell_cache.clear()
+        cell_cache[key] = normalized_value
+        return normalized_value
 
 
     def _copy_staging_csv_to_s3(self, filename, package_id):
@@ -264,6 +286,18 @@ class PackageInput:
 
     def clear_caches(self, my_package):
         # print "clearing cache"
+        from saved_scenario import reset_live_scenario_cache
+        reset_live_scenario_cache(my_package.package_id)
+
+        # the reset above is a new package data version, so the old snapshot is stale either way
+        from package_snapshot import delete_package_snapshot, save_package_snapshot, package_snapshots_enabled
+        if package_snapshots_enabled():
+            try:
+                delete_package_snapshot(my_package.package_id)
+                save_package_snapshot(my_package.package_id)
+            except Exception as e:
+                print("Error: couldn't refresh the package snapshot for {}: {}".format(my_package.package_id, e))
+
         if my_package.is_owned_by_consortium:
             print("clearing consortium cache for my_package.is_owned_by_consortium: {}".format(my_package))
             for consortium_scenario_id in my_package.consortia_scenario_ids_who_own_this_package:
@@ -275,6 +309,7 @@ class PackageInput:
                 email = "scott+{}@ourresearch.org".format(my_package.package_id)
                 my_consortium.queue_for_recompute(email)
                 reset_cache("consortium", "consortium_get_computed_data", consortium_scenario_id)
+                reset_cache("consortium", "consortium_get_computed_frame", consortium_scenario_id)
 
         # my_package.clear_package_counter_breakdown_cache() # not used anymore
 
@@ -344,7 +379,7 @@ class PackageInput:
         line = csv_file.readline().rstrip()
         return len(re.split(',|;|\\s', line)) == 1
 
-    def normalize_rows(self, file_name, file_package=None):
+    def csv_file_name(self, file_name):
         # convert to csv if needed
         if file_name.endswith(".xls") or file_name.endswith(".xlsx"):
             sheet_csv_file_names = convert_spreadsheet_to_csv(file_name, parsed=False)
@@ -360,73 +395,93 @@ class PackageInput:
         # very slow, try not doing this for now
         # file_name = convert_to_utf_8(file_name)
         # logger.info("converted file: {}".format(file_name))
+        return file_name
 
-        with open(file_name, "r", encoding="utf-8-sig") as csv_file:
-            reader_params = {}
+    def csv_reader_params(self, csv_file, file_name):
+        reader_params = {}
+
+        if self.is_single_column_file(csv_file):
+            dialect = None
+            if file_name.endswith(".tsv"):
+                reader_params["delimiter"] = "\t"
+        else:
+            # determine the csv format
+            dialect_sample = ""
+            for i in range(0, 20):
+                next_line = csv_file.readline()
+                # ignore header row when determining dialect
+                # data rows should be more consistent with each other
+                if i > 0:
+                    dialect_sample = str(dialect_sample) + str(next_line)
+                if not next_line:
+                    break
 
-            if self.is_single_column_file(csv_file):
+            try:
+                dialect = csv.Sniffer().sniff(dialect_sample)
+                # logger.info(u"sniffed csv dialect:\n{}".format(json.dumps(vars(dialect), indent=2)))
+            except csv.Error:
                 dialect = None
                 if file_name.endswith(".tsv"):
                     reader_params["delimiter"] = "\t"
-            else:
-                # determine the csv format
-                dialect_sample = ""
-                for i in range(0, 20):
-                    next_line = csv_file.readline()
-                    # ignore header row when determining dialect
-                    # data rows should be more consistent with each other
-                    if i > 0:
-                        dialect_sample = str(dialect_sample) + str(next_line)
-                    if not next_line:
-                        break
 
-                try:
-                    dialect = csv.Sniffer().sniff(dialect_sample)
-                    # logger.info(u"sniffed csv dialect:\n{}".format(json.dumps(vars(dialect), indent=2)))
-                except csv.Error:
-                    dialect = None
-                    if file_name.endswith(".tsv"):
-                        reader_params["delimiter"] = "\t"
+        csv_file.seek(0)
+        return dialect, reader_params
 
-            csv_file.seek(0)
+    @staticmethod
+    def new_error_rows():
+        return {
+            "rows": [],
+            "headers": [{"id": "row_id", "name": "Row Number"}],
+            "num_rows": 0,
+        }
 
-            # turn rows into arrays - remember the first row that looks like a header
-            max_columns = 0
-            header_index = None
-            parsed_rows = []
-            line_no = 0  # the index in parsed_rows where this row will land
-            absolute_line_no = 0  # the actual file row we're parsing
-            parsed_to_absolute_line_no = {}
+    def iter_normalized_rows(self, file_name, error_rows):
+        """Yields the normalized rows of the file one at a time.
 
-            for line in csv.reader(csv_file, dialect=dialect, **reader_params):
-                absolute_line_no += 1
-                if not any([cell.strip() for cell in line]):
-                    continue
+        Memory doesn't grow with the file: the header is looked for in the
+        first max_header_search_rows non-blank rows, header values (see
+        header_values) are worked out from the first header_sample_size good
+        rows, and only the first max_error_rows rows with errors are kept in
+        error_rows["rows"]. error_rows["num_rows"] counts all of them.
 
-                parsed_rows.append(line)
-                parsed_to_absolute_line_no[line_no] = absolute_line_no
+        Every row gets the header values from the sample. Later rows can revise
+        them (see revise_header_values), so once all the rows are through,
+        header_values_used has the values for the file.
+        """
+        file_name = self.csv_file_name(file_name)
 
+        with open(file_name, "r", encoding="utf-8-sig") as csv_file:
+            dialect, reader_params = self.csv_reader_params(csv_file, file_name)
+
+            # (file line number, cells) for rows that aren't blank
+            def non_blank_lines():
+                for absolute_line_no, line in enumerate(csv.reader(csv_file, dialect=dialect, **reader_params), start=1):
+                    if any([cell.strip() for cell in line]):
+                        yield absolute_line_no, line
+
+            lines = non_blank_lines()
+
+            # remember the first row that looks like a header
+            prefix = []
+            max_columns = 0
+            header_index = None
+            for absolute_line_no, line in lines:
+                prefix.append((absolute_line_no, line))
                 populated_columns = len([cell for cell in line if cell.strip()])
                 if populated_columns > max_columns:
                     max_columns = populated_columns
-                    header_index = line_no
+                    header_index = len(prefix) - 1
                     logger.info("candidate header row: {}".format(", ".join(line)))
-
-                line_no += 1
+                if len(prefix) >= self.max_header_search_rows:
+                    break
 
             if header_index is None:
                 # give up. can't turn rows into dicts if we don't have a header
                 raise RuntimeError("Error: Couldn't identify a header row in the file.")
 
-            error_rows = {
-                "rows": [],
-                "headers": [{"id": "row_id", "name": "Row Number"}]
-            }
-
-            normalized_rows = []
-
             # make sure we have all the required columns
-            self.raw_column_names = parsed_rows[header_index]
+            header_rows = [line for (absolute_line_no, line) in prefix[0:header_index+1]]
+            self.raw_column_names = header_rows[-1]
             normalized_column_names = [self.normalize_column_name(cn) for cn in self.raw_column_names]
             raw_to_normalized_map = dict(list(zip(self.raw_column_names, normalized_column_names)))
             normalized_to_raw_map = {}
@@ -434,87 +489,153 @@ class PackageInput:
                 normalized_to_raw_map[v] = k
 
             required_keys = [k for k, v in list(self.csv_columns().items()) if v.get("required", True)]
-
-            # combine the header and data rows into dicts
-            row_dicts = [dict(list(zip(parsed_rows[header_index], x))) for x in parsed_rows[header_index+1:]]
-
             if set(required_keys).difference(set(normalized_column_names)):
                 raise RuntimeError("Error: missing required columns. Required: {}, Found: {}.".format(required_keys, self.raw_column_names))
 
-            for row_no, row in enumerate(row_dicts):
-                absolute_row_no = parsed_to_absolute_line_no[row_no] + header_index + 1
-                normalized_row = {}
-                cell_errors = {}
-
-                for raw_column_name in list(row.keys()):
-                    raw_value = row[raw_column_name]
-                    normalized_name = self.normalize_column_name(raw_column_name)
-                    if normalized_name:
-                        try:
-                            normalized_value = self.normalize_cell(normalized_name, raw_value)
-                            if normalized_value.__class__.__name__ == "ParseWarning":
-                                parse_warning = normalized_value
-                                # logger.info("parse warning: {} for data {},  {}".format(parse_warning, raw_column_name, row))
-                                cell_errors[normalized_name] = self.make_package_file_warning(parse_warning)
-                                normalized_row.setdefault(normalized_name, None)
-                            else:
-                                normalized_row.setdefault(normalized_name, normalized_value)
-                        except Exception as e:
-                            cell_errors[normalized_name] = self.make_package_file_warning(
-                                ParseWarning.unknown, additional_msg="message: {}".format(str(e))
-                            )
-
-                if self.ignore_row(normalized_row):
-                    continue
-
-                normalized_row = self.translate_row(normalized_row)
-
-                # keep the first issn in this row
-                for issn_col in self.issn_columns():
-                    if normalized_row.get(issn_col, None):
-                        row_issn = normalized_row[issn_col]
-                        [cell_errors.pop(c, None) for c in self.issn_columns()]  # delete errors for all issn columns
-                        [normalized_row.pop(c, None) for c in self.issn_columns()] # delete issn columns
-                        normalized_row["issn"] = row_issn
-                        break
+            for normalized, raw in list(normalized_to_raw_map.items()):
+                if normalized:
+                    error_rows["headers"].append({"id": normalized, "name": raw})
 
-                if not cell_errors:
-                    normalized_rows.append(normalized_row)
-                else:
-                    error_row = {
-                        "row_id": {
-                            "value": absolute_row_no,
-                            "error": None
-                        }
-                    }
+            # combine the header and data rows into dicts
+            data_lines = itertools.chain(prefix[header_index+1:], lines)
+            normalized_rows = (
+                self.normalize_row(dict(list(zip(self.raw_column_names, line))), absolute_line_no, raw_to_normalized_map, normalized_to_raw_map, error_rows)
+                for (absolute_line_no, line) in data_lines
+            )
+            normalized_rows = (row for row in normalized_rows if row is not None)
 
-                    for normalized_name in list(normalized_to_raw_map.keys()):
-                        if normalized_name:
-                            raw_name = normalized_to_raw_map[normalized_name]
+            # the header values come from the header rows and the first rows
+            sample = list(itertools.islice(normalized_rows, self.header_sample_size))
+            if not sample and not error_rows["num_rows"]:
+                raise RuntimeError("Error: No rows found")
 
-                            error_row[normalized_name] = {
-                                "value": row[raw_name],
-                                "error": cell_errors.get(normalized_name, None)
-                            }
+            values_from_header = self.header_values(sample, header_rows) if sample else {}
+            self.header_values_used = values_from_header
+            for normalized_row in sample:
+                normalized_row.update(values_from_header)
+                yield normalized_row
+            for normalized_row in normalized_rows:
+                self.header_values_used = self.revise_header_values(self.header_values_used, normalized_row)
+                normalized_row.update(values_from_header)
+                yield normalized_row
+
+    def normalize_row(self, row, absolute_row_no, raw_to_normalized_map, normalized_to_raw_map, error_rows):
+        # returns the normalized row, or None if it's ignored or has errors
+        normalized_row = {}
+        cell_errors = {}
+
+        for raw_column_name, raw_value in row.items():
+            normalized_name = raw_to_normalized_map[raw_column_name]
+            if normalized_name:
+                try:
+                    normalized_value = self.normalize_cell(normalized_name, raw_value)
+                    if normalized_value.__class__.__name__ == "ParseWarning":
+                        parse_warning = normalized_value
+                        # logger.info("parse warning: {} for data {},  {}".format(parse_warning, raw_column_name, row))
+                        cell_errors[normalized_name] = self.make_package_file_warning(parse_warning)
+                        normalized_row.setdefault(normalized_name, None)
+                    else:
+                        normalized_row.setdefault(normalized_name, normalized_value)
+                except Exception as e:
+                    cell_errors[normalized_name] = self.make_package_file_warning(
+                        ParseWarning.unknown, additional_msg="message: {}".format(str(e))
+                    )
+
+        if self.ignore_row(normalized_row):
+            return None
 
-                    error_rows["rows"].append(error_row)
+        normalized_row = self.translate_row(normalized_row)
+
+        # keep the first issn in this row
+        for issn_col in self.issn_columns():
+            if normalized_row.get(issn_col, None):
+                row_issn = normalized_row[issn_col]
+                [cell_errors.pop(c, None) for c in self.issn_columns()]  # delete errors for all issn columns
+                [normalized_row.pop(c, None) for c in self.issn_columns()] # delete issn columns
+                normalized_row["issn"] = row_issn
+                break
+
+        if not cell_errors:
+            return normalized_row
+
+        error_rows["num_rows"] += 1
+        if len(error_rows["rows"]) < self.max_error_rows:
+            error_row = {
+                "row_id": {
+                    "value": absolute_row_no,
+                    "error": None
+                }
+            }
 
-            for normalized, raw in list(normalized_to_raw_map.items()):
-                if normalized:
-                    error_rows["headers"].append({"id": normalized, "name": raw})
+            for normalized_name in list(normalized_to_raw_map.keys()):
+                if normalized_name:
+                    raw_name = normalized_to_raw_map[normalized_name]
 
-            if not normalized_rows and not error_rows['rows']:
-                raise RuntimeError("Error: No rows found")
+                    error_row[normalized_name] = {
+                        "value": row.get(raw_name, None),
+                        "error": cell_errors.get(normalized_name, None)
+                    }
 
-            if normalized_rows:
-                self.apply_header(normalized_rows, parsed_rows[0:header_index+1])
+            error_rows["rows"].append(error_row)
 
-            if not error_rows["rows"]:
-                error_rows = None
+        return None
+
+    def normalize_rows(self, file_name, file_package=None):
+        # all the rows at once, for when the file is known to be small
+        error_rows = self.new_error_rows()
+        normalized_rows = list(self.iter_normalized_rows(file_name, error_rows))
+        for normalized_row in normalized_rows:
+            normalized_row.update(self.header_values_used)
+
+        if not error_rows["rows"]:
+            error_rows = None
+
+        return normalized_rows, error_rows
+
+    def write_staging_csv(self, normalized_rows, package_id):
+        """Writes the rows to a temporary csv as they come, and returns the
+        file name, the sorted field names and the number of rows."""
+        normalized_csv_filename = tempfile.mkstemp()[1]
+        sorted_fields = None
+        written_header_values = None
+        num_rows = 0
+        try:
+            with open(normalized_csv_filename, "w", encoding="utf-8") as normalized_csv_file:
+                writer = None
+                for row in normalized_rows:
+                    row.update({"package_id": package_id})
+                    if writer is None:
+                        sorted_fields = sorted(row.keys())
+                        writer = csv.DictWriter(normalized_csv_file, delimiter=",", fieldnames=sorted_fields)
+                        written_header_values = dict((k, row.get(k)) for k in self.header_values_used)
+                    writer.writerow(row)
+                    num_rows += 1
 
-            return normalized_rows, error_rows
+            # rows past the header sample changed the header values, so write them again
+            if num_rows and written_header_values != self.header_values_used:
+                self.rewrite_staging_csv(normalized_csv_filename, sorted_fields, self.header_values_used)
+        except Exception:
+            # a parsing error part way through the file, the caller never sees the file name
+            os.remove(normalized_csv_filename)
+            raise
 
+        return normalized_csv_filename, sorted_fields, num_rows
 
+    @staticmethod
+    def rewrite_staging_csv(normalized_csv_filename, sorted_fields, values):
+        # set values on every row of the staging csv, a row at a time
+        rewritten_csv_filename = tempfile.mkstemp()[1]
+        try:
+            with open(normalized_csv_filename, "r", encoding="utf-8") as normalized_csv_file:
+                with open(rewritten_csv_filename, "w", encoding="utf-8") as rewritten_csv_file:
+                    writer = csv.DictWriter(rewritten_csv_file, delimiter=",", fieldnames=sorted_fields)
+                    for row in csv.DictReader(normalized_csv_file, fieldnames=sorted_fields):
+                        row.update(values)
+                        writer.writerow(row)
+            os.replace(rewritten_csv_filename, normalized_csv_filename)
+        finally:
+            if os.path.exists(rewritten_csv_filename):
+                os.remove(rewritten_csv_filename)
 
     def load(self, package_id, file_name, file_type, commit=False):
         my_package = db.session.query(package.Package).filter(package.Package.package_id == package_id).scalar()
@@ -522,8 +643,10 @@ class PackageInput:
         if "counter" in file_type:
             self.stored_file_type_label = file_type
 
+        error_rows = self.new_error_rows()
         try:
-            normalized_rows, error_rows = self.normalize_rows(file_name, file_package=my_package)
+            normalized_rows = self.iter_normalized_rows(file_name, error_rows)
+            normalized_csv_filename, sorted_fields, num_rows = self.write_staging_csv(normalized_rows, package_id)
         except (UnicodeError, UnicodeDecodeError, csv.Error) as e:
             print("normalize_rows error {}".format(e))
             err_mssg = str(e)
@@ -536,85 +659,81 @@ class PackageInput:
             self._copy_raw_to_s3(file_name, package_id, num_rows=None, error="parsing_error", error_details=str(e))
             return {"success": False, "message": str(e), "warnings": []}
 
-        # save normalized rows
-
-        aws_creds = "aws_access_key_id={aws_key};aws_secret_access_key={aws_secret}".format(
-            aws_key=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret=os.getenv("AWS_SECRET_ACCESS_KEY")
-        )
-
-        if normalized_rows:
-            for row in normalized_rows:
-                row.update({"package_id": package_id})
-                # logger.info(u"normalized row: {}".format(json.dumps(row)))
-
-            # delete what we've got
-            from counter import CounterInput
-
-            if isinstance(self, CounterInput):
-                report_name = normalized_rows[1]["report_name"]
-                report_version = normalized_rows[1]["report_version"]
-                # make sure to delete counter 4 if loading counter 5, or vice versa
-                if report_version == "4":
-                    self.delete(package_id, "trj2")
-                    self.delete(package_id, "trj3")
-                    self.delete(package_id, "trj4")
-                elif report_version == "5":
-                    self.delete(package_id, "jr1")
-
-                # and now delete the thing you are currently loading
-                self.delete(package_id, report_name)
-
-                # then set this for use further in the function
-                self.set_file_type_label(report_name)
-            else:
-                self.delete(package_id)
-
-            sorted_fields = sorted(normalized_rows[0].keys())
-            normalized_csv_filename = tempfile.mkstemp()[1]
-            num_rows = 0
-            with open(normalized_csv_filename, "w", encoding="utf-8") as normalized_csv_file:
-                writer = csv.DictWriter(normalized_csv_file, delimiter=",", fieldnames=sorted_fields)
-                for row in normalized_rows:
-                    num_rows += 1
-                    writer.writerow(row)
+        # the staging csv is removed however the load goes
+        try:
+            if not error_rows["rows"]:
+                error_rows = None
 
-            s3_object = self._copy_staging_csv_to_s3(normalized_csv_filename, package_id)
-
-            copy_cmd = text("""
-                copy {table} ({fields}) from '{s3_object}'
-                credentials :creds format as csv
-                timeformat 'auto';
-            """.format(
-                table=self.__tablename__,
-                fields=", ".join(sorted_fields),
-                s3_object=s3_object,
-            ))
-
-            print((copy_cmd.bindparams(creds=aws_creds)))
-            safe_commit(db)
-            db.session.execute(copy_cmd.bindparams(creds=aws_creds))
-            safe_commit(db)
-            self.update_dest_table(package_id)
-            self._copy_raw_to_s3(file_name, package_id, num_rows, error=None)
-            from filter_titles import FilterTitlesInput
-            if isinstance(self, FilterTitlesInput):
-                self.update_subscriptions(package_id)
-        else:
-            from collections import OrderedDict
-            try:
-                z = list(filter(lambda x: [v.get('error') for k, v in x.items()], error_rows['rows']))[0]
-                errors_dct = OrderedDict()
-                for k,v in z.items():
-                    if v.get('error'):
-                        errors_dct[k] = v.get('error')
+            # save normalized rows
 
-                errors_tup = next(iter(errors_dct.items()))
-                error_str = f"First error. Error reading column '{errors_tup[0]}': {errors_tup[1].get('message')}"
-            except:
-                error_str = None
+            aws_creds = "aws_access_key_id={aws_key};aws_secret_access_key={aws_secret}".format(
+                aws_key=os.getenv("AWS_ACCESS_KEY_ID"),
+                aws_secret=os.getenv("AWS_SECRET_ACCESS_KEY")
+            )
 
-            self._copy_raw_to_s3(file_name, package_id, num_rows=0, error="no_useable_rows", error_details=error_str)
+            if num_rows:
+                # delete what we've got
+                from counter import CounterInput
+
+                if isinstance(self, CounterInput):
+                    # every row has the same report name and version, from header_values
+                    report_name = self.header_values_used["report_name"]
+                    report_version = self.header_values_used["report_version"]
+                    # make sure to delete counter 4 if loading counter 5, or vice versa
+                    if report_version == "4":
+                        self.delete(package_id, "trj2")
+                        self.delete(package_id, "trj3")
+                        self.delete(package_id, "trj4")
+                    elif report_version == "5":
+                        self.delete(package_id, "jr1")
+
+                    # and now delete the thing you are currently loading
+                    self.delete(package_id, report_name)
+
+                    # then set this for use further in the function
+                    self.set_file_type_label(report_name)
+                else:
+                    self.delete(package_id)
+
+                s3_object = self._copy_staging_csv_to_s3(normalized_csv_filename, package_id)
+
+                copy_cmd = text("""
+                    copy {table} ({fields}) from '{s3_object}'
+                    credentials :creds format as csv
+                    timeformat 'auto';
+                """.format(
+                    table=self.__tablename__,
+                    fields=", ".join(sorted_fields),
+                    s3_object=s3_object,
+                ))
+
+                print((copy_cmd.bindparams(creds=aws_creds)))
+                safe_commit(db)
+                db.session.execute(copy_cmd.bindparams(creds=aws_creds))
+                safe_commit(db)
+                self.update_dest_table(package_id)
+                self._copy_raw_to_s3(file_name, package_id, num_rows, error=None)
+                from filter_titles import FilterTitlesInput
+                if isinstance(self, FilterTitlesInput):
+                    self.update_subscriptions(package_id)
+            else:
+                from collections import OrderedDict
+                try:
+                    z = list(filter(lambda x: [v.get('error') for k, v in x.items()], error_rows['rows']))[0]
+                    errors_dct = OrderedDict()
+                    for k,v in z.items():
+                        if v.get('error'):
+                            errors_dct[k] = v.get('error')
+
+                    errors_tup = next(iter(errors_dct.items()))
+                    error_str = f"First error. Error reading column '{errors_tup[0]}': {errors_tup[1].get('message')}"
+                except:
+                    error_str = None
+
+                self._copy_raw_to_s3(file_name, package_id, num_rows=0, error="no_useable_rows", error_details=error_str)
+        finally:
+            if os.path.exists(normalized_csv_filename):
+                os.remove(normalized_csv_filename)
 
         # delete the current errors, save new errors
         # self.save_errors(package_id, error_rows)
@@ -626,17 +745,19 @@ class PackageInput:
             if my_package:
                 self.clear_caches(my_package)
 
-        if normalized_rows:
+        if num_rows:
             return {
                 "success": True,
-                "message": "Inserted {} {} rows for package {}.".format(len(normalized_rows), self.__class__.__name__, package_id),
-                "warnings": error_rows
+                "message": "Inserted {} {} rows for package {}.".format(num_rows, self.__class__.__name__, package_id),
+                "warnings": error_rows,
+                "num_rows": num_rows
             }
         else:
             return {
                 "success": False,
                 "message": "No usable rows found.",
-                "warnings": error_rows
+                "warnings": error_rows,
+                "num_rows": 0
             }
 
 
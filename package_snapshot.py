@@ -0,0 +1,235 @@
+# Snapshots of a package's own scenario inputs: counter, citation and
+# authorship totals, core list, custom prices, perpetual access and the title
+# filter. Building a Scenario reads them back instead of querying Redshift.
+#
+# A snapshot is a gzipped pickle, kept on local disk and in S3:
+#
+#   <package_snapshot_dir>/<package_id>.v<format_version>.pickle.gz
+#   s3://unsub-cache/package_snapshots/<package_id>.v<format_version>.pickle.gz
+#
+# Each one records the package data version it was built at: the latest
+# jump_cache_status reset for the package (PackageInput.clear_caches) and the
+# latest upload in jump_raw_file_upload_object. A snapshot with any other
+# version is ignored and rebuilt.
+
+import os
+import gzip
+import pickle
+import tempfile
+from time import time
+
+import argparse
+
+from app import get_db_cursor
+from app import s3_client
+from util import elapsed
+
+
+# bump this when the contents change, old snapshots are then ignored
+format_version = 1
+# and this when the download curve fit changes, see scenario_engine.fit_download_curves
+download_curve_fits_format_version = 1
+
+package_snapshot_dir = os.getenv("PACKAGE_SNAPSHOT_DIR", os.path.join("data", "package_snapshots"))
+package_snapshot_bucket = "unsub-cache"
+package_snapshot_s3_prefix = "package_snapshots"
+
+
+def package_snapshots_enabled():
+    return os.getenv("PACKAGE_SNAPSHOTS", "True") == "True"
+
+
+def snapshot_file_name(package_id):
+    return "{}.v{}.pickle.gz".format(package_id, format_version)
+
+
+def get_package_inputs_version(package_id):
+    from saved_scenario import get_package_data_cache_call
+
+    command = """select
+        (select max(updated) from jump_cache_status where cache_call=%s) as package_data_updated,
+        (select max(created) from jump_raw_file_upload_object where package_id=%s and claimed_by is null) as uploaded,
+        (select max(to_delete_date) from jump_raw_file_upload_object where package_id=%s and claimed_by is null) as to_delete,
+        (select count(*) from jump_raw_file_upload_object where package_id=%s and claimed_by is null) as num_uploads"""
+    rows = []
+    with get_db_cursor() as cursor:
+        cursor.execute(command, (get_package_data_cache_call(package_id), package_id, package_id, package_id,))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    return "|".join(str(rows[0][key]) for key in ["package_data_updated", "uploaded", "to_delete", "num_uploads"])
+
+
+def build_package_inputs(package_id):
+    from package import get_custom_prices
+    from scenario import get_common_package_data_specific
+    from scenario import get_perpetual_access_from_cache
+    from scenario import get_journal_filter_issn_ls
+
+    (my_data_specific, my_timing) = get_common_package_data_specific(package_id)
+    return {
+        "specific": my_data_specific,
+        "prices": get_custom_prices(package_id),
+        "perpetual_access": get_perpetual_access_from_cache(package_id),
+        "journal_filter": get_journal_filter_issn_ls(package_id),
+    }
+
+
+def is_snapshottable(inputs, package_id):
+    # a consortium's inputs change with every member's uploads, which this version doesn't see
+    return inputs["specific"]["member_package_ids"] == [package_id]
+
+
+def dump_snapshot(package_id, version, inputs):
+    return gzip.compress(pickle.dumps({
+        "format_version": format_version,
+        "package_id": package_id,
+        "version": version,
+        "inputs": inputs,
+    }, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=6)
+
+
+def load_snapshot(snapshot_bytes, package_id, version):
+    snapshot = pickle.loads(gzip.decompress(snapshot_bytes))
+    if snapshot.get("format_version") != format_version or snapshot.get("package_id") != package_id:
+        return None
+    if snapshot.get("version") != version:
+        return None
+    return snapshot["inputs"]
+
+
+def read_local_snapshot(package_id, version):
+    path = os.path.join(package_snapshot_dir, snapshot_file_name(package_id))
+    try:
+        with open(path, "rb") as f:
+            return load_snapshot(f.read(), package_id, version)
+    except (IOError, OSError):
+        return None
+    except Exception as e:
+        print("Error: couldn't read package snapshot {}: {}".format(path, e))
+        return None
+
+
+def write_local_file(package_id, file_name, file_bytes):
+    os.makedirs(package_snapshot_dir, exist_ok=True)
+    # written to a temporary file and renamed, so readers never see half of one
+    (handle, temp_path) = tempfile.mkstemp(dir=package_snapshot_dir, prefix=".{}-".format(package_id))
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(file_bytes)
+        os.replace(temp_path, os.path.join(package_snapshot_dir, file_name))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_local_snapshot(package_id, snapshot_bytes):
+    write_local_file(package_id, snapshot_file_name(package_id), snapshot_bytes)
+
+
+def read_s3_snapshot(package_id, version):
+    try:
+        s3_object = s3_client.get_object(Bucket=package_snapshot_bucket, Key="{}/{}".format(package_snapshot_s3_prefix, snapshot_file_name(package_id)))
+        snapshot_bytes = s3_object["Body"].read()
+    except Exception:
+        return None, None
+    return load_snapshot(snapshot_bytes, package_id, version), snapshot_bytes
+
+
+def write_s3_snapshot(package_id, snapshot_bytes):
+    s3_client.put_object(Bucket=package_snapshot_bucket, Key="{}/{}".format(package_snapshot_s3_prefix, snapshot_file_name(package_id)), Body=snapshot_bytes)
+
+
+def save_package_snapshot(package_id, version=None, inputs=None):
+    """Builds (unless given) and writes a package's snapshot, locally and to S3.
+    Returns the inputs."""
+    start_time = time()
+    if version is None:
+        version = get_package_inputs_version(package_id)
+    if inputs is None:
+        inputs = build_package_inputs(package_id)
+    if not version or not is_snapshottable(inputs, package_id):
+        return inputs
+
+    snapshot_bytes = dump_snapshot(package_id, version, inputs)
+    try:
+        write_local_snapshot(package_id, snapshot_bytes)
+        write_s3_snapshot(package_id, snapshot_bytes)
+    except Exception as e:
+        print("Error: couldn't write package snapshot for {}: {}".format(package_id, e))
+    print("saved package snapshot for {}: {} bytes, {}s".format(package_id, len(snapshot_bytes), elapsed(start_time)))
+    return inputs
+
+
+def delete_package_snapshot(package_id):
+    path = os.path.join(package_snapshot_dir, snapshot_file_name(package_id))
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        s3_client.delete_object(Bucket=package_snapshot_bucket, Key="{}/{}".format(package_snapshot_s3_prefix, snapshot_file_name(package_id)))
+    except Exception as e:
+        print("Error: couldn't delete package snapshot for {} from s3: {}".format(package_id, e))
+
+
+def download_curve_fits_file_name(package_id):
+    return "{}.download_curve_fits.v{}.pickle.gz".format(package_id, download_curve_fits_format_version)
+
+
+def read_download_curve_fits(package_id):
+    """The download curve fits saved for a package, keyed by downloads-by-age
+    vector. They don't depend on the package data version: a vector that
+    changed is just a key that isn't there."""
+    if not package_snapshots_enabled():
+        return {}
+    path = os.path.join(package_snapshot_dir, download_curve_fits_file_name(package_id))
+    try:
+        with open(path, "rb") as f:
+            return pickle.loads(gzip.decompress(f.read()))
+    except (IOError, OSError):
+        return {}
+    except Exception as e:
+        print("Error: couldn't read download curve fits {}: {}".format(path, e))
+        return {}
+
+
+def write_download_curve_fits(package_id, fits):
+    if not package_snapshots_enabled():
+        return
+    try:
+        write_local_file(package_id, download_curve_fits_file_name(package_id),
+                         gzip.compress(pickle.dumps(fits, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=6))
+    except Exception as e:
+        print("Error: couldn't write download curve fits for {}: {}".format(package_id, e))
+
+
+def get_package_inputs(package_id):
+    """A package's scenario inputs, from the local snapshot, then S3, then the
+    database (writing a new snapshot). A warm read costs one small version query."""
+    if not package_snapshots_enabled():
+        return build_package_inputs(package_id)
+
+    version = get_package_inputs_version(package_id)
+    if version:
+        inputs = read_local_snapshot(package_id, version)
+        if inputs is not None:
+            return inputs
+
+        (inputs, snapshot_bytes) = read_s3_snapshot(package_id, version)
+        if inputs is not None:
+            try:
+                write_local_snapshot(package_id, snapshot_bytes)
+            except Exception as e:
+                print("Error: couldn't write package snapshot for {}: {}".format(package_id, e))
+            return inputs
+
+    return save_package_snapshot(package_id, version)
+
+
+# python package_snapshot.py --package_id=package-3WkCDEZTqo6S
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--package_id", type=str, help="package to snapshot", required=True)
+    parsed_args = parser.parse_args()
+
+    save_package_snapshot(parsed_args.package_id)
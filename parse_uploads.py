@@ -1,11 +1,15 @@
 # coding: utf-8
 
 import argparse
+import datetime
+import multiprocessing
 import os
 import random
-import datetime
+import shutil
+import socket
+import tempfile
 from time import sleep
-import boto3
+from time import time
 
 from app import s3_client
 from app import get_db_cursor
@@ -15,120 +19,368 @@ from perpetual_access import PerpetualAccessInput
 from journal_price import JournalPriceInput
 from filter_titles import FilterTitlesInput
 
+# how long a worker owns an upload it has claimed. a worker that dies
+# mid-load gives the file back to the others when this runs out.
+default_lease_seconds = 60 * 60
 
-def parse_uploads():
 
-    while True:
+class S3UploadStore(object):
+    """Uploads land in the preprocess bucket and are moved to the finished
+    bucket once they're loaded."""
+
+    def __init__(self):
+        self.preprocess_bucket = "unsub-file-uploads-preprocess-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads-preprocess"
+        self.finished_bucket = "unsub-file-uploads-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads"
+
+    @property
+    def name(self):
+        return self.preprocess_bucket
+
+    def list_uploads(self):
+        uploads = []
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.preprocess_bucket):
+            for s3_object in page.get("Contents", []):
+                uploads.append({
+                    "key": s3_object["Key"],
+                    "size": s3_object["Size"],
+                    "last_modified": s3_object["LastModified"].replace(tzinfo=None),
+                })
+        return uploads
+
+    def exists(self, key):
         try:
-            command = """select * from jump_raw_file_upload_object where to_delete_date is not null"""
-            with get_db_cursor() as cursor:
-                cursor.execute(command)
-                raw_file_upload_rows_to_delete = cursor.fetchall()
-            for row_to_delete in raw_file_upload_rows_to_delete:
-                file = row_to_delete["file"]
-                package_id = row_to_delete["package_id"]
-                if file == "price":
-                    JournalPriceInput().delete(package_id)
-                elif file == "perpetual-access":
-                    PerpetualAccessInput().delete(package_id)
-                elif file == "filter":
-                    FilterTitlesInput().delete(package_id)
-                else:
-                    report_name = "jr1"
-                    if "-" in file:
-                        report_name = file.split("-")[1]
-                    CounterInput().delete(package_id, report_name=report_name)
-                # the delete will also delete the raw row which will take it off this queue
+            s3_client.head_object(Bucket=self.preprocess_bucket, Key=key)
+        except s3_client.exceptions.ClientError:
+            return False
+        return True
 
-        except Exception as e:
-            print(("Error: exception1 {} during parse_uploads".format(e)))
-            try:
-                db.session.rollback()
-            except:
-                pass
+    def download(self, key, file_name):
+        # streams to disk in parts instead of reading the whole body into memory
+        s3_client.download_file(self.preprocess_bucket, key, file_name)
+
+    def finish(self, key):
+        copy_source = {"Bucket": self.preprocess_bucket, "Key": key}
+        s3_client.copy(copy_source, self.finished_bucket, key)
+        s3_client.delete_object(Bucket=self.preprocess_bucket, Key=key)
+
+    def discard(self, key):
+        s3_client.delete_object(Bucket=self.preprocess_bucket, Key=key)
+
+
+class LocalUploadStore(object):
+    """A directory standing in for the s3 buckets, for trying out the workers
+    locally: uploads are read from <directory>/preprocess and moved to
+    <directory>/finished. The loaders still write to the database and copy the
+    raw and staging files to s3 as usual."""
+
+    def __init__(self, directory):
+        self.preprocess_dir = os.path.join(directory, "preprocess")
+        self.finished_dir = os.path.join(directory, "finished")
+        os.makedirs(self.preprocess_dir, exist_ok=True)
+        os.makedirs(self.finished_dir, exist_ok=True)
+
+    @property
+    def name(self):
+        return self.preprocess_dir
+
+    def list_uploads(self):
+        uploads = []
+        for key in os.listdir(self.preprocess_dir):
+            file_stat = os.stat(os.path.join(self.preprocess_dir, key))
+            uploads.append({
+                "key": key,
+                "size": file_stat.st_size,
+                "last_modified": datetime.datetime.utcfromtimestamp(file_stat.st_mtime),
+            })
+        return uploads
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.preprocess_dir, key))
+
+    def download(self, key, file_name):
+        shutil.copyfile(os.path.join(self.preprocess_dir, key), file_name)
+
+    def finish(self, key):
+        os.replace(os.path.join(self.preprocess_dir, key), os.path.join(self.finished_dir, key))
+
+    def discard(self, key):
+        os.remove(os.path.join(self.preprocess_dir, key))
+
+
+def parse_upload_key(key):
+    # package-abc123_counter-trj2.xlsx -> ("package-abc123", "counter-trj2")
+    key_base = key.split(".")[0]
+    try:
+        package_id, filetype = key_base.split("_")
+    except ValueError:
+        return None
+    return package_id, filetype
+
+
+def get_loader(filetype):
+    if filetype.startswith("counter"):
+        return CounterInput()
+    elif filetype.startswith("perpetual-access"):
+        return PerpetualAccessInput()
+    elif filetype.startswith("price"):
+        return JournalPriceInput()
+    elif filetype.startswith("filter"):
+        return FilterTitlesInput()
+    return None
+
+
+def make_worker_id():
+    return "{}.{}".format(os.getenv("DYNO", socket.gethostname()), os.getpid())
+
+
+def claim_upload(package_id, key, bucket_name, worker_id, lease_seconds=default_lease_seconds):
+    """Claims an upload for this worker with a row in jump_raw_file_upload_object.
+
+    Claim rows use the upload's object key as `file`, so the loaders (which
+    delete rows by file type label) leave them alone. The table lock makes the
+    check and insert atomic; redshift doesn't enforce primary keys. An expired
+    claim is replaced. Returns True if this worker now holds the claim."""
+    command = """
+        begin;
+        lock jump_raw_file_upload_object;
+        delete from jump_raw_file_upload_object
+            where package_id=%(package_id)s and file=%(file)s and claim_expires < sysdate;
+        insert into jump_raw_file_upload_object (package_id, file, bucket_name, object_name, created, claimed_by, claim_expires)
+            select %(package_id)s, %(file)s, %(bucket_name)s, %(file)s, sysdate, %(worker_id)s, dateadd(second, %(lease_seconds)s, sysdate)
+            where not exists (
+                select 1 from jump_raw_file_upload_object where package_id=%(package_id)s and file=%(file)s
+            );
+        end;
+    """
+    values = {
+        "package_id": package_id,
+        "file": key,
+        "bucket_name": bucket_name,
+        "worker_id": worker_id,
+        "lease_seconds": lease_seconds,
+    }
+    rows = []
+    with get_db_cursor() as cursor:
+        cursor.execute(command, values)
+        cursor.execute(
+            "select claimed_by from jump_raw_file_upload_object where package_id=%s and file=%s",
+            (package_id, key,))
+        rows = cursor.fetchall()
+    return any(row["claimed_by"] == worker_id for row in rows)
+
+
+def release_upload(package_id, key, worker_id):
+    with get_db_cursor() as cursor:
+        cursor.execute(
+            "delete from jump_raw_file_upload_object where package_id=%s and file=%s and claimed_by=%s",
+            (package_id, key, worker_id,))
+
+
+class UploadMetrics(object):
+    """Per-file timing and throughput for one worker, with running totals."""
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.num_files = 0
+        self.num_failed = 0
+        self.num_bytes = 0
+        self.num_rows = 0
+        self.download_seconds = 0.0
+        self.load_seconds = 0.0
+        self.start_time = time()
 
+    def record(self, key, size, download_seconds, load_seconds, num_rows, success):
+        self.num_files += 1
+        self.num_failed += 0 if success else 1
+        self.num_bytes += size
+        self.num_rows += num_rows or 0
+        self.download_seconds += download_seconds
+        self.load_seconds += load_seconds
+
+        print("parse_uploads {}: {} {} {:.2f}MB, download {:.2f}s ({:.2f}MB/s), load {:.2f}s, {} rows ({:.0f} rows/s)".format(
+            self.worker_id,
+            key,
+            "loaded" if success else "failed",
+            size / 1e6,
+            download_seconds,
+            size / 1e6 / max(download_seconds, 1e-6),
+            load_seconds,
+            num_rows or 0,
+            (num_rows or 0) / max(load_seconds, 1e-6)))
+        print(self.summary())
+
+    def summary(self):
+        return "parse_uploads {}: {} files ({} failed), {:.1f}MB, {} rows, download {:.1f}s, load {:.1f}s, up {:.0f}s".format(
+            self.worker_id,
+            self.num_files,
+            self.num_failed,
+            self.num_bytes / 1e6,
+            self.num_rows,
+            self.download_seconds,
+            self.load_seconds,
+            time() - self.start_time)
+
+
+def process_deletes():
+    try:
+        command = """select * from jump_raw_file_upload_object where to_delete_date is not null"""
+        with get_db_cursor() as cursor:
+            cursor.execute(command)
+            raw_file_upload_rows_to_delete = cursor.fetchall()
+        for row_to_delete in raw_file_upload_rows_to_delete:
+            file = row_to_delete["file"]
+            package_id = row_to_delete["package_id"]
+            if file == "price":
+                JournalPriceInput().delete(package_id)
+            elif file == "perpetual-access":
+                PerpetualAccessInput().delete(package_id)
+            elif file == "filter":
+                FilterTitlesInput().delete(package_id)
+            else:
+                report_name = "jr1"
+                if "-" in file:
+                    report_name = file.split("-")[1]
+                CounterInput().delete(package_id, report_name=report_name)
+            # the delete will also delete the raw row which will take it off this queue
+
+    except Exception as e:
+        print(("Error: exception1 {} during parse_uploads".format(e)))
+        try:
+            db.session.rollback()
+        except:
+            pass
+
+
+def process_upload(store, upload, worker_id, metrics, lease_seconds=default_lease_seconds):
+    key = upload["key"]
+    parsed_key = parse_upload_key(key)
+    if not parsed_key:
+        # not a valid file, skip it
+        return False
+    package_id, filetype = parsed_key
+
+    loader = get_loader(filetype)
+    if not loader:
+        return False
+
+    if not claim_upload(package_id, key, store.name, worker_id, lease_seconds):
+        # another worker has it
+        return False
+
+    if not store.exists(key):
+        # another worker finished it after we listed the uploads
+        release_upload(package_id, key, worker_id)
+        return False
+
+    print(("loading {} {}".format(package_id, filetype)))
+    temp_dir = tempfile.mkdtemp()
+    # the loaders look at the file suffix, so keep the upload's name
+    file_name = os.path.join(temp_dir, key)
+    success = False
+    num_rows = None
+    download_seconds = 0.0
+    load_seconds = 0.0
+    try:
+        start_time = time()
+        store.download(key, file_name)
+        download_seconds = time() - start_time
+
+        start_time = time()
+        load_result = loader.load(package_id, file_name, filetype, commit=True)
+        load_seconds = time() - start_time
+        success = load_result["success"]
+        num_rows = load_result.get("num_rows")
+
+        print(("moving file {}".format(key)))
+        store.finish(key)
+        print("moved")
+
+    except Exception as e:
+        print(("Error: exception2 {} during parse_uploads on file {}".format(e, key)))
+        success = False
+        try:
+            db.session.rollback()
+        except:
+            pass
+
+        print(("because of error, deleting file {}".format(key)))
         try:
-            upload_preprocess_bucket = "unsub-file-uploads-preprocess-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads-preprocess"
-            upload_finished_bucket = "unsub-file-uploads-testing" if os.getenv("TESTING_DB") else "unsub-file-uploads"
-            preprocess_file_list = s3_client.list_objects(Bucket=upload_preprocess_bucket)
-            for preprocess_file in preprocess_file_list.get("Contents", []):
-                filename = preprocess_file["Key"]
-                filename_base = filename.split(".")[0]
-                try:
-                    package_id, filetype = filename_base.split("_")
-                except ValueError:
-                    # not a valid file, skip it
-                    continue
-
-                print(("loading {} {}".format(package_id, filetype)))
-                size = preprocess_file["Size"]
-                age_seconds = (datetime.datetime.utcnow() - preprocess_file["LastModified"].replace(tzinfo=None)).total_seconds()
-
-                s3_clientobj = s3_client.get_object(Bucket=upload_preprocess_bucket, Key=filename)
-                contents_string = s3_clientobj["Body"].read()
-                with open(filename, "wb") as temp_file:
-                    temp_file.write(contents_string)
-
-                loader = None
-                if filetype.startswith("counter"):
-                    loader = CounterInput()
-                elif filetype.startswith("perpetual-access"):
-                    loader = PerpetualAccessInput()
-                elif filetype.startswith("price"):
-                    loader = JournalPriceInput()
-                elif filetype.startswith("filter"):
-                    loader = FilterTitlesInput()
-
-                if loader:
-                    load_result = loader.load(package_id, filename, filetype, commit=True)
-
-                    print(("moving file {}".format(filename)))
-                    s3_resource = boto3.resource("s3")
-                    copy_source = {"Bucket": upload_preprocess_bucket, "Key": filename}
-                    s3_resource.meta.client.copy(copy_source, upload_finished_bucket, filename)
-                    s3_resource.Object(upload_preprocess_bucket, filename).delete()
-                    print("moved")
+            store.discard(key)
+            print(("because of error, deleted {}".format(key)))
+        except Exception as e:
+            print(("Error: couldn't delete {}: {}".format(key, e)))
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        release_upload(package_id, key, worker_id)
+        metrics.record(key, upload["size"], download_seconds, load_seconds, num_rows, success)
+
+    return True
+
+
+def parse_uploads(store=None, worker_id=None, lease_seconds=default_lease_seconds, handle_deletes=True, run_once=False):
+    store = store or S3UploadStore()
+    worker_id = worker_id or make_worker_id()
+    metrics = UploadMetrics(worker_id)
+    print("parse_uploads {}: watching {}".format(worker_id, store.name))
+
+    while True:
+        if handle_deletes:
+            process_deletes()
 
+        try:
+            # oldest first, so a big batch doesn't starve a single upload
+            uploads = sorted(store.list_uploads(), key=lambda upload: upload["last_modified"])
         except Exception as e:
-            print(("Error: exception2 {} during parse_uploads on file {}".format(e, filename)))
-            if loader and filename:
-                print(("because of error, deleting file {}".format(filename)))
-                s3_resource = boto3.resource("s3")
-                s3_resource.Object(upload_preprocess_bucket, filename).delete()
-                print(("because of error, deleted {}".format(filename)))
-
-            try:
-                db.session.rollback()
-            except:
-                pass
+            print(("Error: exception listing uploads in {}: {}".format(store.name, e)))
+            uploads = []
+
+        for upload in uploads:
+            process_upload(store, upload, worker_id, metrics, lease_seconds)
+
+        if run_once:
+            return metrics
 
         sleep( 2 * random.random())
-        # print ".",
 
-        # move the file
-        # write it into the file uploads table
-        # counter input and counter
+
+def run_worker(worker_number, local_dir, lease_seconds, run_once):
+    store = LocalUploadStore(local_dir) if local_dir else S3UploadStore()
+    worker_id = "{}.{}".format(make_worker_id(), worker_number)
+    # one worker per process is enough to keep the delete queue moving
+    parse_uploads(store, worker_id, lease_seconds, handle_deletes=(worker_number == 0), run_once=run_once)
 
 
+def run_worker_pool(num_workers, local_dir=None, lease_seconds=default_lease_seconds, run_once=False):
+    # spawn, not fork: each worker needs its own database connections
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for worker_number in range(num_workers):
+        process = context.Process(
+            target=run_worker,
+            args=(worker_number, local_dir, lease_seconds, run_once),
+            name="parse_uploads.{}".format(worker_number))
+        process.start()
+        processes.append(process)
 
+    for process in processes:
+        process.join()
 
-# python consortium_calculate.py
+
+# python parse_uploads.py
+# python parse_uploads.py --workers 4
+# python parse_uploads.py --workers 2 --local-dir /tmp/uploads --once
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run stuff :)")
+    parser.add_argument("--workers", help="Number of worker processes", type=int, default=int(os.getenv("PARSE_UPLOADS_WORKERS", 1)))
+    parser.add_argument("--local-dir", help="Read uploads from <dir>/preprocess instead of the s3 preprocess bucket", type=str, default=None)
+    parser.add_argument("--lease-seconds", help="How long a claim on an upload lasts", type=int, default=default_lease_seconds)
+    parser.add_argument("--once", help="Go through the uploads once and stop", action="store_true", default=False)
 
     parsed_args = parser.parse_args()
-    parsed_vars = vars(parsed_args)
-
-    parse_uploads()
-
-    # package_id = "package-nALodSzDfzqv"
-    # loader = PerpetualAccessInput()
-    # filename = "/Users/hpiwowar/Downloads/test-perpetual-access.csv"
-
-    # package_id = "package-DhFCs96d2Vnv"
-    # loader = CounterInput()
-    # filename = "/Users/hpiwowar/Downloads/package-DhFCs96d2Vnv_counter.xls"
-    #
-    # print loader.load(package_id, filename, commit=True)
 
-    # print loader.delete(package_id)
+    if parsed_args.workers > 1:
+        run_worker_pool(parsed_args.workers, parsed_args.local_dir, parsed_args.lease_seconds, parsed_args.once)
+    else:
+        run_worker(0, parsed_args.local_dir, parsed_args.lease_seconds, parsed_args.once)
@@ -0,0 +1,106 @@
+import argparse
+import builtins
+import os
+import sys
+from time import time
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class ImportTimer(object):
+    """Times the first import of every module while it's active. Cumulative
+    time includes the modules imported along the way, self time doesn't."""
+
+    def __init__(self):
+        self.original_import = None
+        self.cumulative = {}
+        self.self_time = {}
+        self.order = []
+        self.stack = []
+
+    def __enter__(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+        return self
+
+    def __exit__(self, *args):
+        builtins.__import__ = self.original_import
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        frame = {"name": name, "start": time(), "children": 0.0}
+        self.stack.append(frame)
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.stack.pop()
+            total = time() - frame["start"]
+            if name not in self.cumulative:
+                self.order.append(name)
+            self.cumulative[name] = self.cumulative.get(name, 0.0) + total
+            self.self_time[name] = self.self_time.get(name, 0.0) + total - frame["children"]
+            if self.stack:
+                self.stack[-1]["children"] += total
+
+    def is_repo_module(self, name):
+        module = sys.modules.get(name)
+        module_file = getattr(module, "__file__", None) or ""
+        return os.path.abspath(module_file).startswith(repo_dir) and "site-packages" not in module_file
+
+    def report(self, top=40, repo_only=False):
+        names = [name for name in self.order if not repo_only or self.is_repo_module(name)]
+        names = sorted(names, key=lambda name: self.cumulative[name], reverse=True)[:top]
+        lines = ["{: <45} {: >10} {: >10}".format("module", "cumulative", "self")]
+        for name in names:
+            lines.append("{: <45} {: >9.3f}s {: >9.3f}s".format(
+                name + ("" if self.is_repo_module(name) else " *"),
+                self.cumulative[name],
+                self.self_time[name]))
+        return lines
+
+
+def profile_startup(module_names, load_data=False, top=40, repo_only=False):
+    # we want the import cost alone, and then each dataset on its own
+    os.environ["PRELOAD_LAZY_DATA"] = "False"
+    if repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+
+    start_time = time()
+    with ImportTimer() as import_timer:
+        for module_name in module_names:
+            __import__(module_name)
+    import_seconds = time() - start_time
+
+    print("")
+    print("imported {} in {:.3f}s ({} modules, * = not in this repo)".format(", ".join(module_names), import_seconds, len(import_timer.order)))
+    print("\n".join(import_timer.report(top=top, repo_only=repo_only)))
+
+    from util import lazy_data_registry
+    print("")
+    print("{: <45} {: >10}".format("lazy data", "load"))
+    for name, lazy_data in lazy_data_registry.items():
+        if load_data:
+            try:
+                lazy_data.load()
+            except Exception as e:
+                print("error loading {}: {}".format(name, e))
+        load_seconds = "{}s".format(lazy_data.load_seconds) if lazy_data.loaded else "not loaded"
+        print("{: <45} {: >10}".format(name, load_seconds))
+
+
+# python profile_startup.py --profile-startup
+# python profile_startup.py --profile-startup --modules parse_uploads consortium_calculate --load-data
+# heroku run python profile_startup.py --profile-startup --load-data -r heroku
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile-startup", help="Report how long importing each module takes", action="store_true", default=False)
+    parser.add_argument("--modules", help="Modules to import, views (the web app) by default", nargs="+", default=["views"])
+    parser.add_argument("--load-data", help="Also load each lazy dataset and report how long it takes", action="store_true", default=False)
+    parser.add_argument("--top", help="Number of modules to show", type=int, default=40)
+    parser.add_argument("--repo-only", help="Only show modules in this repo", action="store_true", default=False)
+    parsed_args = parser.parse_args()
+
+    if parsed_args.profile_startup:
+        profile_startup(parsed_args.modules, load_data=parsed_args.load_data, top=parsed_args.top, repo_only=parsed_args.repo_only)
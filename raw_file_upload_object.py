@@ -13,6 +13,8 @@ class RawFileUploadObject(db.Model):
     error = db.Column(db.Text)
     error_details = db.Column(db.Text)
     to_delete_date = db.Column(db.DateTime)
+    claimed_by = db.Column(db.Text)
+    claim_expires = db.Column(db.DateTime)
 
     def __init__(self, **kwargs):
         self.created = datetime.datetime.utcnow().isoformat()
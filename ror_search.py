@@ -5,6 +5,8 @@ from whoosh.analysis import StandardAnalyzer
 from whoosh.fields import Schema, STORED, NGRAMWORDS, NUMERIC
 from whoosh.qparser import MultifieldParser
 
+from util import register_lazy_data
+
 _schema = Schema(
     ror=STORED(),
     grid=STORED(),
@@ -30,7 +32,11 @@ def _read_ror_csv_rows():
     return rows
 
 
-_ror_rows = dict((row['ror_id'], row) for row in _read_ror_csv_rows())
+def _load_ror_rows():
+    return dict((row['ror_id'], row) for row in _read_ror_csv_rows())
+
+
+_ror_rows = register_lazy_data('ror_rows', _load_ror_rows)
 
 
 def _create_index():
@@ -50,20 +56,23 @@ def _create_index():
     index_writer.commit()
 
 
-if not index.exists_in(_index_path):
-    _create_index()
+def _load_ror_index():
+    if not index.exists_in(_index_path):
+        _create_index()
 
-_index = index.open_dir(_index_path)
-_searcher = _index.searcher()
+    idx = index.open_dir(_index_path)
+    query_parser = MultifieldParser(
+        ['name', 'aliases'],
+        schema=idx.schema,
+        fieldboosts={
+            'name': 50,
+            'aliases': 1
+        }
+    )
+    return {'searcher': idx.searcher(), 'query_parser': query_parser}
 
-_query_parser = MultifieldParser(
-    ['name', 'aliases'],
-    schema=_index.schema,
-    fieldboosts={
-        'name': 50,
-        'aliases': 1
-    }
-)
+
+_ror_index = register_lazy_data('ror_index', _load_ror_index)
 
 _analyzer = StandardAnalyzer()
 
@@ -71,10 +80,10 @@ _analyzer = StandardAnalyzer()
 def autocomplete(query_str, results=10):
     query_str = ' '.join([t.text for t in _analyzer(query_str) if not 'university'.startswith(t.text)])
 
-    q = _query_parser.parse(query_str)
+    q = _ror_index['query_parser'].parse(query_str)
     return [
         _ror_rows[row['ror']] for row in
-        _searcher.search_page(q, 1, results, sortedby=[
+        _ror_index['searcher'].search_page(q, 1, results, sortedby=[
             sorting.FieldFacet('citation_score', reverse=True),
             sorting.FieldFacet('num_students', reverse=True),
             sorting.ScoreFacet(),
@@ -1,5 +1,7 @@
 # coding: utf-8
 
+import os
+import threading
 from cached_property import cached_property
 import simplejson as json
 import datetime
@@ -13,18 +15,152 @@ register_adapter(dict, Json)
 
 from app import db
 from app import get_db_cursor
+from app import build_cache_key
+from app import reset_cache
 from scenario import Scenario, openalex_export_concepts
 from app import DEMO_PACKAGE_ID
 from util import elapsed
 
+
+class LiveScenarioCache(object):
+    # Built Scenario objects, shared by all the requests a worker handles, so /summary,
+    # /journals, /details, /journal/<issn> and the exports don't each rebuild the model.
+    # There is one entry per scenario, good for one version of it:
+    # (latest jump_scenario_details_* updated, package data version).  The number of
+    # journals held stands in for memory use.
+
+    def __init__(self, max_scenarios, max_journals):
+        self.max_scenarios = max_scenarios
+        self.max_journals = max_journals
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.incremental_updates = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def num_journals(self):
+        return sum([entry["num_journals"] for entry in self.entries.values()])
+
+    def get(self, scenario_id, version):
+        with self.lock:
+            entry = self.entries.get(scenario_id, None)
+            if entry and entry["version"] == version:
+                self.entries.move_to_end(scenario_id)
+                self.hits += 1
+                return entry["scenario"]
+            self.misses += 1
+            return None
+
+    def set(self, scenario_id, version, scenario_definition, my_scenario):
+        num_journals = len(my_scenario.journals)
+        with self.lock:
+            self.entries.pop(scenario_id, None)
+            if num_journals > self.max_journals or not self.max_scenarios:
+                return
+            self.entries[scenario_id] = {
+                "version": version,
+                "package_id": my_scenario.package_id,
+                "definition": scenario_definition,
+                "num_journals": num_journals,
+                "scenario": my_scenario
+            }
+            while len(self.entries) > self.max_scenarios or self.num_journals > self.max_journals:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def update_definition(self, scenario_id, version, scenario_definition):
+        # a newer definition that only changes subscriptions is applied to the cached
+        # scenario by deltas; anything else means the scenario has to be rebuilt
+        with self.lock:
+            entry = self.entries.get(scenario_id, None)
+            if not entry:
+                return None
+            old_configs = (entry["definition"] or {}).get("configs", None)
+            new_configs = (scenario_definition or {}).get("configs", None)
+            if entry["version"][1:] != version[1:] or old_configs is None or old_configs != new_configs:
+                del self.entries[scenario_id]
+                self.invalidations += 1
+                return None
+            my_scenario = entry["scenario"]
+            my_scenario.set_subscriptions(scenario_definition.get("subrs", []), scenario_definition.get("customSubrs", []))
+            entry["version"] = version
+            entry["definition"] = scenario_definition
+            self.entries.move_to_end(scenario_id)
+            self.incremental_updates += 1
+            return my_scenario
+
+    def update_saved_definition(self, scenario_id, updated, scenario_definition):
+        with self.lock:
+            entry = self.entries.get(scenario_id, None)
+            if not entry:
+                return None
+            return self.update_definition(scenario_id, (updated, ) + entry["version"][1:], scenario_definition)
+
+    def invalidate_package(self, package_id):
+        with self.lock:
+            for scenario_id in [k for k, entry in self.entries.items() if entry["package_id"] == package_id]:
+                del self.entries[scenario_id]
+                self.invalidations += 1
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict([
+                ("hits", self.hits),
+                ("misses", self.misses),
+                ("incremental_updates", self.incremental_updates),
+                ("evictions", self.evictions),
+                ("invalidations", self.invalidations),
+                ("num_scenarios", len(self.entries)),
+                ("num_journals", self.num_journals),
+                ("max_scenarios", self.max_scenarios),
+                ("max_journals", self.max_journals),
+                ("scenarios", [{"scenario_id": scenario_id,
+                                "package_id": entry["package_id"],
+                                "num_journals": entry["num_journals"],
+                                "version": [str(v) if v else None for v in entry["version"]]}
+                               for scenario_id, entry in self.entries.items()]),
+            ])
+
+live_scenario_cache = LiveScenarioCache(int(os.getenv("LIVE_SCENARIO_CACHE_MAX_SCENARIOS", 8)),
+                                        int(os.getenv("LIVE_SCENARIO_CACHE_MAX_JOURNALS", 40000)))
+
+
+def get_scenario_details_tablename(scenario_id):
+    if scenario_id.startswith("demo"):
+        return "jump_scenario_details_demo"
+    return "jump_scenario_details_paid"
+
+def get_package_data_cache_call(package_id):
+    return build_cache_key("saved_scenario", "get_live_scenario", package_id)
+
+def reset_live_scenario_cache(package_id):
+    # the jump_cache_status row is the package data version, so this reaches every worker
+    live_scenario_cache.invalidate_package(package_id)
+    reset_cache("saved_scenario", "get_live_scenario", package_id)
+
+def get_live_scenario_version(scenario_id, package_id):
+    qry = sql.SQL("""select
+        (select max(updated) from {} where scenario_id=%s) as scenario_updated,
+        (select max(updated) from jump_cache_status where cache_call=%s) as package_data_updated""").format(
+        sql.Identifier(get_scenario_details_tablename(scenario_id)))
+    rows = None
+    with get_db_cursor() as cursor:
+        cursor.execute(qry, (scenario_id, get_package_data_cache_call(package_id)))
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    return (rows[0]["scenario_updated"], rows[0]["package_data_updated"])
+
+
 def save_raw_scenario_to_db(scenario_id, raw_scenario_definition, ip):
     print("in save_raw_scenario_to_db")
-    if scenario_id.startswith("demo"):
-        tablename = "jump_scenario_details_demo"
-    else:
-        tablename = "jump_scenario_details_paid"
+    tablename = get_scenario_details_tablename(scenario_id)
+    updated = datetime.datetime.utcnow()
     cols = ['scenario_id', 'updated', 'ip', 'scenario_json']
-    values = (scenario_id, datetime.datetime.utcnow(), ip, Json(raw_scenario_definition), )
+    values = (scenario_id, updated, ip, Json(raw_scenario_definition), )
     with get_db_cursor() as cursor:
         qry = sql.SQL("INSERT INTO {} ({}) values ({})").format( 
             sql.Identifier(tablename),
@@ -33,6 +169,9 @@ def save_raw_scenario_to_db(scenario_id, raw_scenario_definition, ip):
         print(cursor.mogrify(qry, values))
         cursor.execute(qry, values)
 
+    # other workers will see the new updated timestamp and catch up on their own
+    live_scenario_cache.update_saved_definition(scenario_id, updated, raw_scenario_definition)
+
 def save_raw_member_institutions_included_to_db(scenario_id, member_institutions_list, ip):
     with get_db_cursor() as cursor:
         cols = ['scenario_id', 'updated', 'ip', 'scenario_members']
@@ -109,23 +248,39 @@ def get_latest_scenario_raw(scenario_id, exclude_added_via_pushpull=False):
     return (updated, scenario_data)
 
 
-def get_latest_scenario(scenario_id, pkg_id=None, my_jwt=None):
-    my_saved_scenario = SavedScenario.query.get(scenario_id)
-    if my_saved_scenario:
-        package_id = my_saved_scenario.package_id
-    elif pkg_id:
-        package_id = pkg_id
-    else:
-        package_id = DEMO_PACKAGE_ID
+def get_latest_scenarios_raw(scenario_ids, exclude_added_via_pushpull=False):
+    # get_latest_scenario_raw for many scenarios in one query: {scenario_id: (updated, scenario_data)}
+    response = {scenario_id: (None, None) for scenario_id in scenario_ids}
+    if not scenario_ids:
+        return response
 
-    if scenario_id.startswith("demo"):
-        tablename = "jump_scenario_details_demo"
-    else:
-        tablename = "jump_scenario_details_paid"
+    rows = []
+    with get_db_cursor() as cursor:
+        # is not True includes false and null, importantly
+        pushpull_filter = "and added_via_pushpull is not True" if exclude_added_via_pushpull else ""
+        command = """select scenario_id, updated, scenario_json from (
+                select scenario_id, updated, scenario_json,
+                row_number() over (partition by scenario_id order by updated desc) as updated_rank
+                from jump_scenario_details_paid
+                where scenario_id in %s {}
+            ) where updated_rank = 1""".format(pushpull_filter)
+        cursor.execute(command, (tuple(set(scenario_ids)),))
+        rows = cursor.fetchall()
+
+    for row in rows:
+        scenario_data = json.loads(row["scenario_json"])
+        if not "member_added_subrs" in scenario_data:
+            scenario_data["member_added_subrs"] = []
+        response[row["scenario_id"]] = (row["updated"], scenario_data)
+
+    return response
+
+
+def get_latest_scenario_definition(scenario_id):
     rows = None
     with get_db_cursor() as cursor:
         qry = sql.SQL("select scenario_json from {} where scenario_id=%s order by updated desc limit 1").format( 
-            sql.Identifier(tablename))
+            sql.Identifier(get_scenario_details_tablename(scenario_id)))
         cursor.execute(qry, (scenario_id,))
         rows = cursor.fetchall()
 
@@ -136,7 +291,50 @@ def get_latest_scenario(scenario_id, pkg_id=None, my_jwt=None):
         if not "member_added_subrs" in scenario_data:
             scenario_data["member_added_subrs"] = []
 
+    return scenario_data
+
+
+def get_latest_scenario(scenario_id, pkg_id=None, my_jwt=None):
+    my_saved_scenario = SavedScenario.query.get(scenario_id)
+    if my_saved_scenario:
+        package_id = my_saved_scenario.package_id
+    elif pkg_id:
+        package_id = pkg_id
+    else:
+        package_id = DEMO_PACKAGE_ID
+
+    scenario_data = get_latest_scenario_definition(scenario_id)
+
+    my_scenario = Scenario(package_id, scenario_data, my_jwt=my_jwt)
+    return my_scenario
+
+
+def restart_timing(my_scenario, message):
+    # a cached scenario would otherwise keep adding to the timing of the request that built it
+    my_scenario.timing_messages = []
+    my_scenario.section_time = time()
+    my_scenario.log_timing(message)
+
+
+def get_live_scenario(scenario_id, package_id, my_jwt=None):
+    # like get_latest_scenario, but through live_scenario_cache
+    version = get_live_scenario_version(scenario_id, package_id)
+    if not version:
+        return get_latest_scenario(scenario_id, package_id, my_jwt)
+
+    my_scenario = live_scenario_cache.get(scenario_id, version)
+    if my_scenario:
+        restart_timing(my_scenario, "live scenario cache hit")
+        return my_scenario
+
+    scenario_data = get_latest_scenario_definition(scenario_id)
+    my_scenario = live_scenario_cache.update_definition(scenario_id, version, scenario_data)
+    if my_scenario:
+        restart_timing(my_scenario, "live scenario cache update")
+        return my_scenario
+
     my_scenario = Scenario(package_id, scenario_data, my_jwt=my_jwt)
+    live_scenario_cache.set(scenario_id, version, scenario_data, my_scenario)
     return my_scenario
 
 
@@ -265,9 +463,11 @@ class SavedScenario(db.Model):
 
     def set_live_scenario(self, my_jwt=None):
         if not hasattr(self, "live_scenario") or not self.live_scenario:
-            self.live_scenario = get_latest_scenario(self.scenario_id, self.package_id, my_jwt)
-        self.live_scenario.package_id = self.package_id
-        self.live_scenario.jwt = my_jwt
+            if self.package_id:
+                self.live_scenario = get_live_scenario(self.scenario_id, self.package_id, my_jwt)
+            else:
+                self.live_scenario = get_latest_scenario(self.scenario_id, self.package_id, my_jwt)
+                self.live_scenario.package_id = self.package_id
         return self.live_scenario
 
 
@@ -368,13 +568,13 @@ class SavedScenario(db.Model):
         return response
 
 
-    def to_dict_journals(self, gather_export_concepts = False):
+    def to_dict_journals(self, gather_export_concepts = False, stream_journals=False):
         self.set_live_scenario()  # in case not done
 
+        export_concepts = None
         if gather_export_concepts:
-            self.live_scenario.data['concepts'] = openalex_export_concepts(self.live_scenario.data['concepts'], self.live_scenario.my_package.unique_issns)
-            [setattr(j, 'subject_top_three', self.live_scenario.data['concepts'].get(j.issn_l, {}).get("top_three", "")) for j in self.live_scenario.journals]
-            [setattr(j, 'subjects_all', self.live_scenario.data['concepts'].get(j.issn_l, {}).get("all", "")) for j in self.live_scenario.journals]
+            # kept out of live_scenario, which later requests may get from live_scenario_cache
+            export_concepts = openalex_export_concepts(self.live_scenario.data['concepts'], self.live_scenario.my_package.unique_issns)
 
         response = OrderedDict()
         response["meta"] = self.to_dict_meta()
@@ -385,7 +585,11 @@ class SavedScenario(db.Model):
 
         response["consortial_proposal_dates"] = self.to_dict_feedback()
 
-        response["journals"] = [j.to_dict_journals() for j in self.live_scenario.journals_sorted_cpu]
+        if stream_journals:
+            # made one at a time while jsonify_streaming sends them
+            response["journals"] = (j.to_dict_journals(export_concepts) for j in self.live_scenario.journals_sorted_cpu)
+        else:
+            response["journals"] = [j.to_dict_journals(export_concepts) for j in self.live_scenario.journals_sorted_cpu]
 
         # these are used by consortium
         response["is_locked_pending_update"] = self.is_locked_pending_update
@@ -5,10 +5,8 @@ import gzip
 import datetime
 from cached_property import cached_property
 import numpy as np
-import pandas as pd
 from collections import defaultdict
 from collections import OrderedDict
-from kids.cache import cache
 import simplejson as json
 
 from app import use_groups
@@ -19,7 +17,7 @@ from app import db
 from app import logger
 from app import memorycache
 from app import s3_client
-from app import common_data_dict
+from app import common_data
 
 from time import time
 from util import elapsed
@@ -29,6 +27,67 @@ from util import get_sql_answer
 
 from journal import Journal
 from assumptions import Assumptions
+from scenario_engine import ScenarioEngine
+from scenario_engine import ranks_and_terciles
+
+# scenario totals that depend on which journals are subscribed, kept up to date by deltas
+# when a subscription changes.  True if the column counts for subscribed journals, False
+# if it counts for unsubscribed ones.
+subscription_total_columns = OrderedDict([
+    ("subscription_cost", True),
+    ("ill_cost", False),
+    ("use_subscription", True),
+    ("use_ill", False),
+    ("use_other_delayed", False),
+    ("use_subscription_by_year", True),
+    ("use_ill_by_year", False),
+    ("use_other_delayed_by_year", False),
+    ("downloads_subscription_by_year", True),
+    ("downloads_ill_by_year", False),
+    ("downloads_other_delayed_by_year", False),
+])
+
+# totals are rounded so deltas don't drift from a fresh sum.  the cost columns have at most
+# four decimals, so the cost totals come out exactly the same either way
+subscription_total_decimals = 6
+
+# engine columns ranked for the *_fuzzed_lookup and *_rank_lookup properties
+ranked_columns = [
+    "subscription_cost",
+    "cost_subscription_minus_ill",
+    "num_citations",
+    "num_authorships",
+    "use_total",
+    "downloads_total",
+    "cpu",
+    "old_school_cpu",
+]
+
+# scenario properties to recompute from the totals when a subscription changes
+subscription_dependent_properties = [
+    "subscribed",
+    "subscribed_bulk",
+    "subscribed_custom",
+    "downloads_actual_by_year",
+    "use_actual_by_year",
+    "downloads",
+    "use_actual",
+    "cost",
+    "cost_actual_ill",
+    "cost_actual_subscription",
+    "cost_saved_percent",
+    "cost_spent_percent",
+    "use_instant",
+    "use_instant_percent",
+    "use_instant_by_year",
+    "use_instant_percent_by_year",
+    "use_subscription",
+    "use_ill",
+    "use_other_delayed",
+    "use_subscription_percent",
+    "use_ill_percent",
+    "use_free_instant_percent",
+]
 
 def get_clean_package_id(http_request_args):
     if not http_request_args:
@@ -40,6 +99,15 @@ def get_clean_package_id(http_request_args):
 
 
 
+def get_journal_filter_issn_ls(package_id):
+    rows = []
+    with get_db_cursor() as cursor:
+        qry = "select distinct(issn_l) from jump_journal_filter where package_id = %s"
+        cursor.execute(qry, (package_id,))
+        rows = cursor.fetchall()
+    return [w[0] for w in rows]
+
+
 def get_fresh_journal_list(scenario, my_jwt):
 
     from package import Package
@@ -49,12 +117,11 @@ def get_fresh_journal_list(scenario, my_jwt):
     issn_ls = list(scenario.data["unpaywall_downloads_dict"].keys())
     issnls_to_build = [issn_l for issn_l in issn_ls if issn_l not in journals_to_exclude]
 
-    with get_db_cursor() as cursor:
-        qry = "select distinct(issn_l) from jump_journal_filter where package_id = %s"
-        cursor.execute(qry, (scenario.package_id,))
-        rows = cursor.fetchall()
-    if rows:
-        journals_to_include = [w[0] for w in rows]
+    if scenario.package_inputs:
+        journals_to_include = scenario.package_inputs["journal_filter"]
+    else:
+        journals_to_include = get_journal_filter_issn_ls(scenario.package_id)
+    if journals_to_include:
         issnls_to_build = [issn_l for issn_l in issnls_to_build if issn_l in journals_to_include]
 
     # only include things in the counter file
@@ -118,7 +185,14 @@ class Scenario(object):
         if not my_package or my_package.is_demo or package_id == DEMO_PACKAGE_ID:
             package_id_in_cache = DEMO_PACKAGE_ID
 
-        self.data = get_common_package_data(package_id_in_cache, my_package.unique_issns)
+        # the package's own inputs, from its snapshot when it has one (see package_snapshot.py)
+        self.package_inputs = None
+        if package_id_in_cache == self.package_id:
+            from package_snapshot import get_package_inputs
+            self.package_inputs = get_package_inputs(self.package_id)
+            self.log_timing("get_package_inputs")
+
+        self.data = get_common_package_data(package_id_in_cache, my_package.unique_issns, self.package_inputs)
         self.log_timing("get_common_package_data from_cache")
 
         self.set_clean_data()  #order for this one matters, after get common, before build journals
@@ -130,12 +204,19 @@ class Scenario(object):
         [j.set_scenario_data(self.data) for j in self.journals]
         self.log_timing("set data in journals")
 
+        package_id_for_journals = DEMO_PACKAGE_ID if my_package.is_demo else self.package_id_for_db
+        self.engine = ScenarioEngine([j.issn_l for j in self.journals], self.data, self.settings, package_id_for_journals)
+        for engine_row, journal in enumerate(self.journals):
+            journal.set_engine(self.engine, engine_row)
+        self.log_timing("compute scenario engine")
+
         if http_request_args:
             for journal in self.journals:
                 if journal.issn_l in http_request_args.get("subrs", []):
                     journal.set_subscribe_bulk()
                 if journal.issn_l in http_request_args.get("customSubrs", []):
                     journal.set_subscribe_custom()
+        self.set_subscription_totals()
         self.log_timing("subscribing to all journals")
 
 
@@ -150,7 +231,10 @@ class Scenario(object):
         from package import get_custom_prices
 
         prices_dict = {}
-        prices_uploaded_raw = get_custom_prices(self.package_id)
+        if self.package_inputs:
+            prices_uploaded_raw = self.package_inputs["prices"]
+        else:
+            prices_uploaded_raw = get_custom_prices(self.package_id)
 
         for my_issn_l, my_meta in self.my_package.journal_metadata.items():
             prices_dict[my_issn_l] = prices_uploaded_raw.get(my_issn_l, None)
@@ -179,7 +263,10 @@ class Scenario(object):
         self.data["unpaywall_downloads_dict"] = clean_dict
 
         # remove this
-        self.data["perpetual_access"] = get_perpetual_access_from_cache(self.package_id)
+        if self.package_inputs:
+            self.data["perpetual_access"] = self.package_inputs["perpetual_access"]
+        else:
+            self.data["perpetual_access"] = get_perpetual_access_from_cache(self.package_id)
 
         self.data["concepts"] = openalex_best_concepts(self.my_package.unique_issns)
 
@@ -187,7 +274,7 @@ class Scenario(object):
     @property
     def has_custom_perpetual_access(self):
         # perpetual_access_rows = get_perpetual_access_from_cache([self.package_id])
-        perpetual_access_rows = get_perpetual_access_from_cache(self.package_id)
+        perpetual_access_rows = self.data["perpetual_access"]
         if perpetual_access_rows:
             return True
         from app import suny_consortium_package_ids
@@ -219,14 +306,24 @@ class Scenario(object):
     def subscribed_custom(self):
         return [j for j in self.journals_sorted_cpu if j.subscribed_custom]
 
-    def fuzzed_lookup(self, var):
-        df = pd.DataFrame({"issn_l": [j.issn_l for j in self.journals], "lookup_value": [getattr(j, var) for j in self.journals]})
-        df["ranked"] = df.lookup_value.rank(method='first', na_option="keep")
-        if df.dropna().empty:
-            return dict(list(zip(df["issn_l"], ["-"] * len(df))))
-        if (len(df) == 1):
-            return dict(list(zip(df["issn_l"], "-")))
-        return dict(list(zip(df.issn_l, pd.qcut(df.ranked,  3, labels=["low", "medium", "high"]))))
+    @cached_property
+    def journal_ranks(self):
+        # every column the fuzzed and rank lookups use, ranked in one pass.  ties go by the
+        # journals' current order, like the pandas ranks did.  none of these columns depend
+        # on subscriptions, so set_subscriptions doesn't reset this
+        rows = np.array([j.engine_row for j in self.journals], dtype=int)
+        (ranks, terciles) = ranks_and_terciles([self.engine.columns[column][rows] for column in ranked_columns])
+        return {
+            "issn_ls": [j.issn_l for j in self.journals],
+            "rank": dict(list(zip(ranked_columns, ranks))),
+            "tercile": dict(list(zip(ranked_columns, terciles))),
+        }
+
+    def fuzzed_lookup(self, column):
+        return dict(list(zip(self.journal_ranks["issn_ls"], self.journal_ranks["tercile"][column].tolist())))
+
+    def rank_lookup(self, column):
+        return dict(list(zip(self.journal_ranks["issn_ls"], self.journal_ranks["rank"][column].tolist())))
 
     @cached_property
     def cost_subscription_fuzzed_lookup(self):
@@ -258,46 +355,122 @@ class Scenario(object):
 
     @cached_property
     def cpu_rank_lookup(self):
-        df = pd.DataFrame({"issn_l": [j.issn_l for j in self.journals], "lookup_value": [j.cpu for j in self.journals]})
-        df["rank"] = df.lookup_value.rank(method='first', na_option="keep")
-        return dict(list(zip(df.issn_l, df["rank"])))
+        return self.rank_lookup('cpu')
 
     @cached_property
     def old_school_cpu_rank_lookup(self):
-        df = pd.DataFrame({"issn_l": [j.issn_l for j in self.journals], "lookup_value": [j.old_school_cpu for j in self.journals]})
-        df["rank"] = df.lookup_value.rank(method='first', na_option="keep")
-        return dict(list(zip(df.issn_l, df["rank"])))
+        return self.rank_lookup('old_school_cpu')
 
 
+    def subscribed_mask(self):
+        # one entry per engine row; journals can be re-sorted so index by their row, not their position
+        response = np.zeros(self.engine.num_journals, dtype=bool)
+        for journal in self.journals:
+            response[journal.engine_row] = journal.subscribed
+        return response
+
+    def subscription_total_values(self, column):
+        values = self.engine.columns[column]
+        if column.startswith("downloads_"):
+            # journals with no downloads don't report any
+            values = np.where((self.engine.columns["downloads_total"] != 0)[:, None], values, 0)
+        return values
+
+    def set_subscription_totals(self):
+        self.subscribed_rows = self.subscribed_mask()
+        self.subscription_totals = {}
+        for column, counts_if_subscribed in subscription_total_columns.items():
+            mask = self.subscribed_rows if counts_if_subscribed else ~self.subscribed_rows
+            self.subscription_totals[column] = np.round(np.sum(self.subscription_total_values(column)[mask], axis=0), subscription_total_decimals)
+
+    def update_subscription_totals(self, journal):
+        # move one journal's numbers between the subscribed and unsubscribed totals
+        engine_row = journal.engine_row
+        if self.subscribed_rows[engine_row] == journal.subscribed:
+            return
+        self.subscribed_rows[engine_row] = journal.subscribed
+        if not self.subscribed_rows.any() or self.subscribed_rows.all():
+            # start again from exact sums so no rounding drift is left behind
+            self.set_subscription_totals()
+            return
+        for column, counts_if_subscribed in subscription_total_columns.items():
+            value = self.subscription_total_values(column)[engine_row]
+            if counts_if_subscribed == journal.subscribed:
+                self.subscription_totals[column] = np.round(self.subscription_totals[column] + value, subscription_total_decimals)
+            else:
+                self.subscription_totals[column] = np.round(self.subscription_totals[column] - value, subscription_total_decimals)
+
+    def set_subscriptions(self, subrs, custom_subrs):
+        # like the subrs and customSubrs in the http request args, but on a live scenario:
+        # only journals whose subscription changes are touched, and the scenario totals
+        # are adjusted by their deltas instead of being summed again
+        subrs = set(subrs or [])
+        custom_subrs = set(custom_subrs or [])
+        num_changed = 0
+        for journal in self.journals:
+            subscribed_bulk = journal.issn_l in subrs
+            subscribed_custom = journal.issn_l in custom_subrs
+            if journal.subscribed_bulk == subscribed_bulk and journal.subscribed_custom == subscribed_custom:
+                continue
+            if subscribed_bulk != journal.subscribed_bulk:
+                if subscribed_bulk:
+                    journal.set_subscribe_bulk()
+                else:
+                    journal.set_unsubscribe_bulk()
+            if subscribed_custom != journal.subscribed_custom:
+                if subscribed_custom:
+                    journal.set_subscribe_custom()
+                else:
+                    journal.set_unsubscribe_custom()
+            self.update_subscription_totals(journal)
+            num_changed += 1
+        if num_changed:
+            for key in subscription_dependent_properties:
+                self.__dict__.pop(key, None)
+        self.log_timing("set {} subscriptions".format(num_changed))
+        return num_changed
+
+    def engine_sum(self, column, mask=None):
+        values = self.engine.columns[column]
+        if mask is not None:
+            values = values[mask]
+        return np.sum(values, axis=0)
+
+    def actual_by_year(self, prefix):
+        # like Journal.use_actual_by_year summed over journals: subscription usage only counts
+        # for subscribed journals, ill and other delayed only for unsubscribed ones
+        response = {}
+        for group in use_groups:
+            column = "{}_{}_by_year".format(prefix, group)
+            if column in self.subscription_totals:
+                response[group] = self.subscription_totals[column].tolist()
+            else:
+                response[group] = np.sum(self.subscription_total_values(column), axis=0).tolist()
+        return response
+
     @cached_property
     def use_total_by_year(self):
-        return [np.sum([journal.use_total_by_year[year] for journal in self.journals]) for year in range(0, 5)]
+        return self.engine_sum("use_total_by_year").tolist()
 
     @cached_property
     def downloads_total_by_year(self):
-        return [np.sum([journal.downloads_total_by_year[year] for journal in self.journals]) for year in range(0, 5)]
+        return self.engine_sum("downloads_total_by_year").tolist()
 
     @cached_property
     def use_total(self):
-        return 1 + np.sum([journal.use_total for journal in self.journals])
+        return 1 + self.engine_sum("use_total")
 
     @cached_property
     def downloads_total(self):
-        return np.sum([journal.downloads_total for journal in self.journals])
+        return self.engine_sum("downloads_total")
 
     @cached_property
     def downloads_actual_by_year(self):
-        use = {}
-        for group in use_groups:
-            use[group] = [np.sum([journal.downloads_actual_by_year[group][year] for journal in self.journals]) for year in range(0, 5)]
-        return use
+        return self.actual_by_year("downloads")
 
     @cached_property
     def use_actual_by_year(self):
-        use = {}
-        for group in use_groups:
-            use[group] = [np.sum([journal.use_actual_by_year[group][year] for journal in self.journals]) for year in range(0, 5)]
-        return use
+        return self.actual_by_year("use")
 
     @cached_property
     def downloads(self):
@@ -315,7 +488,7 @@ class Scenario(object):
 
     @cached_property
     def use_paywalled(self):
-        response = round(sum([j.use_paywalled for j in self.journals if j.use_paywalled]))
+        response = round(self.engine_sum("use_paywalled"))
         response = max(0, response)
         response = min(response, self.use_total)
         return response
@@ -328,27 +501,27 @@ class Scenario(object):
 
     @cached_property
     def ill_cost(self):
-        return round(sum([j.ill_cost for j in self.journals]))
+        return round(self.engine_sum("ill_cost"))
 
     @cached_property
     def subscription_cost(self):
-        return round(sum([j.subscription_cost for j in self.journals]))
+        return round(self.engine_sum("subscription_cost"))
 
     @cached_property
     def cost_subscription_minus_ill(self):
-        return round(sum([j.cost_subscription_minus_ill for j in self.journals]))
+        return round(self.engine_sum("cost_subscription_minus_ill"))
 
     @cached_property
     def cost(self):
-        return round(sum([j.cost_actual for j in self.journals]), 2)
+        return round(self.subscription_totals["subscription_cost"] + self.subscription_totals["ill_cost"], 2)
 
     @cached_property
     def cost_actual_ill(self):
-        return round(sum([j.cost_actual for j in self.journals if not j.subscribed]), 2)
+        return round(self.subscription_totals["ill_cost"], 2)
 
     @cached_property
     def cost_actual_subscription(self):
-        return round(sum([j.cost_actual for j in self.journals if j.subscribed]), 2)
+        return round(self.subscription_totals["subscription_cost"], 2)
 
 
     @cached_property
@@ -396,9 +569,13 @@ class Scenario(object):
     def cost_spent_percent(self):
         return round(100 * float(self.cost) / self.cost_bigdeal_projected, 4)
 
+    @cached_property
+    def use_free_instant(self):
+        return self.engine_sum("use_free_instant")
+
     @cached_property
     def use_instant(self):
-        return 1 + np.sum([journal.use_instant for journal in self.journals])
+        return 1 + self.use_free_instant + self.subscription_totals["use_subscription"]
 
     @cached_property
     def use_instant_by_year(self):
@@ -427,21 +604,22 @@ class Scenario(object):
         return None
 
 
-    def do_wizardly_things(self, spend):
-        my_max = spend/100.0 * self.cost_bigdeal_projected
-
-        my_spend_so_far = np.sum([j.ill_cost for j in self.journals])
-
-        for journal in self.journals_sorted_cpu:
-            if journal.cost_subscription_minus_ill < 0:
-                my_spend_so_far += journal.cost_subscription_minus_ill
-                journal.set_subscribe_bulk()
-
-        for journal in self.journals_sorted_cpu:
-            my_spend_so_far += journal.cost_subscription_minus_ill
-            if my_spend_so_far > my_max:
-                return
-            journal.set_subscribe_bulk()
+    @cached_property
+    def spend_curve(self):
+        # doesn't depend on what's subscribed, so it isn't reset by set_subscriptions
+        from spend_curve import SpendCurve
+        return SpendCurve(self.engine.issn_ls,
+                          self.engine.columns["cost_subscription_minus_ill"],
+                          self.engine.columns["use_paywalled"],
+                          self.engine.columns["cpu"],
+                          base_spend=self.engine_sum("ill_cost"),
+                          base_use_instant=1 + self.use_free_instant,
+                          use_total=self.use_total,
+                          cost_bigdeal=self.cost_bigdeal_projected)
+
+    def knapsack_for_spend(self, spend, max_points=None):
+        from spend_curve import knapsack_for_budget
+        return knapsack_for_budget(self.spend_curve, self.spend_curve.spend_for_percent(spend), max_points=max_points)
 
     # Scott here: not used AFAICT
     # @cached_property
@@ -450,11 +628,11 @@ class Scenario(object):
 
     @cached_property
     def num_citations(self):
-        return round(np.sum([j.num_citations for j in self.journals]), 4)
+        return round(self.engine_sum("num_citations"), 4)
 
     @cached_property
     def num_authorships(self):
-        return round(np.sum([j.num_authorships for j in self.journals]), 4)
+        return round(self.engine_sum("num_authorships"), 4)
 
     @cached_property
     def num_citations_weight_percent(self):
@@ -466,54 +644,54 @@ class Scenario(object):
 
     @cached_property
     def use_social_networks(self):
-        return round(np.sum([j.use_social_networks for j in self.journals]))
+        return round(self.engine_sum("use_social_networks"))
 
     @cached_property
     def use_oa(self):
-        return round(np.sum([j.use_actual["oa_plus_social_networks"] for j in self.journals]))
+        return round(self.engine_sum("use_oa_plus_social_networks"))
 
     @cached_property
     def use_backfile(self):
-        return round(np.sum([j.use_actual["backfile"] for j in self.journals]))
+        return round(self.engine_sum("use_backfile"))
 
     @cached_property
     def use_subscription(self):
-        response = round(np.sum([j.use_actual["subscription"] for j in self.journals]))
+        response = round(self.subscription_totals["use_subscription"])
         if not response:
             response = 0.0
         return response
 
     @cached_property
     def use_ill(self):
-        return round(np.sum([j.use_actual["ill"] for j in self.journals]))
+        return round(self.subscription_totals["use_ill"])
 
     @cached_property
     def use_other_delayed(self):
-        return round(np.sum([j.use_actual["other_delayed"] for j in self.journals]))
+        return round(self.subscription_totals["use_other_delayed"])
 
     @cached_property
     def use_green(self):
-        return round(np.sum([j.use_oa_green for j in self.journals]))
+        return round(self.engine_sum("use_oa_green"))
 
     @cached_property
     def use_hybrid(self):
-        return round(np.sum([j.use_oa_hybrid for j in self.journals]))
+        return round(self.engine_sum("use_oa_hybrid"))
 
     @cached_property
     def use_bronze(self):
-        return round(np.sum([j.use_oa_bronze for j in self.journals]))
+        return round(self.engine_sum("use_oa_bronze"))
 
     @cached_property
     def use_peer_reviewed(self):
-        return round(np.sum([j.use_oa_peer_reviewed for j in self.journals]))
+        return round(self.engine_sum("use_oa_peer_reviewed"))
 
     @cached_property
     def downloads_counter_multiplier(self):
-        return round(np.mean([j.downloads_counter_multiplier for j in self.journals]), 4)
+        return round(np.mean(self.engine.columns["downloads_counter_multiplier"]), 4)
 
     @cached_property
     def use_weight_multiplier(self):
-        return round(np.mean([j.use_weight_multiplier for j in self.journals]), 4)
+        return round(np.mean(self.engine.columns["use_weight_multiplier"]), 4)
 
     @cached_property
     def use_subscription_percent(self):
@@ -589,12 +767,12 @@ class Scenario(object):
         return "<{} (n={})>".format(self.__class__.__name__, len(self.journals))
 
 
-@cache
+@memorycache
 def get_parent_consortium_package_id(package_id):
     q = """select consortium_package_id from jump_account_package where package_id = '{}'""".format(package_id)
     return get_sql_answer(db, q)
 
-@cache
+@memorycache
 def get_consortium_package_ids(package_id):
     command = "select package_id from jump_account_package where consortium_package_id=%s"
     rows = None
@@ -617,90 +795,110 @@ def get_counter_journals_by_report_name_from_db(package_id):
     return rows
 
 # don't cache because called after loading to get fresh data
-def get_counter_totals_from_db(package_id):
-    counter_dict = defaultdict(int)
-    command = """select issn_l, total::float, report_version, report_name, metric_type 
+def get_counter_totals_for_packages_from_db(package_ids):
+    # {package_id: {issn_l: total}} for many packages in one query
+    package_ids = tuple(set(package_ids))
+    counter_dicts = {package_id: defaultdict(int) for package_id in package_ids}
+    if not package_ids:
+        return counter_dicts
+
+    command = """select package_id, issn_l, total::float, report_version, report_name, metric_type 
         from jump_counter 
-        where package_id=%s
+        where package_id in %s
         and (report_name is null or report_name != 'trj4')
         """
     rows = None
     with get_db_cursor() as cursor:
-        cursor.execute(command, (package_id,))
+        cursor.execute(command, (package_ids,))
         rows = cursor.fetchall()
-    if rows:
-        is_counter5 = (rows[0]["report_version"] == "5")
-        for row in rows:
-            if is_counter5:
-                if row["report_name"] in ["trj2", "trj3"]:
-                    if row["metric_type"] in ["Unique_Item_Requests", "No_License"]:
-                        counter_dict[row["issn_l"]] += row.get("total", 0.0)
-                # else don't do anything with it for now
-            else:
-                counter_dict[row["issn_l"]] += row.get("total")
-    return counter_dict
+
+    is_counter5 = {}
+    for row in rows or []:
+        package_id = row["package_id"]
+        if package_id not in is_counter5:
+            is_counter5[package_id] = (row["report_version"] == "5")
+        if is_counter5[package_id]:
+            if row["report_name"] in ["trj2", "trj3"]:
+                if row["metric_type"] in ["Unique_Item_Requests", "No_License"]:
+                    counter_dicts[package_id][row["issn_l"]] += row.get("total", 0.0)
+            # else don't do anything with it for now
+        else:
+            counter_dicts[package_id][row["issn_l"]] += row.get("total")
+    return counter_dicts
 
 # don't cache because called after loading to get fresh data
-def get_package_specific_scenario_data_from_db(package_id):
+def get_counter_totals_from_db(package_id):
+    return get_counter_totals_for_packages_from_db([package_id])[package_id]
+
+def get_packages_grid_year_totals_from_db(table_name, column_name, package_ids, year):
+    # sum of column_name by package, issn_l and year, for the issn_ls in each package's counter
+    # table_name and column_name are ours, not user input
+    command = """with package_issns as (
+            select distinct package_id, issn_l from jump_counter where package_id in %(package_ids)s
+        )
+        select institution_package.package_id, t.issn_l, t.year::int, sum(t.{column_name}) as {column_name}
+        from {table_name} t
+        join jump_grid_id institution_grid on t.grid_id = institution_grid.grid_id
+        join jump_account_package institution_package on institution_grid.institution_id = institution_package.institution_id
+        join package_issns on package_issns.package_id = institution_package.package_id and package_issns.issn_l = t.issn_l
+        where t.year < %(year)s
+        and institution_package.package_id in %(package_ids)s
+        group by institution_package.package_id, t.issn_l, t.year""".format(table_name=table_name, column_name=column_name)
+    rows = None
+    with get_db_cursor() as cursor:
+        cursor.execute(command, {'year': year, 'package_ids': package_ids})
+        rows = cursor.fetchall()
+
+    response = {package_id: defaultdict(dict) for package_id in package_ids}
+    for row in rows or []:
+        response[row["package_id"]][row["issn_l"]][row["year"]] = round(row[column_name])
+    return response
+
+# don't cache because called after loading to get fresh data
+def get_packages_specific_scenario_data_from_db(package_ids, my_timing=None):
+    """get_package_specific_scenario_data_from_db for many packages (a consortium's
+    members) in three queries: counter, citations, authorships."""
+    package_ids = tuple(set(package_ids))
+    if not package_ids:
+        return {}
+
     timing = []
     section_time = time()
 
     now = datetime.datetime.utcnow()
 
-    counter_dict = get_counter_totals_from_db(package_id)
-
+    counter_dicts = get_counter_totals_for_packages_from_db(package_ids)
     timing.append(("time from db: counter", elapsed(section_time, 2)))
+    if my_timing:
+        my_timing.log_timing("get_counter_totals_for_packages_from_db")
     section_time = time()
 
-    command = """select citing.issn_l, citing.year::int, sum(num_citations) as num_citations
-        from jump_citing citing
-        join jump_grid_id institution_grid on citing.grid_id = institution_grid.grid_id
-        join jump_account_package institution_package on institution_grid.institution_id = institution_package.institution_id
-        where citing.year < %(year)s
-        and institution_package.package_id=%(package_id)s
-        and (citing.issn_l in (select distinct issn_l from jump_counter where package_id=%(package_id)s))
-        group by citing.issn_l, year"""
-    citation_rows = None
-    with get_db_cursor() as cursor:
-        cursor.execute(command, {'year': now.year, 'package_id': package_id})
-        citation_rows = cursor.fetchall()
-    citation_dict = defaultdict(dict)
-    for row in citation_rows:
-        citation_dict[row["issn_l"]][row["year"]] = round(row["num_citations"])
-
+    citation_dicts = get_packages_grid_year_totals_from_db("jump_citing", "num_citations", package_ids, now.year)
     timing.append(("time from db: citation_rows", elapsed(section_time, 2)))
+    if my_timing:
+        my_timing.log_timing("citation rows")
     section_time = time()
 
-    command = """
-        select authorship.issn_l, authorship.year::int, sum(num_authorships) as num_authorships
-        from jump_authorship authorship
-        join jump_grid_id institution_grid on authorship.grid_id = institution_grid.grid_id
-        join jump_account_package institution_package on institution_grid.institution_id = institution_package.institution_id
-        where authorship.year < %(year)s
-        and institution_package.package_id=%(package_id)s
-        and (authorship.issn_l in (select distinct issn_l from jump_counter where package_id=%(package_id)s))
-        group by authorship.issn_l, year"""
-    authorship_rows = None
-    with get_db_cursor() as cursor:
-        cursor.execute(command, {'year': now.year, 'package_id': package_id})
-        authorship_rows = cursor.fetchall()
-    authorship_dict = defaultdict(dict)
-    for row in authorship_rows:
-        authorship_dict[row["issn_l"]][row["year"]] = round(row["num_authorships"])
-
+    authorship_dicts = get_packages_grid_year_totals_from_db("jump_authorship", "num_authorships", package_ids, now.year)
     timing.append(("time from db: authorship_rows", elapsed(section_time, 2)))
-    section_time = time()
-
-    data = {
-        "timing": timing,
-        "counter_dict": counter_dict,
-        "citation_dict": citation_dict,
-        "authorship_dict": authorship_dict
-    }
+    if my_timing:
+        my_timing.log_timing("authorship rows")
+
+    response = {}
+    for package_id in package_ids:
+        response[package_id] = {
+            "timing": timing,
+            "counter_dict": counter_dicts[package_id],
+            "citation_dict": citation_dicts[package_id],
+            "authorship_dict": authorship_dicts[package_id]
+        }
+    return response
 
-    return data
+# don't cache because called after loading to get fresh data
+def get_package_specific_scenario_data_from_db(package_id):
+    return get_packages_specific_scenario_data_from_db([package_id])[package_id]
 
-@cache
+@memorycache
 def get_apc_data_from_db(input_package_id):
     if input_package_id == DEMO_PACKAGE_ID or input_package_id.startswith("demo"):
         input_package_id = DEMO_PACKAGE_ID
@@ -727,7 +925,7 @@ def get_perpetual_access_from_cache(package_id):
     return package_dict
 
 
-@cache
+@memorycache
 def get_core_list_from_db(input_package_id):
     command = "select issn_l, baseline_access from jump_core_journals where package_id=%s"
     with get_db_cursor() as cursor:
@@ -736,7 +934,7 @@ def get_core_list_from_db(input_package_id):
     my_dict = dict([(a["issn_l"], a) for a in rows])
     return my_dict
 
-@cache
+@memorycache
 def load_openalex_best_concepts_from_db(issns):
     concepts = {}
     if not issns:
@@ -754,9 +952,10 @@ def load_openalex_best_concepts_from_db(issns):
 def openalex_best_concepts(issns):
     return load_openalex_best_concepts_from_db(tuple(issns))
 
-@cache
-def load_openalex_export_concepts_from_db(concepts, issns):
+@memorycache
+def load_openalex_export_concepts_from_db(issns):
     start_time = time()
+    export_concepts = defaultdict(dict)
 
     # get top three concepts by score
     with get_db_cursor() as cursor:
@@ -764,7 +963,7 @@ def load_openalex_export_concepts_from_db(concepts, issns):
         rows = cursor.fetchall()
 
     for row in rows:
-        concepts[row['issn_l']].update({'top_three': row['top_three']})
+        export_concepts[row['issn_l']]['top_three'] = row['top_three']
 
     # get all the concepts and their openalex IDs
     with get_db_cursor() as cursor:
@@ -772,49 +971,68 @@ def load_openalex_export_concepts_from_db(concepts, issns):
         aggrows = cursor.fetchall()
 
     for aggrow in aggrows:
-        concepts[aggrow["issn_l"]].update({'all': aggrow["id_concept_all"]})
+        export_concepts[aggrow["issn_l"]]['all'] = aggrow["id_concept_all"]
 
     print(f"loaded openalex export concepts in {elapsed(start_time)} seconds")
 
-    return concepts
+    return dict(export_concepts)
 
 def openalex_export_concepts(concepts, issns):
-    return load_openalex_export_concepts_from_db(concepts, tuple(issns))
+    # a new dict, so the scenario's own concepts (shared by cached scenarios) keep their format
+    export_concepts = load_openalex_export_concepts_from_db(tuple(issns))
+    response = {}
+    for issn_l in set(concepts) | set(export_concepts):
+        response[issn_l] = dict(concepts.get(issn_l, {}))
+        response[issn_l].update(export_concepts.get(issn_l, {}))
+    return response
 
 def include_keys(dictionary, keys):
     """Filters a dict by only including certain keys."""
     key_set = set(keys) & set(dictionary.keys())
     return {key: dictionary[key] for key in key_set}
 
+def get_common_data_for(name, issns):
+    # the columnar store is memory-mapped and shared by all workers; the dict
+    # from the json is the fallback when there's no columnar build
+    my_common_data = common_data.value
+    if not isinstance(my_common_data, dict):
+        return my_common_data.table(name, issns)
+    if name.startswith("oa."):
+        return include_keys(my_common_data["oa"][name.split(".", 1)[1]], issns)
+    return include_keys(my_common_data[name], issns)
+
 def get_embargo_data_from_json(issns):
-    return include_keys(common_data_dict['embargo_dict'], issns)
+    return get_common_data_for("embargo_dict", issns)
 
 def get_unpaywall_downloads_from_json(issns):
-    return include_keys(common_data_dict['unpaywall_downloads_dict_raw'], issns)
+    return get_common_data_for("unpaywall_downloads_dict_raw", issns)
 
 def get_num_papers_from_json(issns):
-    return include_keys(common_data_dict['num_papers'], issns)
+    return get_common_data_for("num_papers", issns)
 
 def get_oa_data_from_json(issns):
     oa_dict = {}
     for submitted in ["with_submitted", "no_submitted"]:
         for bronze in ["with_bronze", "no_bronze"]:
             key = "{}_{}".format(submitted, bronze)
-            oa_dict[key] = include_keys(common_data_dict['oa'][key], issns)
+            oa_dict[key] = get_common_data_for("oa.{}".format(key), issns)
     return oa_dict
 
 def get_society_data_from_json(issns):
-    return include_keys(common_data_dict['society'], issns)
+    return get_common_data_for("society", issns)
 
 def get_social_networks_data_from_json(issns):
-    return include_keys(common_data_dict['social_networks'], issns)
+    return get_common_data_for("social_networks", issns)
 
 # not cached on purpose, because components are cached to save space
-def get_common_package_data(package_id, issns):
+def get_common_package_data(package_id, issns, package_inputs=None):
     my_data = {}
 
-    (my_data_specific, timing_specific) = get_common_package_data_specific(package_id)
-    my_data.update(my_data_specific)
+    if package_inputs:
+        my_data.update(package_inputs["specific"])
+    else:
+        (my_data_specific, timing_specific) = get_common_package_data_specific(package_id)
+        my_data.update(my_data_specific)
 
     my_data_common = get_common_package_data_for(issns)
     my_data.update(my_data_common)
@@ -834,9 +1052,7 @@ def get_common_package_data_specific(package_id):
         my_data["member_package_ids"] = [package_id]
     my_timing.log_timing("get_consortium_package_ids")
 
-    for member_package_id in my_data["member_package_ids"]:
-        my_data[member_package_id] = get_package_specific_scenario_data_from_db(member_package_id)
-        my_timing.log_timing("get_package_specific_scenario_data_from_db")
+    my_data.update(get_packages_specific_scenario_data_from_db(my_data["member_package_ids"], my_timing))
 
     my_data["core_list"] = get_core_list_from_db(package_id)
     my_timing.log_timing("get_core_list_from_db")
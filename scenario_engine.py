@@ -0,0 +1,714 @@
+# coding: utf-8
+
+import datetime
+from collections import OrderedDict
+from collections import defaultdict
+
+import numpy as np
+from scipy.special import expit
+
+# from future of OA paper, modified to be just elsevier, all colours
+default_download_by_age = [0.371269, 0.137739, 0.095896, 0.072885, 0.058849]
+default_download_older_than_five_years = 1.0 - sum(default_download_by_age)
+
+# the obs/pub matrix is five observation years by fifteen publication years; every
+# observation year sees papers aged 0-9, at pub index obs_index + 10 - age
+num_obs_years = 5
+num_pub_years = 15
+num_ages = 10
+pub_index_by_obs_age = np.array([[obs_index + 10 - age for age in range(num_ages)] for obs_index in range(num_obs_years)])
+
+# fitted download curves keyed by the input downloads-by-age vector, least
+# recently used first.  the same journal downloads come back on every scenario
+# build for a package, so after the first build the fits are lookups; they are
+# also saved per package next to its snapshot (see package_snapshot.py), so other
+# processes and restarts don't fit them again
+download_curve_fit_cache = OrderedDict()
+download_curve_fit_cache_max_size = 250000
+
+
+def fit_expit_curves(y, max_iterations=400, ftol=1.49012e-08, xtol=1.49012e-08):
+    """
+    Least squares fit of b + a * expit(x / c) to every row of y at once, x = 0..4.
+
+    Levenberg-Marquardt with every row stepping in lockstep: the 3x3 normal equations
+    for all rows are solved in one batched call.  Starts from the same initial guess the
+    old per-journal scipy curve_fit used.  Returns (params, converged), params is (rows, 3).
+    """
+    y = np.asarray(y, dtype=float)
+    num_rows = len(y)
+    x = np.arange(y.shape[1], dtype=float)
+    params = np.column_stack([np.max(y, axis=1), np.full(num_rows, 30.0), np.full(num_rows, -1.0)])  # determined empirically
+
+    def residuals_and_jacobian(my_params, my_y):
+        a, b, c = my_params[:, 0:1], my_params[:, 1:2], my_params[:, 2:3]
+        with np.errstate(all="ignore"):
+            z = x[None, :] / c
+            s = expit(z)
+            residuals = my_y - (b + a * s)
+            jacobian = np.stack([s, np.ones_like(s), -a * s * (1 - s) * z / c], axis=2)
+        return residuals, jacobian
+
+    residuals, jacobian = residuals_and_jacobian(params, y)
+    cost = np.sum(residuals**2, axis=1)
+    # scale the damping by the largest curvature seen for each parameter, like minpack does
+    scale = np.diagonal(np.einsum("rki,rkj->rij", jacobian, jacobian), axis1=1, axis2=2).copy()
+    damping = np.max(scale, axis=1)
+    damping_growth = np.full(num_rows, 2.0)
+    converged = np.zeros(num_rows, dtype=bool)
+    active = np.isfinite(cost)
+
+    for iteration in range(max_iterations):
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+
+        my_jacobian = jacobian[rows]
+        jtj = np.einsum("rki,rkj->rij", my_jacobian, my_jacobian)
+        gradient = np.einsum("rki,rk->ri", my_jacobian, residuals[rows])
+        scale[rows] = np.maximum(scale[rows], np.diagonal(jtj, axis1=1, axis2=2))
+        damped = jtj + np.eye(3)[None, :, :] * (damping[rows, None] * (scale[rows] + 1e-12))[:, :, None]
+        try:
+            step = np.linalg.solve(damped, gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = np.array([np.linalg.lstsq(my_damped, my_gradient, rcond=None)[0] for my_damped, my_gradient in zip(damped, gradient)])
+
+        new_params = params[rows] + step
+        new_residuals, new_jacobian = residuals_and_jacobian(new_params, y[rows])
+        new_cost = np.sum(new_residuals**2, axis=1)
+        predicted_reduction = np.einsum("ri,ri->r", step, damping[rows, None] * scale[rows] * step + gradient)
+        with np.errstate(all="ignore"):
+            gain_ratio = (cost[rows] - new_cost) / np.where(predicted_reduction > 0, predicted_reduction, np.inf)
+        improved = np.isfinite(new_cost) & (gain_ratio > 0)
+
+        accepted = rows[improved]
+        small_reduction = (cost[accepted] - new_cost[improved]) <= ftol * cost[accepted]
+        small_step = np.linalg.norm(step[improved], axis=1) <= xtol * (np.linalg.norm(params[accepted], axis=1) + xtol)
+        params[accepted] = new_params[improved]
+        residuals[accepted] = new_residuals[improved]
+        jacobian[accepted] = new_jacobian[improved]
+        cost[accepted] = new_cost[improved]
+        damping[accepted] *= np.maximum(1 / 3.0, 1 - (2 * gain_ratio[improved] - 1)**3)
+        damping_growth[accepted] = 2.0
+        converged[accepted[small_reduction | small_step]] = True
+
+        rejected = rows[~improved]
+        damping[rejected] *= damping_growth[rejected]
+        damping_growth[rejected] *= 2
+        # no step helps any more, so we are at the minimum
+        converged[rejected[damping[rejected] > 1e16]] = True
+
+        active &= ~converged
+
+    return params, converged
+
+
+def cache_download_curve_fit(key, fit):
+    download_curve_fit_cache[key] = fit
+    download_curve_fit_cache.move_to_end(key)
+    while len(download_curve_fit_cache) > download_curve_fit_cache_max_size:
+        download_curve_fit_cache.popitem(last=False)
+
+
+def fit_download_curves(downloads_by_age_rows, package_id=None):
+    """
+    Fitted download curves for each row of downloads by age, in the form the old
+    per-journal curve_fit_for_downloads returned, {} where the fit blows up.
+    Fits come from download_curve_fit_cache, then the fits saved for package_id,
+    and only the rest are fitted.
+    """
+    keys = [tuple(row) for row in np.asarray(downloads_by_age_rows, dtype=float).tolist()]
+    fits = {}
+    for key in keys:
+        if key in download_curve_fit_cache:
+            download_curve_fit_cache.move_to_end(key)
+            fits[key] = download_curve_fit_cache[key]
+    missing_keys = [key for key in OrderedDict.fromkeys(keys) if key not in fits]
+
+    if missing_keys and package_id:
+        from package_snapshot import read_download_curve_fits
+        saved_fits = read_download_curve_fits(package_id)
+        fits.update((key, saved_fits[key]) for key in missing_keys if key in saved_fits)
+    keys_to_fit = [key for key in missing_keys if key not in fits]
+
+    if keys_to_fit:
+        y = np.array(keys_to_fit)
+        params, converged = fit_expit_curves(y)
+        x = np.arange(y.shape[1], dtype=float)
+        with np.errstate(all="ignore"):
+            y_fit = params[:, 1:2] + params[:, 0:1] * expit(x[None, :] / params[:, 2:3])
+        ss_res = np.sum((y - y_fit)**2, axis=1) + 0.0001
+        ss_tot = np.sum((y - np.mean(y, axis=1)[:, None])**2, axis=1) + 0.0001
+        r_squared = 1 - (ss_res / ss_tot)
+
+        for i, key in enumerate(keys_to_fit):
+            if np.all(np.isfinite(y_fit[i])):
+                fits[key] = {"y_fit": y_fit[i].tolist(),
+                             "r_squared": float(r_squared[i]),
+                             "params": params[i].tolist(),
+                             "input_y": list(key)}
+            else:
+                fits[key] = {}
+
+    for key in missing_keys:
+        cache_download_curve_fit(key, fits[key])
+    if keys_to_fit and package_id:
+        from package_snapshot import write_download_curve_fits
+        write_download_curve_fits(package_id, dict((key, fits[key]) for key in OrderedDict.fromkeys(keys)))
+
+    return [fits[key] for key in keys]
+
+
+def fit_num_papers_curve(raw_num_papers_historical_by_year, threshold):
+    x_list = []
+    y_list = []
+    for year in range(0, 5):
+        if raw_num_papers_historical_by_year[year] >= threshold * raw_num_papers_historical_by_year[4]:
+            x_list.append(year)
+            y_list.append(raw_num_papers_historical_by_year[year])
+    if len(x_list) < 2:
+        return {}
+    x = np.array(x_list, dtype=float)
+    y = np.array(y_list, dtype=float)
+
+    # a straight line, so least squares has a closed form
+    m, b = np.polyfit(x, y, 1)
+
+    y_fit = [b + m * a for a in x_list]
+
+    residuals = y - y_fit
+    ss_res = np.sum(residuals**2) + 0.0001
+    ss_tot = np.sum((y - np.mean(y))**2) + 0.0001
+    r_squared = 1 - (ss_res / ss_tot)
+
+    y_extrap = [b + m * a for a in range(5, 10)]
+
+    return {"y_fit": y_fit,
+            "x": x_list,
+            "r_squared": r_squared,
+            "params": [b, m],
+            "y_extrap": y_extrap,
+            "input_y": list(y)}
+
+
+def perpetual_access_mask(perpetual_access_rows, year_by_perpetual_access_years):
+    #   if two dates, that is the perpetual access range
+    #   if a start date and no end date, then has perpetual access till the model says it doesn't
+    #   if no start date, then perpetual access from far in the past
+    # compared as iso strings, as the dates come as datetimes from the db and as strings from the json cache
+    def as_iso(my_date, default):
+        if not my_date:
+            my_date = default
+        try:
+            return my_date.isoformat()
+        except AttributeError:
+            return my_date
+
+    if not perpetual_access_rows:
+        return np.zeros((0, len(year_by_perpetual_access_years)), dtype=bool)
+    far_past = datetime.datetime(1850, 1, 1)
+    far_future = datetime.datetime(2042, 1, 2)  # let's really hope we have universal OA by then
+    start_dates = np.array([as_iso(row["start_date"], far_past) for row in perpetual_access_rows])
+    end_dates = np.array([as_iso(row["end_date"], far_future) for row in perpetual_access_rows])
+    working_dates = np.array([datetime.datetime(year, 1, 2).isoformat() for year in year_by_perpetual_access_years])  # use January 2nd
+    return (working_dates[None, :] > start_dates[:, None]) & (working_dates[None, :] < end_dates[:, None])
+
+
+def values_by_year(my_dict, years, offset=0):
+    # the year is a string key when the data came from the json cache, an int when from the db
+    if my_dict and isinstance(list(my_dict.keys())[0], int):
+        return [my_dict.get(year + offset, 0) or 0 for year in years]
+    return [my_dict.get(str(year + offset), 0) or 0 for year in years]
+
+
+def round_columns(values, decimals=4):
+    return np.round(values, decimals)
+
+
+def safe_divide(numerator, denominator, default=0.0):
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+    response = np.full(numerator.shape, default, dtype=float)
+    np.divide(numerator, denominator, out=response, where=(denominator != 0))
+    return response
+
+
+tercile_labels = ["low", "medium", "high"]
+
+
+def ranks_and_terciles(values):
+    """
+    For each row of values (variables x journals), every journal's rank and
+    tercile.  Ranks are like pandas rank(method="first", na_option="keep"):
+    1..n in value order, ties in column order.  Terciles are like
+    pd.qcut(ranks, 3, labels=tercile_labels).  nan values get nan for both, and
+    a row with fewer than two values to rank gets "-" terciles throughout.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    (num_rows, num_columns) = values.shape
+    missing = np.isnan(values)
+
+    # nan sorts last and the sort is stable, so one argsort per row gives every rank
+    order = np.argsort(values, axis=1, kind="stable")
+    ranks = np.empty(values.shape)
+    ranks[np.arange(num_rows)[:, None], order] = np.arange(1, num_columns + 1)
+    ranks[missing] = np.nan
+
+    labels = np.array(tercile_labels, dtype=object)
+    terciles = np.full(values.shape, np.nan, dtype=object)
+    for row, num_ranked in enumerate(num_columns - np.sum(missing, axis=1)):
+        if num_ranked < 2:
+            terciles[row] = "-"
+            continue
+        # the same edges qcut takes from the ranks, with right-closed bins
+        edges = np.quantile(np.arange(1, num_ranked + 1), np.linspace(0, 1, 4)[1:3])
+        present = ~missing[row]
+        terciles[row, present] = labels[np.searchsorted(edges, ranks[row, present], side="left")]
+    return ranks, terciles
+
+
+class ScenarioEngine(object):
+    """
+    Computes the per-journal model for a whole scenario at once.
+
+    Every per-journal quantity is a column: a numpy array shaped (num_journals,) for
+    scalars or (num_journals, 5) for by-year/by-age values, with one row per journal in
+    the order of issn_ls.  Journal reads its own row back out through value().
+
+    Only subscription-independent values live here; anything that depends on whether a
+    journal is subscribed is composed from these columns by Journal and Scenario.
+    """
+    years = list(range(0, 5))
+
+    def __init__(self, issn_ls, scenario_data, settings, package_id_for_db):
+        self.now = datetime.datetime.utcnow()
+        self.issn_ls = list(issn_ls)
+        self.row_lookup = dict((issn_l, i) for i, issn_l in enumerate(self.issn_ls))
+        self.num_journals = len(self.issn_ls)
+        self.settings = settings
+        self.package_id_for_db = package_id_for_db
+        self.historical_years_by_year = list(range(self.now.year - 5, self.now.year))
+        self.year_by_perpetual_access_years = list(range(self.now.year - 10, self.now.year))
+        # obs/pub matrices are (5 obs years) x (15 pub years), indexed by offset from these years
+        self.obs_years = np.arange(self.now.year, self.now.year + num_obs_years)
+        self.pub_years = np.arange(self.now.year - 10, self.now.year - 10 + num_pub_years)
+        self.columns = {}
+        self.set_inputs(scenario_data)
+        self.compute()
+
+    def value(self, column, row):
+        my_column = self.columns[column]
+        if isinstance(my_column, list):
+            return my_column[row]
+        my_value = my_column[row]
+        if my_column.ndim == 1:
+            my_value = my_value.item()
+            if isinstance(my_value, float) and my_value != my_value:
+                return None
+            return my_value
+        response = my_value.tolist()
+        if my_column.dtype.kind == "f" and np.isnan(my_value).any():
+            response = [None if num != num else num for num in response]
+        return response
+
+    def obs_pub_matrix(self, column, row):
+        # only ages 0-9 are stored, so scatter them into the full obs x pub grid
+        response = np.zeros((num_obs_years, num_pub_years), dtype=int)
+        response[np.arange(num_obs_years)[:, None], pub_index_by_obs_age] = self.columns[column][row]
+        return response
+
+    def get_oa_rows(self, scenario_data, only_peer_reviewed=False):
+        if only_peer_reviewed or not self.settings.include_submitted_version:
+            submitted = "no_submitted"
+        else:
+            submitted = "with_submitted"
+        if self.settings.include_bronze:
+            bronze = "with_bronze"
+        else:
+            bronze = "no_bronze"
+        return scenario_data["oa"]["{}_{}".format(submitted, bronze)]
+
+    def set_inputs(self, scenario_data):
+        from app import USE_PAPER_GROWTH
+
+        n = self.num_journals
+        shape = (n, len(self.years))
+
+        downloads_total_raw = np.zeros(n)
+        counter = np.zeros(n)
+        has_counter = np.zeros(n, dtype=bool)
+        papers_2021 = np.zeros(n)
+        price = np.full(n, np.nan)
+        embargo_months = np.full(n, np.nan)
+        social_network_multiplier = np.zeros(n)
+        downloads_by_age_raw = np.zeros(shape)
+        raw_num_papers_historical_by_year = np.zeros(shape)
+        num_citations_historical_by_year = np.zeros(shape)
+        num_authorships_historical_by_year = np.zeros(shape)
+        num_green_historical_by_year = np.zeros(shape)
+        num_hybrid_historical_by_year = np.zeros(shape)
+        num_bronze_historical_by_year = np.zeros(shape)
+        num_peer_reviewed_historical_by_year = np.zeros(shape)
+        perpetual_access = np.zeros((n, len(self.year_by_perpetual_access_years)), dtype=bool)
+
+        package_data = scenario_data.get(self.package_id_for_db, None)
+        counter_dict = package_data["counter_dict"] if package_data else {}
+        citation_dict = package_data["citation_dict"] if package_data else {}
+        authorship_dict = package_data["authorship_dict"] if package_data else {}
+        oa_rows_lookup = self.get_oa_rows(scenario_data)
+        peer_reviewed_rows_lookup = self.get_oa_rows(scenario_data, only_peer_reviewed=True)
+        prices = scenario_data["prices"]
+        historical_years = self.historical_years_by_year
+        paper_year_offset = 0 if USE_PAPER_GROWTH else -1
+
+        for i, issn_l in enumerate(self.issn_ls):
+            row = scenario_data["unpaywall_downloads_dict"][issn_l] or {}
+
+            downloads_total_row = row.get("downloads_total", 0.0)
+            downloads_total_raw[i] = downloads_total_row or 0.0
+            if downloads_total_row is not None and issn_l in counter_dict:
+                counter[i] = float(counter_dict[issn_l])
+                has_counter[i] = True
+            papers_2021[i] = row.get("num_papers_2021", 0) or 0
+            downloads_by_age_raw[i] = [row.get("downloads_{}y".format(age), 0) or 0 for age in self.years]
+
+            if prices.get(issn_l, None) is not None:
+                price[i] = float(prices[issn_l])
+            if scenario_data["embargo_dict"].get(issn_l, None):
+                embargo_months[i] = scenario_data["embargo_dict"][issn_l]
+            if self.settings.include_social_networks:
+                social_network_multiplier[i] = scenario_data["social_networks"].get(issn_l, 0.06)
+
+            if issn_l in scenario_data["num_papers"]:
+                raw_num_papers_historical_by_year[i] = values_by_year(scenario_data["num_papers"][issn_l], historical_years, paper_year_offset)
+            else:
+                raw_num_papers_historical_by_year[i] = papers_2021[i]
+
+            if package_data:
+                num_citations_historical_by_year[i] = values_by_year(citation_dict.get(issn_l, {}), historical_years)
+                num_authorships_historical_by_year[i] = values_by_year(authorship_dict.get(issn_l, {}), historical_years)
+
+            oa_dict = defaultdict(dict)
+            for oa_row in oa_rows_lookup.get(issn_l, []):
+                oa_dict[oa_row["fresh_oa_status"]][round(oa_row["year_int"])] = round(oa_row["count"])
+            num_green_historical_by_year[i] = [oa_dict["green"].get(year, 0) for year in historical_years]
+            num_hybrid_historical_by_year[i] = [oa_dict["hybrid"].get(year, 0) for year in historical_years]
+            num_bronze_historical_by_year[i] = [oa_dict["bronze"].get(year, 0) for year in historical_years]
+
+            peer_reviewed_dict = defaultdict(dict)
+            for oa_row in peer_reviewed_rows_lookup.get(issn_l, []):
+                peer_reviewed_dict[oa_row["fresh_oa_status"]][round(oa_row["year_int"])] = round(oa_row["count"])
+            num_peer_reviewed_historical_by_year[i] = [sum([my_dict.get(year, 0) for my_dict in peer_reviewed_dict.values()]) for year in historical_years]
+
+        perpetual_access_rows = [i for i, issn_l in enumerate(self.issn_ls) if issn_l in scenario_data["perpetual_access"]]
+        perpetual_access[perpetual_access_rows] = perpetual_access_mask([scenario_data["perpetual_access"][self.issn_ls[i]] for i in perpetual_access_rows],
+                                                                        self.year_by_perpetual_access_years)
+        year_by_perpetual_access_years = np.array(self.year_by_perpetual_access_years)
+        perpetual_access_years = [year_by_perpetual_access_years[my_mask].tolist() for my_mask in perpetual_access]
+
+        self.downloads_total_raw = downloads_total_raw
+        self.counter = counter
+        self.has_counter = has_counter
+        self.price = price
+        self.embargo_months = embargo_months
+        self.downloads_by_age_raw = downloads_by_age_raw
+        self.perpetual_access = perpetual_access
+
+        self.columns["papers_2021"] = papers_2021
+        self.columns["downloads_social_network_multiplier"] = social_network_multiplier
+        self.columns["downloads_by_age_before_counter_correction"] = downloads_by_age_raw
+        self.columns["raw_num_papers_historical_by_year"] = raw_num_papers_historical_by_year
+        self.columns["num_citations_historical_by_year"] = num_citations_historical_by_year
+        self.columns["num_authorships_historical_by_year"] = num_authorships_historical_by_year
+        self.columns["num_green_historical_by_year"] = num_green_historical_by_year
+        self.columns["num_hybrid_historical_by_year"] = num_hybrid_historical_by_year
+        self.columns["num_bronze_historical_by_year"] = num_bronze_historical_by_year
+        self.columns["num_peer_reviewed_historical_by_year"] = num_peer_reviewed_historical_by_year
+        self.columns["perpetual_access_years"] = perpetual_access_years
+
+    def compute_num_papers_by_year(self):
+        from app import USE_PAPER_GROWTH
+
+        papers_2021 = self.columns["papers_2021"]
+        raw_num_papers = self.columns["raw_num_papers_historical_by_year"]
+        num_papers_by_year = np.repeat(papers_2021[:, None], len(self.years), axis=1)
+        use_default_num_papers_curve = np.ones(self.num_journals, dtype=bool)
+        curve_fits = [{} for i in range(self.num_journals)]
+
+        if USE_PAPER_GROWTH:
+            num_nonzero_paper_years = np.sum(raw_num_papers >= 0.1 * raw_num_papers[:, 4:5], axis=1)
+            for i in np.flatnonzero((num_nonzero_paper_years >= 4) & (papers_2021 != 0)):
+                my_curve_fit = fit_num_papers_curve(raw_num_papers[i], threshold=0.1)
+                curve_fits[i] = my_curve_fit
+                if my_curve_fit and my_curve_fit["r_squared"] >= -0.1:
+                    use_default_num_papers_curve[i] = False
+                    # only let it drop down below 50% of the most recent year
+                    num_papers_by_year[i] = [max(int(round(papers_2021[i] * 0.5)), num) for num in my_curve_fit["y_extrap"]]
+
+        self.columns["num_papers_by_year"] = num_papers_by_year
+        self.columns["use_default_num_papers_curve"] = use_default_num_papers_curve
+        self.columns["curve_fit_for_num_papers"] = curve_fits
+
+    def compute_downloads_by_age(self, downloads_counter_multiplier):
+        raw_num_papers = self.columns["raw_num_papers_historical_by_year"]
+        downloads_by_age_raw = self.downloads_by_age_raw
+
+        # the default curve scaled to each journal's total, replaced by the fitted curve where the fit is good.
+        # although the curve fit is on downloads, download number probably off if there are some years with no papers,
+        # so in those cases just use the default
+        curve_to_use = np.outer(np.sum(downloads_by_age_raw, axis=1), default_download_by_age)
+        use_default_download_curve = np.ones(self.num_journals, dtype=bool)
+        curve_fits = [{} for i in range(self.num_journals)]
+        rows_to_fit = np.flatnonzero(np.all(raw_num_papers != 0, axis=1))
+        for i, my_curve_fit in zip(rows_to_fit, fit_download_curves(downloads_by_age_raw[rows_to_fit], self.package_id_for_db)):
+            curve_fits[i] = my_curve_fit
+            if my_curve_fit and my_curve_fit["r_squared"] >= 0.75:
+                curve_to_use[i] = my_curve_fit["y_fit"]
+                use_default_download_curve[i] = False
+
+        self.columns["curve_fit_for_downloads"] = curve_fits
+        self.columns["use_default_download_curve"] = use_default_download_curve
+        return np.maximum(curve_to_use * downloads_counter_multiplier[:, None], 0.0)
+
+    def obs_pub_cells(self, by_age, by_age_old, growth_scaling):
+        # (journals, obs, age) cells of the obs/pub matrix for ages 0-9; every other cell is zero.
+        # the arrays can have leading axes, e.g. draws in scenario_uncertainty
+        by_age_all = np.concatenate([by_age, np.repeat(by_age_old[..., None], num_ages - len(self.years), axis=-1)], axis=-1)
+        return np.rint(np.rint(by_age_all)[..., None, :] * growth_scaling[..., :, None])
+
+    def sum_obs_pub_by_obs(self, by_age, by_age_old, growth_scaling):
+        return np.sum(self.obs_pub_cells(by_age, by_age_old, growth_scaling), axis=2)
+
+    def age_split(self, rows, downloads_by_age, downloads_total, downloads_total_by_year, growth_scaling, oa_multiplier=1.0):
+        """
+        Splits the downloads by age of the journals in rows over the obs/pub
+        matrix, into all, oa and backfile downloads by observation year.  The
+        download arrays can have leading axes, e.g. draws in scenario_uncertainty,
+        and oa_multiplier scales the oa downloads by age.
+        """
+        c = self.columns
+        downloads_total_older_than_five_years = np.where(c["use_default_download_curve"][rows],
+                                                         default_download_older_than_five_years * downloads_total,
+                                                         downloads_total - np.sum(downloads_by_age, axis=-1))
+        downloads_per_paper_by_age = safe_divide(downloads_by_age, c["num_papers"][rows][:, None])
+        older_per_year = downloads_total_older_than_five_years / 5.0
+
+        downloads_oa_by_age = downloads_per_paper_by_age * c["num_oa_historical_by_year"][rows]
+        embargo_months = self.embargo_months[rows]
+        past_embargo = ~np.isnan(embargo_months)[:, None] & (np.array(self.years)[None, :] * 12 >= np.nan_to_num(embargo_months)[:, None])
+        downloads_oa_by_age = np.where(past_embargo, downloads_by_age, downloads_oa_by_age) * oa_multiplier
+
+        # obs/pub matrices summed by observation year
+        oa_older_per_year = np.where(downloads_by_age[..., 4] != 0,
+                                     older_per_year * safe_divide(downloads_oa_by_age[..., 4], downloads_by_age[..., 4]),
+                                     older_per_year)
+        downloads_cells = self.obs_pub_cells(downloads_by_age, older_per_year, growth_scaling)
+        oa_cells = self.obs_pub_cells(downloads_oa_by_age, oa_older_per_year, growth_scaling)
+        downloads_oa_by_year = np.sum(oa_cells, axis=-1)
+
+        # backfile: papers published in perpetual access years, half credit for the year after
+        perpetual_access = self.perpetual_access[rows]
+        in_perpetual_access = np.zeros((len(perpetual_access), num_pub_years), dtype=bool)
+        in_perpetual_access[:, :num_ages] = perpetual_access
+        after_perpetual_access = np.zeros((len(perpetual_access), num_pub_years), dtype=bool)
+        after_perpetual_access[:, 1:num_ages + 1] = perpetual_access
+        perpetual_access_factor = np.where(in_perpetual_access, 1.0, np.where(after_perpetual_access, 0.5, 0.0))
+        backfile_cells = np.rint(np.maximum(perpetual_access_factor[:, pub_index_by_obs_age] * (downloads_cells - oa_cells), 0))
+        downloads_backfile_by_year = np.minimum(np.sum(backfile_cells, axis=-1), downloads_total_by_year - downloads_oa_by_year)
+
+        return {
+            "downloads_total_older_than_five_years": downloads_total_older_than_five_years,
+            "downloads_per_paper_by_age": downloads_per_paper_by_age,
+            "downloads_oa_by_age": downloads_oa_by_age,
+            "downloads_cells": downloads_cells,
+            "oa_cells": oa_cells,
+            "backfile_cells": backfile_cells,
+            "downloads_oa_by_year": downloads_oa_by_year,
+            "downloads_backfile_by_year": downloads_backfile_by_year,
+        }
+
+    def social_networks_by_year(self, rows, downloads_total_by_year, downloads_oa_by_year, downloads_backfile_by_year):
+        # social network downloads of the journals in rows, minus what overlaps with backfile
+        downloads_social_networks_by_year = downloads_total_by_year * self.columns["downloads_social_network_multiplier"][rows][:, None]
+        overlap_with_backfile = safe_divide(downloads_social_networks_by_year * downloads_backfile_by_year, downloads_total_by_year)
+        downloads_social_networks_by_year = np.where(downloads_social_networks_by_year != 0,
+                                                     downloads_social_networks_by_year - overlap_with_backfile,
+                                                     downloads_social_networks_by_year)
+        downloads_social_networks_by_year = np.minimum(downloads_social_networks_by_year, downloads_total_by_year - downloads_oa_by_year)
+        return np.maximum(downloads_social_networks_by_year, 0)
+
+    def compute(self):
+        c = self.columns
+        settings = self.settings
+        ill_request_fraction = settings.ill_request_percent_of_delayed / float(100)
+
+        # downloads scaled by counter
+        downloads_total_before_counter_correction = np.maximum(1.0, self.downloads_total_raw)
+        downloads_counter_multiplier = np.where(self.has_counter, self.counter / downloads_total_before_counter_correction, 0.0)
+        c["downloads_total_before_counter_correction"] = downloads_total_before_counter_correction
+        c["downloads_counter_multiplier"] = downloads_counter_multiplier
+        c["raw_downloads_by_age"] = self.downloads_by_age_raw * downloads_counter_multiplier[:, None]
+        c["downloads_scaled_by_counter_by_year"] = np.repeat((downloads_total_before_counter_correction * downloads_counter_multiplier)[:, None], len(self.years), axis=1)
+
+        # papers and growth
+        self.compute_num_papers_by_year()
+        num_papers_by_year = c["num_papers_by_year"]
+        growth_scaling = round_columns(num_papers_by_year / (num_papers_by_year[:, 4:5] + 1))
+        c["num_papers_growth_from_2018_by_year"] = growth_scaling
+        c["growth_scaling_downloads"] = growth_scaling
+        c["growth_scaling_oa_downloads"] = growth_scaling
+        num_papers = np.round(np.mean(num_papers_by_year, axis=1))
+        c["num_papers"] = num_papers
+
+        downloads_total_by_year = c["downloads_scaled_by_counter_by_year"] * growth_scaling
+        downloads_total = round_columns(np.mean(downloads_total_by_year, axis=1))
+        c["downloads_total_by_year"] = downloads_total_by_year
+        c["downloads_total"] = downloads_total
+
+        # downloads by age
+        downloads_by_age = self.compute_downloads_by_age(downloads_counter_multiplier)
+        c["downloads_by_age"] = downloads_by_age
+
+        # oa paper counts
+        raw_num_papers = c["raw_num_papers_historical_by_year"]
+        raw_num_oa_historical_by_year = c["num_green_historical_by_year"] + c["num_bronze_historical_by_year"] + c["num_hybrid_historical_by_year"]
+        c["raw_num_oa_historical_by_year"] = raw_num_oa_historical_by_year
+        c["proportion_oa_historical_by_year"] = np.where(raw_num_papers != 0, safe_divide(raw_num_oa_historical_by_year, raw_num_papers), np.nan)
+        oa_proportion_reversed = safe_divide(raw_num_oa_historical_by_year, raw_num_papers)[:, ::-1]
+        num_oa_historical_by_year = np.rint(np.minimum(num_papers_by_year, oa_proportion_reversed * num_papers_by_year)).astype(int)
+        c["num_oa_historical_by_year"] = num_oa_historical_by_year
+
+        # per paper, older than five years, oa and backfile, by observation year
+        split = self.age_split(slice(None), downloads_by_age, downloads_total, downloads_total_by_year, growth_scaling)
+        c["downloads_total_older_than_five_years"] = split["downloads_total_older_than_five_years"]
+        c["downloads_per_paper_by_age"] = split["downloads_per_paper_by_age"]
+        downloads_per_paper_by_age = split["downloads_per_paper_by_age"]
+        older_per_year = split["downloads_total_older_than_five_years"] / 5.0
+        c["downloads_oa_by_age"] = split["downloads_oa_by_age"]
+        downloads_oa_by_year = split["downloads_oa_by_year"]
+        c["downloads_oa_by_year"] = downloads_oa_by_year
+        downloads_backfile_by_year = split["downloads_backfile_by_year"]
+        c["downloads_obs_age"] = split["downloads_cells"].astype(int)
+        c["oa_obs_age"] = split["oa_cells"].astype(int)
+        c["backfile_obs_age"] = split["backfile_cells"].astype(int)
+        c["downloads_backfile_by_year"] = downloads_backfile_by_year
+        c["downloads_backfile"] = round_columns(np.mean(downloads_backfile_by_year, axis=1))
+
+        # social networks, minus what overlaps with backfile
+        downloads_social_networks_by_year = self.social_networks_by_year(slice(None), downloads_total_by_year, downloads_oa_by_year, downloads_backfile_by_year)
+        c["downloads_social_networks_by_year"] = downloads_social_networks_by_year
+        c["downloads_social_networks"] = round_columns(np.mean(downloads_social_networks_by_year, axis=1))
+        c["downloads_oa_plus_social_networks_by_year"] = downloads_oa_by_year + downloads_social_networks_by_year
+
+        # paywalled, split into ill and other delayed
+        downloads_paywalled_by_year = np.maximum(0, downloads_total_by_year - (downloads_backfile_by_year + downloads_oa_by_year + downloads_social_networks_by_year))
+        downloads_ill_by_year = ill_request_fraction * downloads_paywalled_by_year
+        downloads_other_delayed_by_year = downloads_paywalled_by_year - downloads_ill_by_year
+        c["downloads_paywalled_by_year"] = downloads_paywalled_by_year
+        c["downloads_paywalled"] = round_columns(np.mean(downloads_paywalled_by_year, axis=1))
+        c["downloads_subscription_by_year"] = downloads_paywalled_by_year
+        c["downloads_subscription"] = c["downloads_paywalled"]
+        c["downloads_ill_by_year"] = downloads_ill_by_year
+        c["downloads_ill"] = round_columns(np.mean(downloads_ill_by_year, axis=1))
+        c["downloads_other_delayed_by_year"] = downloads_other_delayed_by_year
+        c["downloads_other_delayed"] = round_columns(np.mean(downloads_other_delayed_by_year, axis=1))
+
+        # citations and authorships weighted into usage
+        num_citations = round_columns(np.mean(c["num_citations_historical_by_year"], axis=1))
+        num_authorships = round_columns(np.mean(c["num_authorships_historical_by_year"], axis=1))
+        c["num_citations"] = num_citations
+        c["num_authorships"] = num_authorships
+        use_addition_from_weights = round_columns(float(settings.weight_citation) * num_citations + float(settings.weight_authorship) * num_authorships)
+        use_addition_from_weights = np.where((num_citations != 0) | (num_authorships != 0), use_addition_from_weights, 0.0)
+        c["use_addition_from_weights"] = use_addition_from_weights
+
+        use_total_by_year = downloads_total_by_year + use_addition_from_weights[:, None] * growth_scaling
+        use_total = round_columns(np.mean(use_total_by_year, axis=1))
+        use_total = np.where(use_total == 0, 0.0001, use_total)
+        c["use_total_by_year"] = use_total_by_year
+        c["use_total"] = use_total
+
+        use_weight_multiplier = np.where(downloads_total != 0, safe_divide(use_total, downloads_total), 1.0)
+        c["use_weight_multiplier"] = use_weight_multiplier
+        multiplier = use_weight_multiplier[:, None]
+
+        # usage by group
+        use_oa_by_year = np.minimum(np.maximum(0, downloads_oa_by_year * multiplier), use_total_by_year)
+        use_oa = round_columns(np.minimum(np.mean(use_oa_by_year, axis=1), use_total))
+        c["use_oa_by_year"] = use_oa_by_year
+        c["use_oa"] = use_oa
+        c["use_oa_percent_by_year"] = np.minimum(100, np.round(100.0 * (use_oa_by_year / (1.0 + use_total_by_year)), 1))
+
+        use_social_networks_by_year = np.maximum(0, round_columns(downloads_social_networks_by_year * multiplier))
+        use_social_networks_by_year = np.maximum(np.minimum(use_social_networks_by_year, use_total_by_year - use_oa_by_year), 0)
+        use_social_networks = np.minimum(np.mean(use_social_networks_by_year, axis=1), use_total - use_oa)
+        c["use_social_networks_by_year"] = use_social_networks_by_year
+        c["use_social_networks"] = use_social_networks
+
+        use_backfile_by_year = np.maximum(0, round_columns(downloads_backfile_by_year * multiplier))
+        use_backfile_by_year = np.minimum(use_backfile_by_year, use_total_by_year - use_oa_by_year)
+        use_backfile = round_columns(np.minimum(np.mean(use_backfile_by_year, axis=1), use_total - use_oa - use_social_networks))
+        c["use_backfile_by_year"] = use_backfile_by_year
+        c["use_backfile"] = use_backfile
+
+        c["use_oa_plus_social_networks_by_year"] = use_oa_by_year + use_social_networks_by_year
+        c["use_oa_plus_social_networks"] = use_oa + use_social_networks
+        use_free_instant_by_year = c["use_oa_plus_social_networks_by_year"] + use_backfile_by_year
+        use_free_instant = c["use_oa_plus_social_networks"] + use_backfile
+        c["use_free_instant_by_year"] = use_free_instant_by_year
+        c["use_free_instant"] = use_free_instant
+        c["use_free_instant_percent"] = np.where(use_total != 0, np.minimum(100.0, round_columns(100 * safe_divide(use_free_instant, use_total))), 0)
+
+        use_paywalled_by_year = np.maximum(0, use_total_by_year - use_free_instant_by_year)
+        use_paywalled = np.maximum(0, use_total - use_free_instant)
+        c["use_paywalled_by_year"] = use_paywalled_by_year
+        c["use_paywalled"] = use_paywalled
+        c["use_subscription_by_year"] = use_paywalled_by_year
+        c["use_subscription"] = use_paywalled
+        c["use_ill_by_year"] = ill_request_fraction * use_paywalled_by_year
+        c["use_ill"] = ill_request_fraction * use_paywalled
+        c["use_other_delayed_by_year"] = use_paywalled_by_year - c["use_ill_by_year"]
+        c["use_other_delayed"] = use_paywalled - c["use_ill"]
+
+        # costs
+        cost_first_year_including_content_fee = self.price * (1 + settings.cost_content_fee_percent/float(100))
+        c["cost_first_year_including_content_fee"] = cost_first_year_including_content_fee
+        alacart_growth = np.array([(1+settings.cost_alacart_increase/float(100))**year for year in self.years])
+        subscription_cost_by_year = np.rint(alacart_growth[None, :] * cost_first_year_including_content_fee[:, None])
+        subscription_cost = round_columns(np.mean(subscription_cost_by_year, axis=1))
+        c["subscription_cost_by_year"] = subscription_cost_by_year
+        c["subscription_cost"] = subscription_cost
+
+        ill_cost_by_year = round_columns(downloads_ill_by_year * settings.cost_ill)
+        ill_cost = round_columns(np.mean(ill_cost_by_year, axis=1))
+        c["ill_cost_by_year"] = ill_cost_by_year
+        c["ill_cost"] = ill_cost
+        c["cost_subscription_minus_ill_by_year"] = subscription_cost_by_year - ill_cost_by_year
+        cost_subscription_minus_ill = round_columns(subscription_cost - ill_cost)
+        c["cost_subscription_minus_ill"] = cost_subscription_minus_ill
+
+        c["cpu"] = np.where(use_paywalled >= 1, np.round(safe_divide(cost_subscription_minus_ill, use_paywalled), 6), np.nan)
+        c["old_school_cpu"] = np.where(downloads_total >= 1, np.round(safe_divide(subscription_cost, downloads_total), 6), np.nan)
+
+        # oa by type
+        num_hybrid_by_year = np.minimum(num_papers_by_year, c["num_hybrid_historical_by_year"][:, ::-1])
+        num_bronze_by_year = np.minimum(num_papers_by_year - num_hybrid_by_year, c["num_bronze_historical_by_year"][:, ::-1])
+        num_green_by_year = np.minimum(num_papers_by_year - num_hybrid_by_year - num_bronze_by_year, c["num_green_historical_by_year"][:, ::-1])
+        num_peer_reviewed_by_year = np.minimum(num_papers_by_year, c["num_peer_reviewed_historical_by_year"][:, ::-1])
+        c["num_hybrid_by_year"] = num_hybrid_by_year
+        c["num_bronze_by_year"] = num_bronze_by_year
+        c["num_green_by_year"] = num_green_by_year
+
+        for oa_type, num_by_year in [("green", num_green_by_year),
+                                     ("hybrid", num_hybrid_by_year),
+                                     ("bronze", num_bronze_by_year),
+                                     ("peer_reviewed", num_peer_reviewed_by_year)]:
+            c["num_{}_historical".format(oa_type)] = round_columns(np.mean(c["num_{}_historical_by_year".format(oa_type)], axis=1))
+            by_age = downloads_per_paper_by_age * num_by_year
+            older = older_per_year * (by_age[:, 4] / (downloads_by_age[:, 4] + 1))
+            by_year = self.sum_obs_pub_by_obs(by_age, older, growth_scaling)
+            downloads_oa_type = round_columns(np.mean(by_year, axis=1))
+            c["downloads_oa_{}_by_age".format(oa_type)] = by_age
+            c["downloads_oa_{}_older".format(oa_type)] = older
+            c["downloads_oa_{}_by_year".format(oa_type)] = by_year
+            c["downloads_oa_{}".format(oa_type)] = downloads_oa_type
+            c["use_oa_{}".format(oa_type)] = round_columns(downloads_oa_type * use_weight_multiplier)
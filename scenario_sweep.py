@@ -0,0 +1,232 @@
+# coding: utf-8
+
+# What-if sweeps over Assumptions for a live scenario: every combination of the
+# given values, evaluated over the scenario's already loaded package data.
+#
+# The include_* settings change which OA rows and social network numbers go into
+# the ScenarioEngine inputs, so each combination of those gets its own engine,
+# built from scenario.data without going back to the database.  Everything else
+# only enters the engine after the downloads are computed, so those
+# combinations are evaluated together as (combination x journal x year) arrays,
+# the same steps as ScenarioEngine.compute with a leading combination axis.
+
+import copy
+
+import numpy as np
+
+from scenario_engine import ScenarioEngine
+from scenario_engine import round_columns
+from scenario_engine import safe_divide
+from util import str2bool
+
+# evaluated together with broadcasting
+array_sweep_fields = [
+    "cost_ill",
+    "ill_request_percent_of_delayed",
+    "weight_citation",
+    "weight_authorship",
+    "cost_alacart_increase",
+    "cost_content_fee_percent",
+    "cost_bigdeal",
+    "cost_bigdeal_increase",
+]
+
+# one ScenarioEngine per combination
+engine_sweep_fields = [
+    "include_bronze",
+    "include_submitted_version",
+    "include_social_networks",
+]
+
+sweep_metrics = [
+    "cost",
+    "cost_spent_percent",
+    "cost_bigdeal_projected",
+    "use_total",
+    "use_instant_percent",
+    "use_free_instant_percent",
+    "num_journals_cheaper_than_ill",
+]
+
+default_max_combinations = 10000
+
+# (combinations x journals x years) cells to evaluate at once
+max_cells_per_chunk = 2 * 1000 * 1000
+
+
+def parse_sweep_values(field, values):
+    # a list of values, or {"min": 10, "max": 30, "num": 5}
+    if isinstance(values, dict):
+        try:
+            values = np.linspace(float(values["min"]), float(values["max"]), int(values.get("num", 5))).tolist()
+        except (KeyError, ValueError, TypeError):
+            raise ValueError("{} needs min, max and num".format(field))
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    if not values:
+        raise ValueError("{} has no values".format(field))
+    try:
+        if field in engine_sweep_fields:
+            return [value if isinstance(value, bool) else str2bool(str(value)) for value in values]
+        return [float(value) for value in values]
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("{} has a value that isn't a {}".format(field, "boolean" if field in engine_sweep_fields else "number"))
+
+
+def get_sweep_combinations(ranges, max_combinations=default_max_combinations):
+    """
+    The fields to sweep and the value of each field in every combination, as
+    (fields, {field: array with one entry per combination}).
+    """
+    fields = list(ranges.keys())
+    unknown_fields = [field for field in fields if field not in array_sweep_fields + engine_sweep_fields]
+    if unknown_fields:
+        raise ValueError("can't sweep {}, fields are {}".format(", ".join(unknown_fields), ", ".join(array_sweep_fields + engine_sweep_fields)))
+
+    if not fields:
+        return fields, {}
+
+    values_by_field = dict((field, parse_sweep_values(field, ranges[field])) for field in fields)
+    shape = [len(values_by_field[field]) for field in fields]
+    num_combinations = int(np.prod(shape))
+    if num_combinations > max_combinations:
+        raise ValueError("{} combinations is too many, the most is {}".format(num_combinations, max_combinations))
+
+    indexes = np.indices(shape).reshape(len(fields), -1)
+    return fields, dict((field, np.asarray(values_by_field[field])[indexes[i]]) for i, field in enumerate(fields))
+
+
+def use_from_downloads(downloads_total_by_year, downloads_total, downloads_oa_by_year,
+                       downloads_social_networks_by_year, downloads_backfile_by_year, use_addition_by_year):
+    """
+    The usage steps of ScenarioEngine.compute, for arrays with any leading axes
+    before (journal, year).  Returns use_total, use_free_instant and
+    use_paywalled by journal.
+    """
+    use_total_by_year = downloads_total_by_year + use_addition_by_year
+    use_total = round_columns(np.mean(use_total_by_year, axis=-1))
+    use_total = np.where(use_total == 0, 0.0001, use_total)
+    multiplier = np.where(downloads_total != 0, safe_divide(use_total, downloads_total), 1.0)[..., None]
+
+    use_oa_by_year = np.minimum(np.maximum(0, downloads_oa_by_year * multiplier), use_total_by_year)
+    use_oa = round_columns(np.minimum(np.mean(use_oa_by_year, axis=-1), use_total))
+    use_social_networks_by_year = np.maximum(0, round_columns(downloads_social_networks_by_year * multiplier))
+    use_social_networks_by_year = np.maximum(np.minimum(use_social_networks_by_year, use_total_by_year - use_oa_by_year), 0)
+    use_social_networks = np.minimum(np.mean(use_social_networks_by_year, axis=-1), use_total - use_oa)
+    use_backfile_by_year = np.maximum(0, round_columns(downloads_backfile_by_year * multiplier))
+    use_backfile_by_year = np.minimum(use_backfile_by_year, use_total_by_year - use_oa_by_year)
+    use_backfile = round_columns(np.minimum(np.mean(use_backfile_by_year, axis=-1), use_total - use_oa - use_social_networks))
+    use_free_instant = use_oa + use_social_networks + use_backfile
+    use_paywalled = np.maximum(0, use_total - use_free_instant)
+    return use_total, use_free_instant, use_paywalled
+
+
+def sweep_engine(engine, subscribed, params):
+    """
+    Scenario summary metrics for each combination of the array sweep fields.
+    params is {field: array with one value per combination} for every field in
+    array_sweep_fields; subscribed is a mask over the engine rows.
+    """
+    c = engine.columns
+    years = np.array(engine.years)
+    num_combinations = len(params["cost_ill"])
+    response = dict((metric, np.zeros(num_combinations)) for metric in sweep_metrics)
+
+    has_weights = (c["num_citations"] != 0) | (c["num_authorships"] != 0)
+    chunk_size = max(1, max_cells_per_chunk // max(1, engine.num_journals * len(years)))
+
+    for start in range(0, num_combinations, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        p = dict((field, params[field][chunk][:, None]) for field in array_sweep_fields)
+
+        use_addition_from_weights = np.where(has_weights, round_columns(p["weight_citation"] * c["num_citations"] + p["weight_authorship"] * c["num_authorships"]), 0.0)
+        (use_total, use_free_instant, use_paywalled) = use_from_downloads(c["downloads_total_by_year"],
+                                                                          c["downloads_total"],
+                                                                          c["downloads_oa_by_year"],
+                                                                          c["downloads_social_networks_by_year"],
+                                                                          c["downloads_backfile_by_year"],
+                                                                          use_addition_from_weights[:, :, None] * c["growth_scaling_downloads"])
+
+        # costs
+        alacart_growth = (1 + p["cost_alacart_increase"] / float(100)) ** years
+        cost_first_year = engine.price * (1 + p["cost_content_fee_percent"] / float(100))
+        subscription_cost = round_columns(np.mean(np.rint(alacart_growth[:, None, :] * cost_first_year[:, :, None]), axis=2))
+        downloads_ill_by_year = (p["ill_request_percent_of_delayed"] / float(100))[:, :, None] * c["downloads_paywalled_by_year"]
+        ill_cost = round_columns(np.mean(round_columns(downloads_ill_by_year * p["cost_ill"][:, :, None]), axis=2))
+
+        cost_bigdeal_projected = np.round(np.mean(np.round(((1 + p["cost_bigdeal_increase"] / float(100)) ** years) * p["cost_bigdeal"]), axis=1), 4)
+        cost_bigdeal_projected = np.maximum(cost_bigdeal_projected, 1.0)
+
+        # scenario totals, like Scenario.cost and Scenario.use_instant for the subscribed journals
+        scenario_use_total = 1 + np.sum(use_total, axis=1)
+        scenario_use_free_instant = np.sum(use_free_instant, axis=1)
+        use_instant = 1 + scenario_use_free_instant + np.sum(use_paywalled[:, subscribed], axis=1)
+        cost = np.round(np.sum(subscription_cost[:, subscribed], axis=1) + np.sum(ill_cost[:, ~subscribed], axis=1), 2)
+
+        response["cost"][chunk] = cost
+        response["cost_spent_percent"][chunk] = np.round(100 * cost / cost_bigdeal_projected, 4)
+        response["cost_bigdeal_projected"][chunk] = cost_bigdeal_projected
+        response["use_total"][chunk] = scenario_use_total
+        response["use_instant_percent"][chunk] = np.round(100 * use_instant / scenario_use_total, 2)
+        response["use_free_instant_percent"][chunk] = np.round(100 * scenario_use_free_instant / scenario_use_total, 2)
+        response["num_journals_cheaper_than_ill"][chunk] = np.sum(round_columns(subscription_cost - ill_cost) < 0, axis=1)
+
+    return response
+
+
+def sweep_scenario(my_scenario, ranges, max_combinations=default_max_combinations):
+    """
+    Summary metrics for every combination of the values in ranges, a dict of
+    Assumptions field to a list of values (or min, max and num).  Fields that
+    aren't swept keep the scenario's values, and the scenario's subscriptions
+    are used throughout.
+
+    Returns a compact table: {"columns": [...], "rows": [[...], ...]}, one row
+    per combination, the swept fields then sweep_metrics.
+    """
+    (fields, combinations) = get_sweep_combinations(ranges, max_combinations)
+    num_combinations = len(combinations[fields[0]]) if fields else 1
+
+    params = {}
+    for field in array_sweep_fields:
+        if field in combinations:
+            params[field] = combinations[field].astype(float)
+        else:
+            if field == "cost_bigdeal":
+                default = my_scenario.cost_bigdeal_raw
+            elif field == "cost_bigdeal_increase":
+                default = my_scenario.cost_bigdeal_increase_raw
+            else:
+                default = getattr(my_scenario.settings, field)
+            params[field] = np.full(num_combinations, float(default))
+
+    subscribed = my_scenario.subscribed_mask()
+    metrics = dict((metric, np.zeros(num_combinations)) for metric in sweep_metrics)
+
+    swept_engine_fields = [field for field in engine_sweep_fields if field in combinations]
+    engine_keys = list(zip(*[combinations[field].tolist() for field in swept_engine_fields])) if swept_engine_fields else [()] * num_combinations
+    for engine_key in sorted(set(engine_keys)):
+        rows = np.array([i for i, key in enumerate(engine_keys) if key == engine_key])
+        my_settings = copy.copy(my_scenario.settings)
+        for field, value in zip(swept_engine_fields, engine_key):
+            setattr(my_settings, field, value)
+
+        if all(getattr(my_settings, field) == getattr(my_scenario.settings, field) for field in engine_sweep_fields):
+            my_engine = my_scenario.engine
+        else:
+            my_engine = ScenarioEngine(my_scenario.engine.issn_ls, my_scenario.data, my_settings, my_scenario.engine.package_id_for_db)
+            my_scenario.log_timing("sweep engine for {}".format(dict(zip(swept_engine_fields, engine_key))))
+
+        engine_metrics = sweep_engine(my_engine, subscribed, dict((field, values[rows]) for field, values in params.items()))
+        for metric in sweep_metrics:
+            metrics[metric][rows] = engine_metrics[metric]
+
+    my_scenario.log_timing("sweep {} combinations".format(num_combinations))
+
+    columns = fields + sweep_metrics
+    table = [combinations[field].tolist() for field in fields]
+    table += [metrics[metric].astype(int).tolist() if metric.startswith("num_") else metrics[metric].tolist() for metric in sweep_metrics]
+    return {
+        "columns": columns,
+        "rows": [list(row) for row in zip(*table)],
+    }
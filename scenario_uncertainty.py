@@ -0,0 +1,163 @@
+# coding: utf-8
+
+# Uncertainty bands for a scenario's five year projections.
+#
+# The projections rest on a few estimated inputs per journal: how COUNTER
+# downloads scale the Unpaywall download numbers, the fitted download-by-age
+# curve that splits downloads between OA, backfile and paywalled, the paper
+# growth curve fit that projects downloads forward, and the OA proportion.  Each
+# draw perturbs those independently per journal, rebuilds the obs/pub cells
+# with ScenarioEngine.age_split and reruns the usage and cost steps of
+# ScenarioEngine.compute for all draws at once as (draw x journal x year x age)
+# arrays, a chunk of journals at a time.  The scenario's Journal objects are
+# never rebuilt, and its subscriptions stay fixed.
+
+import warnings
+
+import numpy as np
+from scipy.special import expit
+
+from scenario_engine import num_ages
+from scenario_engine import round_columns
+from scenario_engine import safe_divide
+from scenario_sweep import use_from_downloads
+
+# standard deviation of the log of each multiplier
+default_sigmas = {
+    "counter": 0.15,
+    # of the timescale of the fitted download curve, for journals that use their fit
+    "curve": 0.20,
+    # at the last projected year; it grows linearly from zero at the current year
+    "growth": 0.10,
+    "oa": 0.20,
+}
+
+default_num_draws = 1000
+# memory is bounded by the chunking below, time isn't: a 5000 journal package
+# takes about 15 seconds per 1000 draws
+max_num_draws = 5000
+default_percentiles = [5, 25, 50, 75, 95]
+
+# (draws x journals x years x ages) cells to evaluate at once.  journals are
+# taken in chunks, so memory doesn't grow with the number of draws; a draw's
+# scenario totals are summed across chunks and each journal's cpu bands are
+# worked out with its chunk
+max_cells_per_chunk = 2 * 1000 * 1000
+
+
+def draw_multipliers(rng, num_draws, num_journals, num_years, sigmas):
+    counter = np.exp(rng.normal(0, sigmas["counter"], (num_draws, num_journals, 1)))
+    curve = np.exp(rng.normal(0, sigmas["curve"], (num_draws, num_journals, 1)))
+    growth_trend = (np.arange(num_years) + 1) / float(num_years)
+    growth = np.exp(rng.normal(0, sigmas["growth"], (num_draws, num_journals, 1)) * growth_trend)
+    oa = np.exp(rng.normal(0, sigmas["oa"], (num_draws, num_journals, 1)))
+    return counter, curve, growth, oa
+
+
+def perturbed_downloads_by_age(engine, rows, curve):
+    # the engine's downloads by age, with the timescale of each fitted curve multiplied by curve
+    c = engine.columns
+    downloads_by_age = c["downloads_by_age"][rows]
+    fitted = ~c["use_default_download_curve"][rows]
+    if not np.any(fitted):
+        return np.broadcast_to(downloads_by_age, curve.shape[:-1] + downloads_by_age.shape[-1:])
+
+    params = np.array([fit["params"] if use_fit else [np.nan] * 3 for (fit, use_fit) in zip(c["curve_fit_for_downloads"][rows], fitted)])
+    x = np.arange(downloads_by_age.shape[-1], dtype=float)
+    with np.errstate(all="ignore"):
+        y_fit = params[:, 1:2] + params[:, 0:1] * expit(x / (params[:, 2:3] * curve))
+    fitted_by_age = np.maximum(y_fit * c["downloads_counter_multiplier"][rows][:, None], 0.0)
+    return np.where(fitted[:, None], fitted_by_age, downloads_by_age)
+
+
+def perturbed_columns(engine, rows, subscribed, settings, counter, curve, growth, oa):
+    """
+    For the journals in rows, each draw's share of the scenario cost, instant
+    use and total use, and per journal cpu, with the engine inputs perturbed as
+    drawn and the obs/pub cells rebuilt from them.
+    """
+    c = engine.columns
+    subscribed = subscribed[rows]
+    ill_request_fraction = settings.ill_request_percent_of_delayed / float(100)
+
+    growth_scaling = c["growth_scaling_downloads"][rows] * growth
+    downloads_total_by_year = (c["downloads_scaled_by_counter_by_year"][rows] * counter) * growth_scaling
+    downloads_total = round_columns(np.mean(downloads_total_by_year, axis=-1))
+    downloads_by_age = perturbed_downloads_by_age(engine, rows, curve) * counter
+
+    split = engine.age_split(rows, downloads_by_age, downloads_total, downloads_total_by_year, growth_scaling, oa_multiplier=oa)
+    downloads_oa_by_year = split["downloads_oa_by_year"]
+    downloads_backfile_by_year = split["downloads_backfile_by_year"]
+    downloads_social_networks_by_year = engine.social_networks_by_year(rows, downloads_total_by_year, downloads_oa_by_year, downloads_backfile_by_year)
+    downloads_paywalled_by_year = np.maximum(0, downloads_total_by_year - (downloads_backfile_by_year + downloads_oa_by_year + downloads_social_networks_by_year))
+
+    # citations and authorships aren't from downloads, so only the growth applies to them
+    use_addition_by_year = c["use_addition_from_weights"][rows][:, None] * growth_scaling
+    (use_total, use_free_instant, use_paywalled) = use_from_downloads(downloads_total_by_year,
+                                                                      downloads_total,
+                                                                      downloads_oa_by_year,
+                                                                      downloads_social_networks_by_year,
+                                                                      downloads_backfile_by_year,
+                                                                      use_addition_by_year)
+
+    ill_cost = round_columns(np.mean(round_columns(ill_request_fraction * downloads_paywalled_by_year * settings.cost_ill), axis=-1))
+    subscription_cost = c["subscription_cost"][rows]
+    cost_subscription_minus_ill = round_columns(subscription_cost - ill_cost)
+    cpu = np.where(use_paywalled >= 1, np.round(safe_divide(cost_subscription_minus_ill, use_paywalled), 6), np.nan)
+
+    return {
+        "cost": np.sum(np.broadcast_to(subscription_cost, ill_cost.shape)[:, subscribed], axis=-1) + np.sum(ill_cost[:, ~subscribed], axis=-1),
+        "use_instant": np.sum(use_free_instant, axis=-1) + np.sum(use_paywalled[:, subscribed], axis=-1),
+        "use_total": np.sum(use_total, axis=-1),
+        "cpu": cpu,
+    }
+
+
+def percentile_bands(values, percentiles, axis=0):
+    with warnings.catch_warnings():
+        # journals with no paywalled use in any draw have no cpu
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanpercentile(values, percentiles, axis=axis)
+
+
+def none_if_nan(values):
+    return [None if value != value else round(value, 4) for value in values]
+
+
+def uncertainty_bands(engine, subscribed, settings, num_draws=default_num_draws, sigmas=None,
+                      percentiles=None, seed=0):
+    """
+    Percentile bands over num_draws perturbed projections: of the scenario
+    cost and use_instant_percent, and of each journal's cpu.  The same seed
+    gives the same bands.
+    """
+    my_sigmas = dict(default_sigmas)
+    my_sigmas.update(sigmas or {})
+    percentiles = percentiles or default_percentiles
+    rng = np.random.RandomState(seed)
+
+    num_years = len(engine.years)
+    cost = np.zeros(num_draws)
+    use_instant = np.zeros(num_draws)
+    use_total = np.zeros(num_draws)
+    cpu_bands = []
+
+    chunk_size = max(1, max_cells_per_chunk // (num_draws * num_years * num_ages))
+    for start in range(0, engine.num_journals, chunk_size):
+        rows = slice(start, min(engine.num_journals, start + chunk_size))
+        (counter, curve, growth, oa) = draw_multipliers(rng, num_draws, rows.stop - rows.start, num_years, my_sigmas)
+        draws = perturbed_columns(engine, rows, subscribed, settings, counter, curve, growth, oa)
+        cost += draws["cost"]
+        use_instant += draws["use_instant"]
+        use_total += draws["use_total"]
+        cpu_bands += percentile_bands(draws["cpu"], percentiles).T.tolist()
+
+    use_instant_percent = 100 * (1 + use_instant) / (1 + use_total)
+    return {
+        "num_draws": num_draws,
+        "sigmas": my_sigmas,
+        "percentiles": percentiles,
+        "cost": none_if_nan(percentile_bands(cost, percentiles).tolist()),
+        "use_instant_percent": none_if_nan(percentile_bands(use_instant_percent, percentiles).tolist()),
+        "journals": [{"issn_l": issn_l, "cpu": none_if_nan(bands)} for issn_l, bands in zip(engine.issn_ls, cpu_bands)],
+    }
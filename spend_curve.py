@@ -0,0 +1,172 @@
+# coding: utf-8
+
+# The spend -> instant access curve of a scenario, from its engine columns.
+#
+# Subscribing to a journal changes the scenario cost by its
+# cost_subscription_minus_ill and its instant use by its use_paywalled, so with
+# nothing subscribed the spend is the sum of ill_cost, and every subscription
+# order is a curve of cumulative sums.  The greedy curve subscribes journals
+# that save money first, then the rest by cost per use.  knapsack_for_budget
+# gives the exact most instant use for a budget, for checking how far greedy is off.
+
+import numpy as np
+
+# the knapsack table is one byte per journal per budget step
+default_knapsack_max_cells = 20 * 1000 * 1000
+
+
+def greedy_order(cost_subscription_minus_ill, cpu):
+    # journals that save money first, then by cost per use, journals without a cpu last.
+    # stable, so ties keep engine row order like the sort in Scenario.journals_sorted_cpu
+    cpu_key = np.where(np.isnan(cpu), np.inf, cpu)
+    saves_money = cost_subscription_minus_ill < 0
+    return np.lexsort((cpu_key, ~saves_money))
+
+
+def downsample_points(num_points, max_points, keep=None):
+    # indexes of at most max_points evenly spaced points, always the first and last and any in keep
+    if not max_points or num_points <= max_points:
+        return np.arange(num_points)
+    points = np.round(np.linspace(0, num_points - 1, max_points)).astype(int)
+    if keep is not None:
+        points = np.concatenate((points, np.asarray(keep, dtype=int)))
+    return np.unique(points)
+
+
+class SpendCurve(object):
+    def __init__(self, issn_ls, cost_subscription_minus_ill, use_paywalled, cpu,
+                 base_spend, base_use_instant, use_total, cost_bigdeal):
+        self.issn_ls = list(issn_ls)
+        self.cost_subscription_minus_ill = np.asarray(cost_subscription_minus_ill, dtype=float)
+        self.use_paywalled = np.asarray(use_paywalled, dtype=float)
+        self.base_spend = float(base_spend)
+        self.base_use_instant = float(base_use_instant)
+        self.use_total = float(use_total)
+        self.cost_bigdeal = float(cost_bigdeal)
+
+        self.order = greedy_order(self.cost_subscription_minus_ill, np.asarray(cpu, dtype=float))
+        # point k is the first k journals of self.order subscribed
+        self.spend = self.base_spend + np.concatenate(([0.0], np.cumsum(self.cost_subscription_minus_ill[self.order])))
+        self.use_instant = self.base_use_instant + np.concatenate(([0.0], np.cumsum(self.use_paywalled[self.order])))
+        self.num_saves_money = int(np.sum(self.cost_subscription_minus_ill < 0))
+
+    @property
+    def num_points(self):
+        return len(self.spend)
+
+    def num_journals_for_spend(self, max_spend):
+        # the journals that save money are always in; after them spend only goes up,
+        # so the longest prefix within max_spend is a binary search
+        after_saves_money = self.spend[self.num_saves_money:]
+        num_more = int(np.searchsorted(after_saves_money, max_spend, side="right")) - 1
+        return self.num_saves_money + max(0, num_more)
+
+    def rows_for_spend(self, max_spend):
+        return self.order[:self.num_journals_for_spend(max_spend)]
+
+    def issn_ls_for_spend(self, max_spend):
+        return [self.issn_ls[row] for row in self.rows_for_spend(max_spend)]
+
+    def spend_for_percent(self, spend_percent):
+        return float(spend_percent) / 100.0 * self.cost_bigdeal
+
+    def to_dict(self, max_points=None):
+        points = downsample_points(self.num_points, max_points, keep=[self.num_saves_money])
+        spend = self.spend[points]
+        use_instant = self.use_instant[points]
+        return {
+            "issn_ls": [self.issn_ls[row] for row in self.order],
+            "num_saves_money": self.num_saves_money,
+            "cost_bigdeal": self.cost_bigdeal,
+            "use_total": self.use_total,
+            "points": {
+                "num_journals": points.tolist(),
+                "spend": np.round(spend, 2).tolist(),
+                "spend_percent": np.round(100 * spend / self.cost_bigdeal, 4).tolist(),
+                "use_instant": np.round(use_instant, 2).tolist(),
+                "use_instant_percent": np.round(100 * use_instant / self.use_total, 4).tolist() if self.use_total else [0] * len(points),
+            }
+        }
+
+
+def knapsack(costs, values, capacity, max_cells=default_knapsack_max_cells):
+    """
+    0/1 knapsack over positive costs: the subset of items with the most total
+    value whose total cost is at most capacity.
+
+    Costs are rounded up to whole budget steps.  The step is 1 when
+    len(costs) * capacity fits in max_cells, so small budgets are exact to the
+    dollar; bigger ones get coarser steps, and the chosen set is still within
+    capacity.  Returns (chosen item indexes, best value at each budget step,
+    step size).
+    """
+    costs = np.asarray(costs, dtype=float)
+    values = np.asarray(values, dtype=float)
+    num_items = len(costs)
+    if capacity < 0:
+        return np.array([], dtype=int), np.array([]), 1.0
+
+    step = max(1.0, float(capacity) * max(1, num_items) / max_cells)
+    num_steps = int(np.floor(capacity / step + 1e-9))
+    weights = np.ceil(costs / step - 1e-9).astype(int)
+
+    best = np.zeros(num_steps + 1)
+    taken = np.zeros((num_items, num_steps + 1), dtype=bool)
+    for i in range(num_items):
+        weight = weights[i]
+        if weight > num_steps or values[i] <= 0:
+            continue
+        # with_item reads best before this item, so each item is used at most once
+        with_item = best[:num_steps + 1 - weight] + values[i]
+        improved = with_item > best[weight:]
+        taken[i, weight:] = improved
+        best[weight:] = np.where(improved, with_item, best[weight:])
+
+    chosen = []
+    remaining = num_steps
+    for i in range(num_items - 1, -1, -1):
+        if taken[i, remaining]:
+            chosen.append(i)
+            remaining -= weights[i]
+    return np.array(chosen[::-1], dtype=int), best, step
+
+
+def knapsack_for_budget(curve, max_spend, max_points=None, max_cells=default_knapsack_max_cells):
+    # like SpendCurve.num_journals_for_spend but exact: journals that save money
+    # are always in, the rest is a knapsack over what's left of the budget
+    saves_money = np.flatnonzero(curve.cost_subscription_minus_ill <= 0)
+    costs_money = np.flatnonzero(curve.cost_subscription_minus_ill > 0)
+    spend_saves_money = curve.base_spend + np.sum(curve.cost_subscription_minus_ill[saves_money])
+    use_saves_money = curve.base_use_instant + np.sum(curve.use_paywalled[saves_money])
+
+    (chosen, best, step) = knapsack(curve.cost_subscription_minus_ill[costs_money],
+                                    curve.use_paywalled[costs_money],
+                                    max_spend - spend_saves_money,
+                                    max_cells=max_cells)
+    rows = np.sort(np.concatenate((saves_money, costs_money[chosen]))).astype(int)
+    spend = spend_saves_money + np.sum(curve.cost_subscription_minus_ill[costs_money[chosen]])
+    use_instant = use_saves_money + np.sum(curve.use_paywalled[costs_money[chosen]])
+
+    greedy_num_journals = curve.num_journals_for_spend(max_spend)
+    if step > 1 and curve.use_instant[greedy_num_journals] > use_instant:
+        # costs rounded up to coarse steps can lose more than greedy's leftover budget
+        rows = np.sort(curve.order[:greedy_num_journals])
+        spend = curve.spend[greedy_num_journals]
+        use_instant = curve.use_instant[greedy_num_journals]
+    points = downsample_points(len(best), max_points)
+
+    return {
+        "max_spend": round(float(max_spend), 2),
+        "step": step,
+        "is_exact": step == 1,
+        "issn_ls": [curve.issn_ls[row] for row in rows],
+        "spend": round(float(spend), 2),
+        "use_instant": round(float(use_instant), 2),
+        "use_instant_percent": round(100 * float(use_instant) / curve.use_total, 4) if curve.use_total else 0,
+        "greedy_use_instant": round(float(curve.use_instant[greedy_num_journals]), 2),
+        # the most instant use for every budget up to max_spend
+        "budget_curve": {
+            "spend": np.round(spend_saves_money + step * points, 2).tolist(),
+            "use_instant": np.round(use_saves_money + best[points], 2).tolist(),
+        },
+    }
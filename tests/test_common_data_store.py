@@ -0,0 +1,52 @@
+import os
+
+from common_data_store import CommonDataStore
+from common_data_store import latest_local_common_data_store
+from common_data_store import write_common_data_store
+
+
+def oa_rows(year):
+    return [{"fresh_oa_status": "green", "year_int": year, "count": 3.0},
+            {"fresh_oa_status": "bronze", "year_int": year, "count": None}]
+
+
+common_data = {
+    "embargo_dict": {"0000-0001": 12, "0000-0003": None},
+    "unpaywall_downloads_dict_raw": {
+        "0000-0001": {"downloads_total": 120.5, "num_papers_2021": 40, "downloads_0y": 60.0},
+        "0000-0002": {"downloads_total": 7.0, "num_papers_2021": None, "downloads_0y": 1.5},
+    },
+    "social_networks": {"0000-0002": 0.06},
+    "society": {"0000-0001": "YES", "0000-0002": "NO"},
+    "num_papers": {"0000-0001": {2019: 10, 2020: 12}, "0000-0003": {2020: 4}},
+    "oa": {
+        "with_submitted_with_bronze": {"0000-0001": oa_rows(2019.0), "0000-0002": []},
+        "with_submitted_no_bronze": {"0000-0001": oa_rows(2020.0)},
+        "no_submitted_with_bronze": {},
+        "no_submitted_no_bronze": {"0000-0003": oa_rows(2018.0)},
+    },
+}
+
+
+def test_common_data_store_round_trip(tmp_path):
+    path = os.path.join(str(tmp_path), "build")
+    manifest = write_common_data_store(common_data, path)
+    assert latest_local_common_data_store(str(tmp_path)) == path
+
+    store = CommonDataStore(path)
+    assert store.build_id == manifest["build_id"]
+    assert "num_papers" in store
+    issns = ["0000-0001", "0000-0002", "0000-0003", "9999-9999"]
+
+    assert store.table("embargo_dict", issns) == common_data["embargo_dict"]
+    assert store.table("unpaywall_downloads_dict_raw", issns) == common_data["unpaywall_downloads_dict_raw"]
+    assert store.table("social_networks", issns) == common_data["social_networks"]
+    assert store.table("society", issns) == common_data["society"]
+    assert store.table("num_papers", issns) == common_data["num_papers"]
+    assert store.table("oa.with_submitted_with_bronze", issns) == {"0000-0001": oa_rows(2019.0)}
+    assert store.table("oa.no_submitted_with_bronze", issns) == {}
+    assert store.table("oa.no_submitted_no_bronze", issns) == common_data["oa"]["no_submitted_no_bronze"]
+
+    # only the rows of the requested issn_ls
+    assert store.table("num_papers", ["0000-0003"]) == {"0000-0003": {2020: 4}}
+    assert store.table("society", []) == {}
@@ -54,3 +54,23 @@ def test_bindvars_get_perpetual_access_from_cache():
     assert len(res) > 0
     assert isinstance(res[0], psycopg2.extras.RealDictRow)
     assert list(res[0].keys()) == ['institution_id', 'institution_short_name', 'institution_name', 'package_id', 'usage', 'num_journals', 'tags', 'included', 'sent_date', 'return_date', 'changed_date', 'member_added_subrs']
+
+def test_journal_aggregates_match_member_rows():
+    from consortium import consortium_get_computed_data
+    member_rows = [row for row in consortium_get_computed_data(scenario_id_with_email)
+                   if row["member_package_id"] in cons.member_institution_included_list]
+    aggregates = cons.build_journal_aggregates()
+    assert len(aggregates) == len(set(row["issn_l"] for row in member_rows))
+    issn_l = member_rows[0]["issn_l"]
+    journal_rows = [row for row in member_rows if row["issn_l"] == issn_l]
+    assert aggregates[issn_l]["num_members"] == len(journal_rows)
+    assert aggregates[issn_l]["sums"]["usage"] == pytest.approx(sum(row["usage"] for row in journal_rows))
+    assert aggregates[issn_l]["lists"]["package_id"] == [row["package_id"] for row in journal_rows]
+
+def test_consortium_get_computed_frame():
+    from consortium import consortium_get_computed_frame, consortium_get_computed_data
+    frame = consortium_get_computed_frame(scenario_id)
+    assert len(frame) == len(consortium_get_computed_data(scenario_id))
+    assert frame["issn_l"].dtype.name == "category"
+    assert frame["member_package_id"].dtype.name == "category"
+    assert frame["usage"].dtype.name == "float64"
@@ -1,3 +1,6 @@
+import csv
+import os
+
 import pytest
 import requests
 
@@ -6,6 +9,7 @@ from package import Package
 from counter import CounterInput
 from app import get_db_cursor
 from app import s3_client
+from util import write_to_tempfile
 
 # scott+anothertest@ourresearch.org
 # package name: "Els"
@@ -45,6 +49,37 @@ def test_imports_counter_4_samples():
         rows, warnings = CounterInput().normalize_rows(file_name='tests/test_files/counter/{}'.format(file_name))
         assert expected_rows == rows
 
+def test_trj3_detected_past_header_sample():
+    class SmallSampleCounterInput(CounterInput):
+        header_sample_size = 2
+
+    # no report name above the column names, and the first OA_Gold row is past the sample
+    test_file = write_to_tempfile("""
+Title,Print_ISSN,Online_ISSN,Metric_Type,Access_Type,Reporting_Period_Total,Jan-2019,Feb-2019
+Zoology,0944-2006,,Total_Item_Requests,Controlled,5,2,3
+Zoology,0944-2006,,Unique_Item_Requests,Controlled,4,2,2
+Manufacturing Letters,2213-8463,,Total_Item_Requests,Controlled,7,3,4
+Manufacturing Letters,2213-8463,,Total_Item_Requests,OA_Gold,2,1,1
+    """.strip())
+
+    counter_input = SmallSampleCounterInput()
+    rows, warnings = counter_input.normalize_rows(file_name=test_file)
+    assert 4 == len(rows)
+    assert set(["trj3"]) == set([row["report_name"] for row in rows])
+    assert set(["5"]) == set([row["report_version"] for row in rows])
+
+    # rows already in the staging csv are written again with the new report name
+    counter_input = SmallSampleCounterInput()
+    normalized_rows = counter_input.iter_normalized_rows(test_file, counter_input.new_error_rows())
+    normalized_csv_filename, sorted_fields, num_rows = counter_input.write_staging_csv(normalized_rows, "package-test")
+    with open(normalized_csv_filename) as normalized_csv_file:
+        staged_rows = list(csv.DictReader(normalized_csv_file, fieldnames=sorted_fields))
+    os.remove(normalized_csv_filename)
+    assert 4 == num_rows
+    assert set(["trj3"]) == set([row["report_name"] for row in staged_rows])
+    assert "trj3" == counter_input.header_values_used["report_name"]
+
+
 def test_set_to_delete():
     report_name = "jr1"
     res = CounterInput().set_to_delete(package_id, report_name)
@@ -1,13 +1,15 @@
 import pytest
 import os
 import filecmp
-from excel import convert_xls_to_xlsx, convert_spreadsheet_to_csv
+from excel import convert_spreadsheet_to_csv, iter_spreadsheet_sheets
 
-def test_convert_xls_to_xlsx():
-    x = convert_xls_to_xlsx('tests/test_files/counter/counter4_jr1_2018_01.xls')
-    assert isinstance(x, str)
-    assert '.xlsx' in x
-    assert os.path.isfile(x)
+def test_iter_spreadsheet_sheets_xls_matches_xlsx():
+    # .xls is read with xlrd and .xlsx with openpyxl, neither is converted first
+    xls_sheets = list((name, list(rows)) for name, rows in iter_spreadsheet_sheets('tests/test_files/counter/counter4_jr1_2018_01.xls'))
+    xlsx_sheets = list((name, list(rows)) for name, rows in iter_spreadsheet_sheets('tests/test_files/counter/counter4_jr1_2018_01.xlsx'))
+    assert len(xls_sheets) == len(xlsx_sheets) > 0
+    assert [list(row) for row in xls_sheets[0][1]] == [list(row) for row in xlsx_sheets[0][1]]
+    assert iter_spreadsheet_sheets('tests/test_files/counter/counter4_jr1_2018_01.csv') is None
 
 def test_convert_spreadsheet_to_csv_parsed_good_file():
     x = convert_spreadsheet_to_csv('tests/test_files/counter/counter4_jr1_2018_01.xlsx', parsed=False)
@@ -23,3 +25,20 @@ def test_convert_spreadsheet_to_csv_parsed_with_formulas():
     with pytest.raises(RuntimeError) as err:
         convert_spreadsheet_to_csv('tests/test_files/journal_price/with-formulas.xlsx', parsed=False)
         assert "Uploaded files can not contain formulas" in str(err.value)
+
+
+def test_convert_spreadsheet_to_csv_xls_matches_xlsx():
+    # .xls is read directly, not re-saved as .xlsx first, and gives the same csv
+    xls = convert_spreadsheet_to_csv('tests/test_files/counter/counter4_jr1_2018_01.xls', parsed=False)
+    xlsx = convert_spreadsheet_to_csv('tests/test_files/counter/counter4_jr1_2018_01.xlsx', parsed=False)
+    assert filecmp.cmp(xls[0], xlsx[0], shallow=False)
+
+
+def test_convert_spreadsheet_to_csv_skips_hidden_sheets():
+    # a hidden helper sheet, with a formula in the .xlsx one, isn't read or checked for formulas
+    xls = convert_spreadsheet_to_csv('tests/test_files/journal_price/with-hidden-sheet.xls', parsed=False)
+    xlsx = convert_spreadsheet_to_csv('tests/test_files/journal_price/with-hidden-sheet.xlsx', parsed=False)
+    assert len(xls) == len(xlsx) == 1
+    assert filecmp.cmp(xls[0], xlsx[0], shallow=False)
+    with open(xlsx[0]) as csv_file:
+        assert csv_file.readline().strip() == 'issn,price'
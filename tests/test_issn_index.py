@@ -0,0 +1,20 @@
+from issn_index import IssnIndex
+from issn_index import clean_issn
+
+
+def test_clean_issn():
+    assert clean_issn("issn:1234567x") == ("issn", "1234-567X")
+    assert clean_issn(" 1234-5678 ") == ("issn", "1234-5678")
+    assert clean_issn("FS66-6561") == ("bundle", "FS66-6561")
+    assert clean_issn("1234-56") == ("bad", "1234-56")
+
+
+def test_issn_index():
+    my_issn_index = IssnIndex.from_rows([("0028-0836", "0028-0836"), ("1476-4687", "0028-0836"), (None, "0036-8075"), ("0036-8075", "0036-8075")])
+    assert len(my_issn_index) == 3
+    assert sorted(my_issn_index.issns) == ["0028-0836", "0036-8075", "1476-4687"]
+    assert "1476-4687" in my_issn_index
+    assert "1234-5678" not in my_issn_index
+    assert my_issn_index.get_issn_l("1476-4687") == "0028-0836"
+    assert my_issn_index.get_issn_l("1234-5678") is None
+    assert my_issn_index.get_issn_l("1234-5678", "1234-5678") == "1234-5678"
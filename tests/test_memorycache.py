@@ -0,0 +1,105 @@
+import contextlib
+import datetime
+
+import numpy as np
+
+import app
+from app import MemoryCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCursor(object):
+    def __init__(self, results):
+        self.results = results
+        self.commands = []
+
+    def execute(self, command, args=None):
+        self.commands.append((command, args))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+
+def make_store(monkeypatch, max_bytes=3000, default_ttl=60, reset_poll_seconds=10):
+    clock = Clock()
+    monkeypatch.setattr(app, "time", clock)
+    store = MemoryCache(max_bytes=max_bytes, default_ttl=default_ttl, reset_poll_seconds=reset_poll_seconds)
+    # resets were just checked, so get doesn't go to the database
+    store.resets_checked_time = clock.now
+    return store, clock
+
+
+def test_memorycache_lru_eviction(monkeypatch):
+    (store, clock) = make_store(monkeypatch)
+    for key in ["a", "b", "c"]:
+        store.set(key, "f", np.zeros(1000, dtype=np.uint8))
+    assert store.num_bytes == 3000
+
+    # a was used last, so b is the oldest
+    assert store.get("a", "f") is not None
+    store.set("d", "f", np.zeros(1000, dtype=np.uint8))
+    assert list(store.entries.keys()) == ["c", "a", "d"]
+    assert store.get("b", "f") is None
+    assert store.num_bytes == 3000
+    assert store.stats["f"]["evictions"] == 1
+    assert store.stats["f"]["entries"] == 3
+
+    store.set("e", "f", np.zeros(4000, dtype=np.uint8))
+    assert "e" not in store.entries
+    assert store.stats["f"]["too_big"] == 1
+
+
+def test_memorycache_ttl(monkeypatch):
+    (store, clock) = make_store(monkeypatch, reset_poll_seconds=10 ** 9)
+    store.set("default", "f", [1])
+    store.set("short", "f", [2], ttl=5)
+    store.set("forever", "f", [3], ttl=0)
+
+    clock.now += 6
+    assert store.get("short", "f") is None
+    assert store.get("default", "f") == [1]
+    assert store.stats["f"]["expirations"] == 1
+
+    clock.now += 60
+    assert store.get("default", "f") is None
+    assert store.get("forever", "f") == [3]
+    assert store.stats["f"]["expirations"] == 2
+    assert list(store.entries.keys()) == ["forever"]
+
+
+def test_memorycache_check_resets(monkeypatch):
+    (store, clock) = make_store(monkeypatch)
+    first_updated = datetime.datetime(2022, 1, 1)
+    reset_updated = datetime.datetime(2022, 1, 2)
+    cursor = FakeCursor([
+        [{"cache_call": None, "updated": first_updated}],
+        [{"cache_call": "a", "updated": reset_updated}],
+    ])
+    monkeypatch.setattr(app, "get_db_cursor", lambda: contextlib.nullcontext(cursor))
+
+    store.set("a", "f", [1])
+    store.set("b", "f", [2])
+
+    # the first check only notes the latest reset
+    clock.now += 11
+    assert store.get("a", "f") == [1]
+    assert store.resets_checked_updated == first_updated
+
+    # not again until reset_poll_seconds have passed
+    clock.now += 5
+    store.check_resets()
+    assert len(cursor.commands) == 1
+
+    clock.now += 6
+    assert store.get("a", "f") is None
+    assert cursor.commands[1][1] == (first_updated,)
+    assert store.get("b", "f") == [2]
+    assert store.stats["f"]["resets"] == 1
+    assert store.resets_checked_updated == reset_updated
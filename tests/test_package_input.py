@@ -1,4 +1,7 @@
 import datetime
+import os
+import tempfile
+
 import pytest
 import requests
 
@@ -248,6 +251,53 @@ int,price,issn
             }
         ] == warnings['rows']
 
+def test_error_rows_are_a_sample():
+    class SmallSampleFormat(TestInputFormat):
+        max_error_rows = 2
+
+    test_file = write_to_tempfile("""
+int,issn
+1,2093-968X
+2,not an issn
+3,not an issn
+
+4,not an issn
+5,1990-7478
+    """.strip())
+
+    rows, warnings = SmallSampleFormat().normalize_rows(file_name=test_file)
+
+    assert [
+        {'int': 1, 'issn': '2093-968X'},
+        {'int': 5, 'issn': '1990-7478'},
+    ] == rows
+
+    # row numbers are lines in the file, counting the blank one
+    assert [3, 4] == [row['row_id']['value'] for row in warnings['rows']]
+    assert 3 == warnings['num_rows']
+
+def test_staging_csv_removed_on_error(monkeypatch):
+    staging_csv_filenames = []
+    real_mkstemp = tempfile.mkstemp
+
+    def mkstemp():
+        (handle, filename) = real_mkstemp()
+        staging_csv_filenames.append(filename)
+        return handle, filename
+    monkeypatch.setattr(tempfile, "mkstemp", mkstemp)
+
+    def rows():
+        yield {'int': 1, 'issn': '2093-968X'}
+        raise RuntimeError("Error: bad row")
+
+    input_format = TestInputFormat()
+    input_format.header_values_used = {}
+    with pytest.raises(RuntimeError):
+        input_format.write_staging_csv(rows(), "package-test")
+
+    assert 1 == len(staging_csv_filenames)
+    assert not os.path.exists(staging_csv_filenames[0])
+
 def test_excluded_name_snippet():
     class PickyInputFormat(TestInputFormat):
         @classmethod
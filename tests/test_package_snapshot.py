@@ -0,0 +1,37 @@
+from collections import defaultdict
+
+import package_snapshot
+from package_snapshot import dump_snapshot
+from package_snapshot import get_package_inputs
+from package_snapshot import get_package_inputs_version
+from package_snapshot import load_snapshot
+from package_snapshot import read_local_snapshot
+from package_snapshot import write_local_snapshot
+
+package_id = 'package-55BdKPno2uX5'
+
+
+def test_snapshot_round_trip():
+    citation_dict = defaultdict(dict)
+    citation_dict['0031-9252'][2019] = 4
+    inputs = {'specific': {'member_package_ids': [package_id], package_id: {'citation_dict': citation_dict}}, 'prices': {}}
+    snapshot_bytes = dump_snapshot(package_id, 'v1', inputs)
+    assert load_snapshot(snapshot_bytes, package_id, 'v1') == inputs
+    assert load_snapshot(snapshot_bytes, package_id, 'v2') is None
+    assert load_snapshot(snapshot_bytes, 'package-other', 'v1') is None
+
+
+def test_local_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(package_snapshot, 'package_snapshot_dir', str(tmp_path))
+    write_local_snapshot(package_id, dump_snapshot(package_id, 'v1', {'prices': {'0031-9252': 10}}))
+    assert read_local_snapshot(package_id, 'v1') == {'prices': {'0031-9252': 10}}
+    assert read_local_snapshot(package_id, 'v2') is None
+    assert read_local_snapshot('package-other', 'v1') is None
+
+
+def test_get_package_inputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(package_snapshot, 'package_snapshot_dir', str(tmp_path))
+    assert get_package_inputs_version(package_id)
+    inputs = get_package_inputs(package_id)
+    assert inputs['specific']['member_package_ids'] == [package_id]
+    assert read_local_snapshot(package_id, get_package_inputs_version(package_id)) == inputs
@@ -0,0 +1,50 @@
+import os
+
+from parse_uploads import LocalUploadStore
+from parse_uploads import claim_upload
+from parse_uploads import parse_upload_key
+from parse_uploads import release_upload
+
+package_id = 'package-55BdKPno2uX5'
+
+
+def test_parse_upload_key():
+    assert parse_upload_key('package-abc123_counter-trj2.xlsx') == ('package-abc123', 'counter-trj2')
+    assert parse_upload_key('package-abc123_price.csv') == ('package-abc123', 'price')
+    assert parse_upload_key('not-an-upload.csv') is None
+
+
+def test_local_upload_store(tmp_path):
+    store = LocalUploadStore(str(tmp_path))
+    with open(os.path.join(store.preprocess_dir, 'package-abc123_price.csv'), 'w') as f:
+        f.write('issn,price\n')
+
+    uploads = store.list_uploads()
+    assert [upload['key'] for upload in uploads] == ['package-abc123_price.csv']
+    assert uploads[0]['size'] == 11
+
+    file_name = str(tmp_path / 'downloaded.csv')
+    store.download('package-abc123_price.csv', file_name)
+    assert open(file_name).read() == 'issn,price\n'
+
+    store.finish('package-abc123_price.csv')
+    assert not store.exists('package-abc123_price.csv')
+    assert store.list_uploads() == []
+    assert os.listdir(store.finished_dir) == ['package-abc123_price.csv']
+
+
+def test_claim_upload():
+    key = '{}_test-claim.csv'.format(package_id)
+    try:
+        assert claim_upload(package_id, key, 'test-bucket', 'worker-a')
+        assert not claim_upload(package_id, key, 'test-bucket', 'worker-b')
+        release_upload(package_id, key, 'worker-a')
+        assert claim_upload(package_id, key, 'test-bucket', 'worker-b')
+
+        # an expired claim is taken over
+        release_upload(package_id, key, 'worker-b')
+        assert claim_upload(package_id, key, 'test-bucket', 'worker-a', lease_seconds=-1)
+        assert claim_upload(package_id, key, 'test-bucket', 'worker-b')
+    finally:
+        release_upload(package_id, key, 'worker-a')
+        release_upload(package_id, key, 'worker-b')
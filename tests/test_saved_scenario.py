@@ -1,5 +1,7 @@
 import pytest
 from saved_scenario import SavedScenario,save_raw_scenario_to_db,get_latest_scenario_raw,get_latest_scenario
+from saved_scenario import get_latest_scenarios_raw
+from saved_scenario import get_live_scenario,live_scenario_cache
 
 scenario_id2 = '8kPSbFCN' # scott+anothertest@ourresearch.org, "Sage-HopeCollege"/"potatoes"
 
@@ -37,6 +39,11 @@ def test_get_latest_scenario_raw():
     my_dict['configs']['notes'] = ""
     save_raw_scenario_to_db(scenario_id2, my_dict, None)
 
+def test_get_latest_scenarios_raw():
+    res = get_latest_scenarios_raw([scenario_id2, "not-a-scenario"])
+    assert res[scenario_id2] == get_latest_scenario_raw(scenario_id2)
+    assert res["not-a-scenario"] == (None, None)
+
 def test_get_latest_scenario():
     scenario_before_update = get_latest_scenario(scenario_id2)
 
@@ -68,3 +75,28 @@ def test_saved_scenario():
     with pytest.raises(AttributeError):
         scenario_by_id.to_dict_meta()
     
+
+def test_live_scenario_cache():
+    scenario = SavedScenario.query.get(scenario_id2)
+    live_scenario = get_live_scenario(scenario_id2, scenario.package_id)
+    hits_before = live_scenario_cache.hits
+    assert get_live_scenario(scenario_id2, scenario.package_id) is live_scenario
+    assert live_scenario_cache.hits == hits_before + 1
+
+    # changing only subscriptions updates the cached scenario in place
+    my_dict = scenario.to_dict_saved_from_db()
+    issn_l = live_scenario.journals[0].issn_l
+    subscribed_before = issn_l in my_dict['subrs']
+    if subscribed_before:
+        my_dict['subrs'] = [x for x in my_dict['subrs'] if x != issn_l]
+    else:
+        my_dict['subrs'] = my_dict['subrs'] + [issn_l]
+    save_raw_scenario_to_db(scenario_id2, my_dict, None)
+    assert get_live_scenario(scenario_id2, scenario.package_id) is live_scenario
+    assert live_scenario.get_journal(issn_l).subscribed != subscribed_before
+    assert live_scenario.cost == get_latest_scenario(scenario_id2).cost
+
+    # changing settings means a rebuild
+    my_dict['configs']['weight_citation'] = 5 if my_dict['configs']['weight_citation'] == 10 else 10
+    save_raw_scenario_to_db(scenario_id2, my_dict, None)
+    assert get_live_scenario(scenario_id2, scenario.package_id) is not live_scenario
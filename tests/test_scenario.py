@@ -180,6 +180,14 @@ def test_bindvars_get_package_specific_scenario_data_from_db():
     assert len(res) > 0
     assert list(res.keys()) == ['timing', 'counter_dict', 'citation_dict', 'authorship_dict']
 
+def test_bindvars_get_packages_specific_scenario_data_from_db():
+    from scenario import get_packages_specific_scenario_data_from_db, get_counter_totals_from_db
+    res = get_packages_specific_scenario_data_from_db([package_id, "package-not-a-package"])
+    assert set(res.keys()) == {package_id, "package-not-a-package"}
+    assert res[package_id]["counter_dict"] == get_counter_totals_from_db(package_id)
+    assert len(res[package_id]["citation_dict"]) > 0
+    assert len(res["package-not-a-package"]["counter_dict"]) == 0
+
 def test_bindvars_get_apc_data_from_db():
     from scenario import get_apc_data_from_db
     res = get_apc_data_from_db(package_id)
@@ -204,3 +212,21 @@ def test_bindvars_get_core_list_from_db():
     out = list(res.items())
     assert isinstance(out[0][0], str)
     assert isinstance(out[0][1], psycopg2.extras.DictRow)
+
+def test_set_subscriptions_matches_fresh_scenario():
+    from scenario import Scenario
+    my_scenario = Scenario(package_id)
+    issn_ls = [j.issn_l for j in my_scenario.journals_sorted_cpu]
+    my_scenario.set_subscriptions(issn_ls[:20], issn_ls[30:35])
+    my_scenario.to_dict_summary_dict()
+    # toggle some journals on and some off after the totals have been read
+    subrs = issn_ls[10:40]
+    custom_subrs = issn_ls[32:33]
+    my_scenario.set_subscriptions(subrs, custom_subrs)
+
+    fresh_scenario = Scenario(package_id, {"subrs": subrs, "customSubrs": custom_subrs})
+    summary = my_scenario.to_dict_summary_dict()
+    fresh_summary = fresh_scenario.to_dict_summary_dict()
+    for key in fresh_summary:
+        assert summary[key] == pytest.approx(fresh_summary[key], abs=0.011), key
+    assert sorted(j.issn_l for j in my_scenario.subscribed) == sorted(j.issn_l for j in fresh_scenario.subscribed)
@@ -0,0 +1,156 @@
+import datetime
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import scenario_engine
+import package_snapshot
+from scipy.optimize import curve_fit
+from scipy.special import expit
+
+from assumptions import Assumptions
+from scenario_engine import ScenarioEngine
+from scenario_engine import fit_download_curves
+from scenario_engine import fit_expit_curves
+from scenario_engine import ranks_and_terciles
+
+package_id = 'package-small'
+issn_ls = ['0000-0001', '0000-0002', '0000-0003']
+
+
+def small_package_data(package_id):
+    # three journals: one with counter, prices, OA, citations and perpetual access; one
+    # with an embargo and no perpetual access; one with no unpaywall downloads at all
+    this_year = datetime.datetime.utcnow().year
+    past_years = list(range(this_year - 6, this_year))
+
+    def by_year(values):
+        return dict(zip(past_years, values))
+
+    def oa_rows(green, hybrid, bronze):
+        rows = []
+        for (status, counts) in [('green', green), ('hybrid', hybrid), ('bronze', bronze)]:
+            rows += [{'fresh_oa_status': status, 'year_int': float(year), 'count': count} for year, count in zip(past_years, counts)]
+        return rows
+
+    oa = {
+        '0000-0001': oa_rows([4, 5, 6, 6, 7, 8], [2, 2, 3, 3, 4, 4], [1, 1, 1, 2, 2, 3]),
+        '0000-0002': oa_rows([10, 12, 14, 15, 16, 18], [0, 0, 0, 0, 0, 0], [5, 4, 6, 5, 7, 6]),
+    }
+    return {
+        'unpaywall_downloads_dict': {
+            '0000-0001': {'downloads_total': 2400.0, 'num_papers_2021': 120,
+                          'downloads_0y': 900.0, 'downloads_1y': 520.0, 'downloads_2y': 380.0, 'downloads_3y': 300.0, 'downloads_4y': 260.0},
+            '0000-0002': {'downloads_total': 800.0, 'num_papers_2021': 60,
+                          'downloads_0y': 300.0, 'downloads_1y': 110.0, 'downloads_2y': 80.0, 'downloads_3y': 60.0, 'downloads_4y': 50.0},
+            '0000-0003': None,
+        },
+        'prices': {'0000-0001': 4200.0, '0000-0002': 1800.0, '0000-0003': 950.0},
+        'embargo_dict': {'0000-0002': 12},
+        'social_networks': {'0000-0001': 0.08},
+        'num_papers': {
+            '0000-0001': by_year([100, 105, 110, 112, 118, 120]),
+            '0000-0002': by_year([50, 52, 55, 58, 59, 60]),
+        },
+        'perpetual_access': {'0000-0001': {'start_date': datetime.datetime(2000, 1, 1), 'end_date': None}},
+        'oa': {
+            'with_submitted_with_bronze': oa,
+            'with_submitted_no_bronze': oa,
+            'no_submitted_with_bronze': oa,
+            'no_submitted_no_bronze': oa,
+        },
+        'society': {},
+        'concepts': {},
+        package_id: {
+            'counter_dict': {'0000-0001': 3100.0, '0000-0002': 650.0, '0000-0003': 40.0},
+            'citation_dict': {'0000-0001': by_year([3, 4, 5, 6, 7, 8]), '0000-0002': by_year([1, 0, 2, 1, 3, 2])},
+            'authorship_dict': {'0000-0001': by_year([0.5, 1.0, 1.5, 0.5, 1.0, 2.0])},
+        },
+    }
+
+
+# from the per-journal Journal model before ScenarioEngine, on small_package_data
+expected_columns = {
+    'downloads_total': [3074.27, 639.34, 0.0],
+    'use_total': [3252.776, 655.0776, 0.0001],
+    'use_oa': [354.4516, 495.9138, 0.0],
+    'use_backfile': [1103.7729, 0.0, 0.0],
+    'use_social_networks': [171.92024, 39.3047, 0.0],
+    'use_free_instant': [1630.14474, 535.2185, 0.0],
+    'use_paywalled': [1622.63126, 119.8591, 0.0001],
+    'subscription_cost': [5208.8, 2232.4, 1178.0],
+    'ill_cost': [1303.5467, 99.4327, 0.0],
+    'cost_subscription_minus_ill': [3905.2533, 2132.9673, 1178.0],
+    'cpu': [2.406741, 17.795623, None],
+    'num_citations': [6.0, 1.6, 0.0],
+    'num_authorships': [1.2, 0.0, 0.0],
+    'use_total_by_year': [[3252.776] * 5, [655.0776] * 5, [0.0] * 5],
+    'downloads_paywalled_by_year': [[459.2084, 1201.6484, 1669.9284, 2015.8484, 2321.2884], [116.9796] * 5, [0.0] * 5],
+}
+
+
+def test_scenario_engine_golden_values():
+    engine = ScenarioEngine(issn_ls, small_package_data(package_id), Assumptions(), package_id)
+    for column, expected in expected_columns.items():
+        for row, expected_value in enumerate(expected):
+            value = engine.value(column, row)
+            if expected_value is None:
+                assert value is None, column
+            else:
+                assert value == pytest.approx(expected_value, abs=1e-4), column
+
+
+def test_ranks_and_terciles():
+    values = [3.0, np.nan, 1.0, 3.0, 0.0, 7.0, 1.0]
+    (ranks, terciles) = ranks_and_terciles([values])
+    ranked = pd.Series(values).rank(method='first', na_option="keep")
+    np.testing.assert_array_equal(ranks[0], ranked.values)
+    expected = pd.qcut(ranked, 3, labels=["low", "medium", "high"]).tolist()
+    assert terciles[0].tolist()[2:] == expected[2:] and terciles[0][0] == expected[0]
+    assert ranks_and_terciles([[np.nan, 2.0]])[1][0].tolist() == ["-", "-"]
+
+
+def test_fit_expit_curves_matches_curve_fit():
+    def func(x, a, b, c):
+        return b + a * expit(x / c)
+
+    rng = np.random.RandomState(0)
+    x = np.arange(5, dtype=float)
+    totals = rng.uniform(50, 5000, 40)
+    decays = rng.uniform(0.3, 0.9, 40)
+    y = np.round(totals[:, None] * decays[:, None] ** x + rng.uniform(-20, 20, (40, 5)), 1)
+
+    (params, converged) = fit_expit_curves(y)
+    assert converged.all()
+    num_same_fits = 0
+    for i in range(len(y)):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            (scipy_params, pcov) = curve_fit(func, x, y[i], p0=[max(y[i]), 30, -1], maxfev=2000)
+        scipy_cost = np.sum((y[i] - func(x, *scipy_params))**2)
+        cost = np.sum((y[i] - func(x, *params[i]))**2)
+        assert cost <= scipy_cost * (1 + 1e-6) + 1e-6
+        # curve_fit sometimes stops early on a worse curve; where it found the same minimum the curves match
+        if cost >= scipy_cost * (1 - 1e-3):
+            num_same_fits += 1
+            np.testing.assert_allclose(func(x, *params[i]), func(x, *scipy_params), rtol=1e-4, atol=0.01)
+    assert num_same_fits >= 0.9 * len(y)
+
+
+def test_fit_download_curves_are_saved_and_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(package_snapshot, "package_snapshot_dir", str(tmp_path))
+    monkeypatch.setattr(scenario_engine, "download_curve_fit_cache", scenario_engine.OrderedDict())
+    monkeypatch.setattr(scenario_engine, "download_curve_fit_cache_max_size", 2)
+    rows = [[400.0, 150.0, 90.0, 70.0, 60.0], [80.0, 30.0, 20.0, 15.0, 10.0], [900.0, 300.0, 250.0, 150.0, 120.0]]
+
+    fits = fit_download_curves(rows, package_id)
+    assert [fit["input_y"] for fit in fits] == rows
+    # least recently used first, only the last two kept
+    assert list(scenario_engine.download_curve_fit_cache.keys()) == [tuple(row) for row in rows[1:]]
+    assert set(package_snapshot.read_download_curve_fits(package_id).keys()) == set(tuple(row) for row in rows)
+
+    # another process: nothing in memory, and nothing to fit
+    scenario_engine.download_curve_fit_cache.clear()
+    monkeypatch.setattr(scenario_engine, "fit_expit_curves", None)
+    assert fit_download_curves(rows, package_id) == fits
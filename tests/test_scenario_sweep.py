@@ -0,0 +1,38 @@
+import pytest
+
+from scenario_sweep import get_sweep_combinations
+from scenario_sweep import sweep_scenario
+
+package_id = "package-iQF8sFiRY99t"
+
+
+def test_get_sweep_combinations():
+    (fields, combinations) = get_sweep_combinations({"cost_ill": [12, 17], "include_bronze": ["true", "false"]})
+    assert fields == ["cost_ill", "include_bronze"]
+    assert combinations["cost_ill"].tolist() == [12, 12, 17, 17]
+    assert combinations["include_bronze"].tolist() == [True, False, True, False]
+
+    (fields, combinations) = get_sweep_combinations({"weight_authorship": {"min": 0, "max": 100, "num": 3}})
+    assert combinations["weight_authorship"].tolist() == [0, 50, 100]
+
+    with pytest.raises(ValueError):
+        get_sweep_combinations({"include_backfile": [True]})
+    with pytest.raises(ValueError):
+        get_sweep_combinations({"cost_ill": list(range(200)), "weight_citation": list(range(100))})
+
+
+def test_sweep_scenario_matches_scenario():
+    from scenario import Scenario
+
+    my_scenario = Scenario(package_id)
+    response = sweep_scenario(my_scenario, {"cost_ill": [my_scenario.settings.cost_ill, 25], "include_bronze": [True, False]})
+    assert len(response["rows"]) == 4
+    row = dict(zip(response["columns"], response["rows"][0]))
+    assert row["cost"] == my_scenario.cost
+    assert row["cost_spent_percent"] == my_scenario.cost_spent_percent
+    assert row["use_instant_percent"] == my_scenario.use_instant_percent
+
+    bronze_scenario = Scenario(package_id, {"include_bronze": False, "cost_ill": 25})
+    row = dict(zip(response["columns"], response["rows"][3]))
+    assert row["cost"] == bronze_scenario.cost
+    assert row["use_instant_percent"] == bronze_scenario.use_instant_percent
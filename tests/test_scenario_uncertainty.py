@@ -0,0 +1,28 @@
+import numpy as np
+
+from scenario_uncertainty import uncertainty_bands
+
+package_id = "package-iQF8sFiRY99t"
+
+
+def test_uncertainty_bands_without_noise_match_scenario():
+    from scenario import Scenario
+
+    my_scenario = Scenario(package_id)
+    response = uncertainty_bands(my_scenario.engine, my_scenario.subscribed_mask(), my_scenario.settings,
+                                 num_draws=3, sigmas={"counter": 0, "curve": 0, "growth": 0, "oa": 0})
+    assert np.isclose(response["cost"][2], my_scenario.cost)
+    assert np.isclose(response["use_instant_percent"][2], my_scenario.use_instant_percent, atol=0.01)
+    journal = my_scenario.journals[0]
+    cpu = response["journals"][journal.engine_row]["cpu"][2]
+    assert (cpu is None and journal.cpu is None) or np.isclose(cpu, journal.cpu, rtol=1e-4)
+
+
+def test_uncertainty_bands_are_ordered():
+    from scenario import Scenario
+
+    my_scenario = Scenario(package_id)
+    response = uncertainty_bands(my_scenario.engine, my_scenario.subscribed_mask(), my_scenario.settings, num_draws=200, seed=1)
+    assert response["cost"] == sorted(response["cost"])
+    assert response["use_instant_percent"] == sorted(response["use_instant_percent"])
+    assert response == uncertainty_bands(my_scenario.engine, my_scenario.subscribed_mask(), my_scenario.settings, num_draws=200, seed=1)
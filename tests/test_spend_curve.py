@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+
+from spend_curve import SpendCurve
+from spend_curve import knapsack
+from spend_curve import knapsack_for_budget
+
+issn_ls = ['0000-0001', '0000-0002', '0000-0003', '0000-0004', '0000-0005']
+cost_subscription_minus_ill = np.array([50.0, -20.0, 30.0, 80.0, 10.0])
+use_paywalled = np.array([10.0, 5.0, 12.0, 0.0, 1.0])
+cpu = np.where(use_paywalled >= 1, cost_subscription_minus_ill / np.maximum(use_paywalled, 1), np.nan)
+
+
+def make_curve():
+    return SpendCurve(issn_ls, cost_subscription_minus_ill, use_paywalled, cpu,
+                      base_spend=1000, base_use_instant=101, use_total=200, cost_bigdeal=2000)
+
+
+def test_spend_curve():
+    curve = make_curve()
+    # saves money first, then by cpu (2.5, 5, 10), no cpu last
+    assert [issn_ls[row] for row in curve.order] == ['0000-0002', '0000-0003', '0000-0001', '0000-0005', '0000-0004']
+    assert curve.spend.tolist() == [1000, 980, 1010, 1060, 1070, 1150]
+    assert curve.use_instant.tolist() == [101, 106, 118, 128, 129, 129]
+    assert curve.issn_ls_for_spend(900) == ['0000-0002']
+    assert curve.issn_ls_for_spend(1060) == ['0000-0002', '0000-0003', '0000-0001']
+    assert curve.to_dict(max_points=3)['points']['num_journals'] == [0, 1, 2, 5]
+
+
+def test_knapsack_matches_brute_force():
+    rng = np.random.RandomState(0)
+    costs = rng.randint(1, 40, 10).astype(float)
+    values = rng.randint(0, 20, 10).astype(float)
+    for capacity in [0, 15, 60, 150]:
+        (chosen, best, step) = knapsack(costs, values, capacity)
+        brute_force = max(sum(values[list(items)])
+                          for n in range(len(costs) + 1)
+                          for items in itertools.combinations(range(len(costs)), n)
+                          if sum(costs[list(items)]) <= capacity)
+        assert step == 1
+        assert sum(costs[chosen]) <= capacity
+        assert sum(values[chosen]) == brute_force == best[-1]
+
+
+def test_knapsack_for_budget():
+    response = knapsack_for_budget(make_curve(), 1030)
+    # greedy stops after 0000-0003, the knapsack swaps 0000-0005 in for the leftover budget
+    assert response['issn_ls'] == ['0000-0002', '0000-0003', '0000-0005']
+    assert response['use_instant'] == 119
+    assert response['greedy_use_instant'] == 118
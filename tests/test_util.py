@@ -0,0 +1,28 @@
+import datetime
+import decimal
+import gzip
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from util import gzip_stream
+from util import stream_json
+
+
+def test_stream_json():
+    journals = [OrderedDict([("issn_l", "0031-9252"), ("rank", np.int64(3)), ("cpu", float("nan")), ("years", {2021: 2})]),
+                OrderedDict([("issn_l", "2093-968X"), ("price", decimal.Decimal("12.5")), ("updated", datetime.datetime(2021, 1, 2, 3, 4, 5))])]
+    data = OrderedDict([("meta", {"scenario_id": "Jrofb6CY"}), ("journals", iter(journals)), ("warnings", [])])
+    streamed = b"".join(stream_json(data, "journals", batch_size=1))
+    assert list(json.loads(streamed).keys()) == ["meta", "journals", "warnings"]
+    assert json.loads(streamed)["journals"] == [
+        {"issn_l": "0031-9252", "rank": 3, "cpu": None, "years": {"2021": 2}},
+        {"issn_l": "2093-968X", "price": 12.5, "updated": "2021-01-02T03:04:05"},
+    ]
+    assert b"".join(stream_json({"journals": []}, "journals")) == b'{"journals":[]}\n'
+
+
+def test_gzip_stream():
+    chunks = [b'{"journals":[', b'{"issn_l":"0031-9252"}', b"]}\n"]
+    assert gzip.decompress(b"".join(gzip_stream(iter(chunks)))) == b"".join(chunks)
@@ -4,21 +4,25 @@ import bisect
 import codecs
 import collections
 import datetime
+import decimal
 import locale
 import logging
 import math
 import os
 import re
 import tempfile
+import threading
 import time
 import traceback
 import unicodedata
 import urllib.parse
+import zlib
 from codecs import BOM_UTF8, BOM_UTF16_BE, BOM_UTF16_LE, BOM_UTF32_BE, BOM_UTF32_LE
 import chardet
 import numpy as np
 
 import heroku3
+import orjson
 import requests
 import simplejson as json
 import sqlalchemy
@@ -67,6 +71,117 @@ class TimingMessages(object):
         return self.messages
 
 
+class LazyData(object):
+    """A big dataset that is loaded on first use instead of at import.
+
+    `value` loads it (once, whichever thread gets there first) and waits for a
+    load that is already running in the background. For dicts and sets the
+    object can be used in place of the value: `get`, `[]`, `in`, `len`, `items`
+    and friends load it first.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.loaded = False
+        self._value = None
+        self.error = None
+        self.load_seconds = None
+        self.thread = None
+
+    def load(self):
+        with self.lock:
+            if not self.loaded:
+                print("loading {}...".format(self.name))
+                start_time = time.time()
+                try:
+                    self._value = self.loader()
+                    self.error = None
+                except Exception as e:
+                    # not marked as loaded, so the next use tries again
+                    self.error = repr(e)
+                    raise
+                self.load_seconds = elapsed(start_time, 2)
+                self.loaded = True
+                print("loaded {} in {} seconds".format(self.name, self.load_seconds))
+        return self._value
+
+    @property
+    def value(self):
+        if self.loaded:
+            return self._value
+        return self.load()
+
+    def load_in_background(self):
+        if self.loaded or (self.thread and self.thread.is_alive()):
+            return
+
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                print("error loading {} in the background, will load on first use: {}".format(self.name, e))
+
+        self.thread = threading.Thread(target=run, name="lazy-{}".format(self.name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reset(self):
+        with self.lock:
+            self.loaded = False
+            self._value = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "loaded": self.loaded,
+            "loading": bool(self.thread and self.thread.is_alive()),
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+    def get(self, key, default=None):
+        return self.value.get(key, default)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def keys(self):
+        return self.value.keys()
+
+    def values(self):
+        return self.value.values()
+
+    def items(self):
+        return self.value.items()
+
+    def __repr__(self):
+        return "<{} {} loaded={}>".format(self.__class__.__name__, self.name, self.loaded)
+
+
+lazy_data_registry = collections.OrderedDict()
+
+def register_lazy_data(name, loader):
+    if name not in lazy_data_registry:
+        lazy_data_registry[name] = LazyData(name, loader)
+    return lazy_data_registry[name]
+
+def load_lazy_data_in_background(names=None):
+    for name, lazy_data in lazy_data_registry.items():
+        if names is None or name in names:
+            lazy_data.load_in_background()
+
+
 class DelayedAdapter(HTTPAdapter):
     def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
         # logger.info(u"in DelayedAdapter getting {}, sleeping for 2 seconds".format(request.url))
@@ -748,6 +863,64 @@ def jsonify_fast(*args, **kwargs):
               sort_keys=sort_keys) + '\n', mimetype=current_app.config['JSONIFY_MIMETYPE']
     )
 
+def orjson_default(o):
+    # orjson does numpy and datetimes itself; numeric columns from psycopg2 come back as Decimal
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    return myconverter(o)
+
+orjson_options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def stream_json(data, stream_key, batch_size=100):
+    """The bytes of data as json, with data[stream_key] (a list or any iterable) serialized
+    batch_size items at a time instead of all in one string.  Key order is kept.
+    NaN is written as null."""
+    yield b"{"
+    for i, (key, value) in enumerate(data.items()):
+        if i:
+            yield b","
+        if key != stream_key:
+            yield orjson.dumps({key: value}, default=orjson_default, option=orjson_options)[1:-1]
+            continue
+        yield orjson.dumps(key) + b":["
+        batch = []
+        is_first_batch = True
+        for item in value:
+            batch.append(orjson.dumps(item, default=orjson_default, option=orjson_options))
+            if len(batch) >= batch_size:
+                yield (b"" if is_first_batch else b",") + b",".join(batch)
+                batch = []
+                is_first_batch = False
+        if batch:
+            yield (b"" if is_first_batch else b",") + b",".join(batch)
+        yield b"]"
+    yield b"}\n"
+
+def gzip_stream(chunks, compress_level=6):
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def jsonify_streaming(data, stream_key="journals"):
+    """Like jsonify_fast_no_sort for a big response whose bulk is one list, data[stream_key]:
+    the list goes out in batches as it's serialized, gzipped as it goes if the client takes
+    gzip, so the whole response is never in memory as one string.  data[stream_key] can be
+    a generator, which is then consumed while the response is sent."""
+    from flask import request
+    from flask import stream_with_context
+
+    chunks = stream_json(data, stream_key)
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("Accept-Encoding", "").lower():
+        # Flask-Compress leaves responses that already have a Content-Encoding alone
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return current_app.response_class(stream_with_context(chunks), mimetype=current_app.config['JSONIFY_MIMETYPE'], headers=headers)
+
+
 def find_normalized_license(text):
     if not text:
         return None
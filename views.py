@@ -55,14 +55,21 @@ from saved_scenario import save_raw_scenario_to_db
 from saved_scenario import save_raw_member_institutions_included_to_db
 from saved_scenario import save_feedback_on_member_institutions_included_to_db
 from saved_scenario import get_latest_scenario_raw
+from saved_scenario import live_scenario_cache
+from saved_scenario import reset_live_scenario_cache
 from scenario import get_common_package_data
 from scenario import get_clean_package_id
+from scenario_sweep import sweep_scenario
+from scenario_uncertainty import uncertainty_bands
+from scenario_uncertainty import default_num_draws
+from scenario_uncertainty import max_num_draws
 from consortium import get_consortium_ids
 from consortium import Consortium
 from user import User, default_password
 
 from util import jsonify_fast
 from util import jsonify_fast_no_sort
+from util import jsonify_streaming
 from util import str2bool
 from util import elapsed
 from util import abort_json
@@ -71,11 +78,19 @@ from util import TimingMessages
 from util import get_ip
 from util import response_json
 from util import get_sql_answer
+from util import lazy_data_registry
+from util import load_lazy_data_in_background
 from app import logger
 
 from app import DEMO_PACKAGE_ID
 from app import s3_client
 
+# start loading the big datasets (common data, journal metadata) in the
+# background, so the worker can take requests right away; a request that needs
+# one before it's ready waits for it
+if os.getenv("PRELOAD_LAZY_DATA", "True") == "True":
+    load_lazy_data_in_background()
+
 
 def s3_cache_get(url):
     print("in cache_get with", url)
@@ -715,6 +730,30 @@ def institution_ror_id(institution_id, ror_id):
 # curl -s -X POST -H 'Accept: application/json' -H "Content-Type: application/json' --data '{"username":"test","password":"password","rememberMe":false}' http://localhost:5004/login
 # curl -H 'Accept: application/json' -H "Authorization: Bearer ${TOKEN}" http://localhost:5004/protected
 
+@app.route("/live/cache/scenarios", methods=["GET"])
+def live_scenario_cache_get():
+    if not is_authorized_superuser():
+        abort_json(500, "Secret doesn't match, not getting cache stats")
+
+    return jsonify_fast_no_sort(live_scenario_cache.to_dict())
+
+
+@app.route("/live/cache/memorycache", methods=["GET"])
+def memorycache_get():
+    if not is_authorized_superuser():
+        abort_json(500, "Secret doesn't match, not getting cache stats")
+
+    return jsonify_fast_no_sort(app.memorycache_store.to_dict())
+
+
+@app.route("/live/cache/lazy-data", methods=["GET"])
+def lazy_data_get():
+    if not is_authorized_superuser():
+        abort_json(500, "Secret doesn't match, not getting lazy data status")
+
+    return jsonify_fast_no_sort([lazy_data.to_dict() for lazy_data in lazy_data_registry.values()])
+
+
 # Protect a view with jwt_required, which requires a valid access token
 # in the request to access.
 @app.route("/protected", methods=["GET"])
@@ -870,6 +909,7 @@ def update_publisher(publisher_id):
 
     db.session.merge(publisher)
     safe_commit(db)
+    reset_live_scenario_cache(publisher_id)  # currency and big deal costs are baked into built scenarios
 
     package_dict = publisher.to_package_dict()
     return jsonify_fast_no_sort(package_dict)
@@ -1288,19 +1328,72 @@ def scenario_id_summary_get(scenario_id):
     my_timing.log_timing("after to_dict()")
     return jsonify_fast_no_sort(my_saved_scenario.live_scenario.to_dict_summary())
 
+@app.route("/scenario/<scenario_id>/spend-curve", methods=["GET"])
+@jwt_required()
+def scenario_id_spend_curve_get(scenario_id):
+    # the greedy spend -> instant access curve, and with ?spend=<percent of big deal>
+    # the exact best subscription set for that budget
+    my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.view())
+    my_live_scenario = my_saved_scenario.live_scenario
+    max_points = request.args.get("max_points", 500, type=int)
+    if max_points < 2:
+        return abort_json(400, "max_points must be at least 2")
+    response = {"curve": my_live_scenario.spend_curve.to_dict(max_points=max_points)}
+    spend = request.args.get("spend", None, type=float)
+    if spend is not None:
+        response["knapsack"] = my_live_scenario.knapsack_for_spend(spend, max_points=max_points)
+    return jsonify_fast_no_sort(response)
+
+@app.route("/scenario/<scenario_id>/sweep", methods=["POST"])
+@jwt_required()
+def scenario_id_sweep_post(scenario_id):
+    # posted data is {"ranges": {"cost_ill": [12, 17, 25], "weight_authorship": {"min": 0, "max": 100, "num": 5}, ...}}
+    if not request.is_json:
+        return abort_json(400, "This post requires data.")
+    my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.view())
+    try:
+        response = sweep_scenario(my_saved_scenario.live_scenario, request.json.get("ranges", {}))
+    except ValueError as e:
+        return abort_json(400, str(e))
+    return jsonify_fast_no_sort(response)
+
+@app.route("/scenario/<scenario_id>/uncertainty", methods=["GET"])
+@jwt_required()
+def scenario_id_uncertainty_get(scenario_id):
+    # percentile bands for cost, use_instant_percent and each journal's cpu, ?draws=1000&seed=0
+    num_draws = request.args.get("draws", default_num_draws, type=int)
+    if num_draws < 1 or num_draws > max_num_draws:
+        return abort_json(400, "draws must be between 1 and {}".format(max_num_draws))
+    sigmas = {}
+    for key in ["counter", "curve", "growth", "oa"]:
+        sigma = request.args.get("sigma_{}".format(key), None, type=float)
+        if sigma is not None:
+            if sigma < 0:
+                return abort_json(400, "sigma_{} can't be negative".format(key))
+            sigmas[key] = sigma
+
+    my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.view())
+    my_live_scenario = my_saved_scenario.live_scenario
+    response = uncertainty_bands(my_live_scenario.engine,
+                                 my_live_scenario.subscribed_mask(),
+                                 my_live_scenario.settings,
+                                 num_draws=num_draws,
+                                 sigmas=sigmas,
+                                 seed=request.args.get("seed", 0, type=int))
+    return jsonify_fast_no_sort(response)
+
 @app.route("/scenario/<scenario_id>/journals", methods=["GET"])
 @jwt_required()
 def scenario_id_journals_get(scenario_id):
     consortium_ids = get_consortium_ids()
     if scenario_id in [d["scenario_id"] for d in consortium_ids]:
         my_consortium = Consortium(scenario_id)
-        my_saved_scenario_dict = my_consortium.to_dict_journals()
+        my_saved_scenario_dict = my_consortium.to_dict_journals(stream_journals=True)
     else:
         my_saved_scenario = get_saved_scenario(scenario_id, required_permission=Permission.view())
-        my_saved_scenario_dict = my_saved_scenario.to_dict_journals()
+        my_saved_scenario_dict = my_saved_scenario.to_dict_journals(stream_journals=True)
 
-    response = jsonify_fast_no_sort(my_saved_scenario_dict)
-    return response
+    return jsonify_streaming(my_saved_scenario_dict, "journals")
 
 
 @app.route("/scenario/<scenario_id>/member-institutions", methods=["GET"])
@@ -1310,7 +1403,7 @@ def scenario_member_institutions_get(scenario_id):
     for row in consortium_ids:
         if scenario_id == row["scenario_id"]:
             my_consortia = Consortium(scenario_id)
-            return jsonify_fast_no_sort({"institutions": my_consortia.to_dict_institutions()})
+            return jsonify_streaming({"institutions": my_consortia.to_dict_institutions()}, "institutions")
     return abort_json(404, "not a consortium scenario_id")
 
 
@@ -1321,7 +1414,7 @@ def package_member_institutions_get(package_id):
     for row in consortium_ids:
         if package_id == row["package_id"]:
             my_consortia = Consortium(scenario_id=None, package_id=package_id)
-            return jsonify_fast_no_sort({"institutions": my_consortia.to_dict_institutions()})
+            return jsonify_streaming({"institutions": my_consortia.to_dict_institutions()}, "institutions")
     return abort_json(404, "not a consortium package_id")
 
 